@@ -22,6 +22,7 @@ from .expression import Scalar, Variable, InputTensor, OutputTensor, PositionTen
 from .expression import position_in
 from .expression import output, output_like
 from .expression import zeros, ones
+from .expression import atomic_add
 
 # @ Scalar functions
 # @@ Utility
@@ -32,13 +33,19 @@ from .expression import exp, log, log10, sqrt
 from .expression import ceil, absolute, floor
 # @@ Binary math
 from .expression import minimum, maximum, power, arctan2, logical_and, logical_or, logical_not
+from .expression import where
 
 # @ Control flow
 from .expression import arange
 from .expression import if_, elif_, else_
+from .expression import while_, break_, continue_
 
 # @ Operator
 from .operator import Operator
 
+# @ Reductions
+from .reduction import Reduction
+from .reduction import reduce_sum, reduce_max, reduce_min, reduce_argmax, reduce_argmin
+
 # @ Localization info
 from .local import version, cuda_enabled, cache_directory
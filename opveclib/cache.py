@@ -0,0 +1,353 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive, process-wide lock associated with a path in the operator cache for the duration of a
+    ``with`` block. Other processes that try to lock the same path block until the lock is released.
+
+    :param path: the path to lock
+    """
+    lock_path = path + '.lock'
+    while True:
+        lock_file = open(lock_path, 'a')
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        # the lock file may have been removed by cache eviction while we were waiting, in which case the lock we
+        # hold no longer excludes anyone and we have to lock the new file instead
+        try:
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                break
+        except OSError:
+            pass
+        lock_file.close()
+
+    try:
+        yield
+    finally:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _remove_locked(path):
+    # remove a cached file and its lock file while holding the lock, so that no build of the file is in progress
+    with file_lock(path):
+        if os.path.exists(path):
+            os.remove(path)
+        os.remove(path + '.lock')
+
+
+def build_once(path, build):
+    """
+    Build a file in the operator cache if it does not exist yet. Concurrent processes that need the same file wait
+    for the first one to finish building it instead of building it again. The build function writes to a temporary
+    path in the same directory, which is atomically renamed to the final path on success, so no process ever sees
+    a partially written file.
+
+    :param path: the final path of the file
+    :param build: function which is called with the temporary path it must write to
+    :return: the final path
+    """
+    if os.path.exists(path):
+        return path
+
+    with file_lock(path):
+        # another process may have finished building while we were waiting for the lock
+        if not os.path.exists(path):
+            directory, name = os.path.split(path)
+            handle, tmp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix=os.path.splitext(name)[1],
+                                                dir=directory)
+            os.close(handle)
+            try:
+                build(tmp_path)
+                os.rename(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    return path
+
+
+def build_in_directory_once(path, build):
+    """
+    Like build_once, for tools such as protoc which choose the names of the files they write themselves. The build
+    function writes into a temporary directory, and the file with the same name as the final path is then moved
+    into place.
+
+    :param path: the final path of the file
+    :param build: function which is called with the temporary directory it must write to
+    :return: the final path
+    """
+    def build_file(tmp_path):
+        directory, name = os.path.split(path)
+        tmp_directory = tempfile.mkdtemp(prefix='.' + name + '.', dir=directory)
+        try:
+            build(tmp_directory)
+            os.rename(os.path.join(tmp_directory, name), tmp_path)
+        finally:
+            shutil.rmtree(tmp_directory)
+
+    return build_once(path, build_file)
+
+
+# files built for an operator are named by the operator hash followed by an underscore
+_operator_file = re.compile(r'^(f[0-9a-f]{56})_')
+
+
+class Manifest(object):
+    """
+    Index of the operator cache which maps each operator hash to the files built for it, their total size, the
+    time they were last used and the build profiles they were built with. The index is shared by all processes that
+    use the cache and is stored in the cache directory as a JSON snapshot and a log of the records and uses since the
+    snapshot was written, which are appended one JSON object per line under a file lock. Only the running total size
+    of the cache is read back when an operator is recorded, so recording and using operators does not depend on the
+    size of the cache.
+
+    The log is compacted into the snapshot when it grows too large or when the total size exceeds the size limit, in
+    which case the least recently used operators are evicted until the cache fits into the limit with some room to
+    spare. Compaction also indexes operator files which are in the cache directory but not in the manifest, such as
+    those built before the manifest existed, so that they can be evicted and removed as well. It is the only
+    operation which scans the cache directory, and runs when the manifest is first used in a cache directory.
+
+    :param directory: the cache directory
+    :param size_limit: maximum size of the cache in bytes, 0 for no limit
+    :param touch_interval: minimum number of seconds between two updates of the last used time of an operator
+        by the same process
+    :param log_size_limit: size of the log in bytes above which it is compacted into the snapshot
+    """
+    # fraction of the size limit the cache is reduced to by eviction, so that it is not compacted on every record
+    # once it is full
+    evict_to = 0.9
+
+    def __init__(self, directory, size_limit=0, touch_interval=60, log_size_limit=2**16):
+        self.path = os.path.join(directory, 'manifest.json')
+        self.log_path = os.path.join(directory, 'manifest.log')
+        self.size_path = os.path.join(directory, 'manifest.size')
+        self.directory = directory
+        self.size_limit = size_limit
+        self.touch_interval = touch_interval
+        self.log_size_limit = log_size_limit
+        self._touched = {}
+
+    def _read(self):
+        # read the snapshot and replay the log onto it
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            # a missing or unreadable snapshot is treated as empty, its files are indexed again by compaction
+            entries = {}
+
+        try:
+            with open(self.log_path) as f:
+                lines = f.readlines()
+        except IOError:
+            lines = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a record which was cut short by a crash is skipped
+                continue
+            name = record['name']
+            if record.get('removed', False):
+                entries.pop(name, None)
+            elif 'files' in record:
+                entry = entries.setdefault(name, {'files': [], 'size': 0, 'last_used': record['time'],
+                                                  'profiles': []})
+                for filename in record['files']:
+                    if filename not in entry['files']:
+                        entry['files'].append(filename)
+                if record['profile'] is not None and record['profile'] not in entry['profiles']:
+                    entry['profiles'].append(record['profile'])
+                entry['last_used'] = max(entry['last_used'], record['time'])
+            elif name in entries:
+                entries[name]['last_used'] = max(entries[name]['last_used'], record['time'])
+        return entries
+
+    def _write(self, entries):
+        handle, tmp_path = tempfile.mkstemp(prefix='.manifest.', suffix='.json', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _append(self, record):
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def _read_size(self):
+        try:
+            with open(self.size_path) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def _write_size(self, size):
+        with open(self.size_path, 'w') as f:
+            f.write(str(size))
+
+    def _file_size(self, filename):
+        try:
+            return os.path.getsize(os.path.join(self.directory, filename))
+        except OSError:
+            return 0
+
+    def _compact(self, keep=None):
+        # merge the log into the snapshot, index operator files the manifest does not know about, recompute the
+        # sizes from the files which still exist and evict least recently used operators
+        entries = self._read()
+        indexed = set(filename for entry in entries.values() for filename in entry['files'])
+        for filename in os.listdir(self.directory):
+            match = _operator_file.match(filename)
+            if match is None or filename.endswith('.lock') or filename in indexed:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                last_used = os.path.getmtime(path)
+            except OSError:
+                continue
+            entry = entries.setdefault(match.group(1), {'files': [], 'size': 0, 'last_used': last_used,
+                                                        'profiles': []})
+            entry['files'].append(filename)
+
+        for entry in entries.values():
+            entry['files'] = [filename for filename in entry['files']
+                              if os.path.exists(os.path.join(self.directory, filename))]
+            entry['size'] = sum(self._file_size(filename) for filename in entry['files'])
+
+        total = sum(entry['size'] for entry in entries.values())
+        if 0 < self.size_limit < total:
+            for name in sorted(entries, key=lambda n: entries[n]['last_used']):
+                if total <= self.size_limit*self.evict_to:
+                    break
+                if name == keep:
+                    continue
+                entry = entries.pop(name)
+                self._remove_files(entry['files'])
+                self._touched.pop(name, None)
+                total -= entry['size']
+
+        self._write(entries)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._write_size(total)
+
+    def _remove_files(self, filenames):
+        for filename in filenames:
+            try:
+                _remove_locked(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+
+    def _files(self, name):
+        # the files of an operator which still exist, the lock must be held. A cache which has not been indexed yet,
+        # such as one from before the manifest existed, is compacted first so that its files are found.
+        if self._read_size() is None:
+            self._compact()
+        entry = self._read().get(name)
+        if entry is None:
+            return []
+        return [filename for filename in entry['files'] if os.path.exists(os.path.join(self.directory, filename))]
+
+    def files(self, name):
+        """
+        :param name: the operator hash
+        :return: the names of the files of the operator in the cache directory
+        """
+        with file_lock(self.path):
+            return self._files(name)
+
+    def entry(self, name):
+        """
+        :param name: the operator hash
+        :return: the manifest entry of the operator, or None if it has no files in the cache
+        """
+        with file_lock(self.path):
+            entry = self._read().get(name)
+        if entry is not None:
+            entry['size'] = sum(self._file_size(filename) for filename in entry['files'])
+        return entry
+
+    def record(self, name, paths, profile=None):
+        """
+        Add files built for an operator to the manifest and mark it as used, then evict least recently used
+        operators if the cache exceeds the size limit. The operator itself is never evicted.
+
+        :param name: the operator hash
+        :param paths: the paths of the files built for the operator
+        :param profile: the build profile the files were built with
+        """
+        now = time.time()
+        filenames = [os.path.basename(path) for path in paths]
+        with file_lock(self.path):
+            self._append({'name': name, 'files': filenames, 'profile': profile, 'time': now})
+
+            # files which are recorded again are counted twice, which compaction corrects
+            total = self._read_size()
+            if total is None:
+                self._compact(keep=name)
+            else:
+                total += sum(self._file_size(filename) for filename in filenames)
+                log_size = os.path.getsize(self.log_path)
+                if 0 < self.size_limit < total or log_size > self.log_size_limit:
+                    self._compact(keep=name)
+                else:
+                    self._write_size(total)
+        self._touched[name] = now
+
+    def touch(self, name):
+        """
+        Mark an operator as used. To avoid writing to the manifest on every evaluation, the last used time is only
+        updated if this process has not done so within the touch interval.
+
+        :param name: the operator hash
+        """
+        now = time.time()
+        if now - self._touched.get(name, 0) < self.touch_interval:
+            return
+        with file_lock(self.path):
+            self._append({'name': name, 'time': now})
+            if os.path.getsize(self.log_path) > self.log_size_limit:
+                self._compact()
+        self._touched[name] = now
+
+    def remove(self, name, filenames=None):
+        """
+        Remove all files of an operator from the cache.
+
+        :param name: the operator hash
+        :param filenames: the files of the operator as returned by files, which are looked up if None
+        :return: True if the operator had files in the cache
+        """
+        with file_lock(self.path):
+            if filenames is None:
+                filenames = self._files(name)
+            removed_size = sum(self._file_size(filename) for filename in filenames)
+            self._remove_files(filenames)
+            self._append({'name': name, 'removed': True, 'time': time.time()})
+            total = self._read_size()
+            if total is not None:
+                self._write_size(max(total - removed_size, 0))
+        self._touched.pop(name, None)
+        return len(filenames) > 0
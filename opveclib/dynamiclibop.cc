@@ -10,7 +10,7 @@
 
 // #include <cxxabi.h>
 #include "dynamiclibop.h"
-#include <dlfcn.h>
+#include "libraryregistry.h"
 #include <string>
 #include <memory>
 #include <typeinfo>
@@ -85,22 +85,27 @@ class DynamicLibLaunch<CPUDevice>  {
                      const int ) {
         LOG(INFO) << "*** Standalone DynamicLibLaunch on CPU *****";
 
-        // load the compiled op shared library
-        static_assert(sizeof(void *) == sizeof(void (*)(void)),
-                      "object pointer and function pointer sizes must equal");
-        void *handle = dlopen(cpu_lib_path.c_str(), RTLD_LAZY);
-        OP_REQUIRES(context, handle != nullptr,
+        // load the compiled op shared library, which is shared with all other
+        // kernels that use it and released when this launcher is destroyed
+        func_ = nullptr;
+        lib_path_ = cpu_lib_path;
+        acquired_ = LibraryRegistry::instance().acquire(lib_path_);
+        OP_REQUIRES(context, acquired_,
             errors::NotFound("Unable to find DynamicLib library "
                              + cpu_lib_path));
 
         // load the function and cast it from void* to a function pointer
-        void *f = dlsym(handle, cpu_func_name.c_str());
+        void *f = LibraryRegistry::instance().function(lib_path_, cpu_func_name);
         func_ = reinterpret_cast<FUNPTR>(f);
         OP_REQUIRES(context, func_ != nullptr,
             errors::NotFound("Unable to find DynamicLib function "
                              + cpu_func_name));
     }
 
+    ~DynamicLibLaunch() {
+        if (acquired_) LibraryRegistry::instance().release(lib_path_);
+    }
+
     void Run(OpKernelContext* context, const CPUDevice&,
              std::vector<std::shared_ptr<const InputParameter>> inputs,
              std::vector<std::shared_ptr<OutputParameter>> outputs) {
@@ -112,6 +117,8 @@ class DynamicLibLaunch<CPUDevice>  {
 
  private:
     FUNPTR func_;
+    string lib_path_;
+    bool acquired_;
 };
 
 #if GOOGLE_CUDA
@@ -130,16 +137,17 @@ class DynamicLibLaunch<GPUDevice>  {
                      const int cuda_threads_per_block) {
         LOG(INFO) << "*** Standalone DynamicLibLaunch on GPU *****";
 
-        // load the compiled op shared library
-        static_assert(sizeof(void *) == sizeof(void (*)(void)),
-                  "object pointer and function pointer sizes must equal");
-        void *handle = dlopen(gpu_lib_path.c_str(), RTLD_LAZY);
-        OP_REQUIRES(context, handle != nullptr,
+        // load the compiled op shared library, which is shared with all other
+        // kernels that use it and released when this launcher is destroyed
+        func_ = nullptr;
+        lib_path_ = gpu_lib_path;
+        acquired_ = LibraryRegistry::instance().acquire(lib_path_);
+        OP_REQUIRES(context, acquired_,
             errors::NotFound("Unable to find DynamicLib library "
                              + gpu_lib_path));
 
         // load the function and cast it from void* to a function pointer
-        void *f = dlsym(handle, gpu_func_name.c_str());
+        void *f = LibraryRegistry::instance().function(lib_path_, gpu_func_name);
         func_ = reinterpret_cast<FUNPTR>(f);
         OP_REQUIRES(context, func_ != nullptr,
             errors::NotFound("Unable to find DynamicLib function "
@@ -148,6 +156,10 @@ class DynamicLibLaunch<GPUDevice>  {
         cuda_threads_per_block_ = cuda_threads_per_block;
     }
 
+    ~DynamicLibLaunch() {
+        if (acquired_) LibraryRegistry::instance().release(lib_path_);
+    }
+
     void Run(OpKernelContext* context, const GPUDevice& d,
              std::vector<std::shared_ptr<const InputParameter>> inputs,
              std::vector<std::shared_ptr<OutputParameter>> outputs) {
@@ -161,6 +173,8 @@ class DynamicLibLaunch<GPUDevice>  {
 
  private:
     FUNPTR func_;
+    string lib_path_;
+    bool acquired_;
     int cuda_threads_per_block_;
 };
 #endif  // GOOGLE_CUDA
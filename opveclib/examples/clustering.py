@@ -52,39 +52,36 @@ class KMeansMinDistOp(ops.Operator):
 
         return minIndex
 
-class KMeansNewCenOp(ops.Operator):
-    """Computation of new cluster centers for kMeans.
+class KMeansCenterSumOp(ops.Operator):
+    """Sums of the data assigned to each cluster center for kMeans.
 
-    Use the assignment index of closest data points for a cluster center and recomputes the cluster centers
-    as the centroid of that assigned data.
+    Each data point adds itself to the sum of the cluster center it is assigned to, and counts itself for that
+    center. The new cluster centers are the centroids of that assigned data, the sums divided by the counts.
     """
     def op(self, data, minIndex, nCenter):
         """The definition of the operator function.
 
-        Thread pool over nCenter. That should be fine for most cases.
+        Thread pool over nData, with the data scattered to the sums by atomic additions.
 
         :param data: 2D matrix as data input with dimensions: nDim x nData.
         :type data: numpy array.
         :param minIndex: 1D matrix of assignemnts of data points to cluster centers: nData x 1.
         :type minIndex: numpy array.
-        :return 2D matrix with computed cluster centers with dimensions> nDim x nCenter.
+        :return 2D matrix with the sums of the assigned data with dimensions: nDim x nCenter, and 1D matrix with the
+            number of assigned data points: nCenter x 1.
         """
         nDim    = data.shape[0]
         nData   = data.shape[1]
         assert nData==minIndex.shape[0], "Data has %d values and minDist has %d values, but these must match!" % (nData, minIndex.shape[0])
-        iCenter = ops.position_in(nCenter)[0]
-        center  = ops.zeros([nDim,nCenter], data.dtype)
-        count   = ops.variable(0, data.dtype)
-        for iSample in ops.arange(nData):
-            with ops.if_(iCenter==ops.cast(minIndex[iSample], ops.uint32)):
-                count <<= count + 1
-                for iDim in ops.arange(nDim):
-                    center[iDim,iCenter] = center[iDim,iCenter] + data[iDim,iSample]
-
-        newCenter = ops.output([nDim,nCenter],data.dtype)
+        iSample = ops.position_in(nData)[0]
+        iCenter = ops.variable(ops.cast(minIndex[iSample], ops.uint32), ops.uint32)
+        centerSum = ops.output([nDim,nCenter], data.dtype)
+        count = ops.output(nCenter, data.dtype)
+        ops.atomic_add(count, iCenter, 1)
         for iDim in ops.arange(nDim):
-            newCenter[iDim,iCenter] = center[iDim,iCenter]/count
-        return newCenter
+            ops.atomic_add(centerSum, [iDim,iCenter], data[iDim,iSample])
+
+        return centerSum, count
 
 def condForWhile(iter, nMaxIter, rms, th, data, center):
     return tf.logical_and(tf.less(iter, nMaxIter), tf.less(th, rms))
@@ -92,7 +89,8 @@ def condForWhile(iter, nMaxIter, rms, th, data, center):
 def bodyForWhile(iter, nMaxIter, rms, th, data, center):
     oldCenter = center
     minIndex = KMeansMinDistOp(data, center).as_tensorflow()
-    center = KMeansNewCenOp(data, minIndex, nCenter=int(center.get_shape()[1])).as_tensorflow()
+    centerSum, count = KMeansCenterSumOp(data, minIndex, nCenter=int(center.get_shape()[1])).as_tensorflow()
+    center = centerSum/count
     rms = tf.reduce_sum(tf.sqrt(tf.reduce_sum((center-oldCenter)*(center-oldCenter), 0)), 0)
     return [iter+1, nMaxIter, rms, th, data, center]
 
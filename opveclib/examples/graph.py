@@ -63,33 +63,25 @@ class GraphTriangleCountOp(ops.Operator):
         iToEdgeEnd      = ops.variable(startEdge[iToVertex+1], startEdge.dtype)
         iiToVertex      = ops.variable(toVertex[iToEdge], toVertex.dtype)
 
-        nMerge          = iToEdgeEnd-iToEdge + iFromEdgeEnd-iFromEdge # Maximum number of merges.
+        # Merge the sorted lists of neighbors until one of them is exhausted.
+        doMerge = ops.logical_and(iFromEdge < iFromEdgeEnd, iToEdge < iToEdgeEnd)
+        doMerge = ops.logical_and(doMerge, iiFromVertex < iToVertex)
+        with ops.while_(doMerge):
+            with ops.if_(iiFromVertex < iiToVertex):
+                iFromEdge <<= iFromEdge+1
+                iiFromVertex <<= toVertex[iFromEdge]
+
+            with ops.elif_(iiFromVertex > iiToVertex):
+                iToEdge <<= iToEdge+1
+                iiToVertex <<= toVertex[iToEdge]
+
+            with ops.else_():
+                nTriangle <<= nTriangle+1
+                iFromEdge <<= iFromEdge+1
+                iToEdge <<= iToEdge+1
+                iiFromVertex <<= toVertex[iFromEdge]
+                iiToVertex <<= toVertex[iToEdge]
 
-        # This construction is a work-around for simulating the function of a while loop.
-        #TODO(raudies@hpe.com): Replace this construct by a while loop once it is available in ovl.
-        for iMerge in ops.arange(nMerge):
-            doMerge = ops.logical_and(iFromEdge < iFromEdgeEnd, iToEdge < iToEdgeEnd)
-            doMerge = ops.logical_and(doMerge, iiFromVertex < iToVertex)
-
-            with ops.if_(doMerge):
-
-                with ops.if_(iiFromVertex < iiToVertex):
-                    iFromEdge <<= iFromEdge+1
-                    iiFromVertex <<= toVertex[iFromEdge]
-
-                with ops.elif_(iiFromVertex > iiToVertex):
-                    iToEdge <<= iToEdge+1
-                    iiToVertex <<= toVertex[iToEdge]
-
-                with ops.else_():
-                    nTriangle <<= nTriangle+1
-                    iFromEdge <<= iFromEdge+1
-                    iToEdge <<= iToEdge+1
-                    iiFromVertex <<= toVertex[iFromEdge]
-                    iiToVertex <<= toVertex[iToEdge]
-
-
-        #TODO(raudies@hpe.com): Use a reduction function that computes a partial or complete sum.
         count[iEdge] = nTriangle # Save the triangles for each edge.
 
         return count
@@ -108,7 +100,7 @@ def countTrianglesCPU(startEdge, fromVertex, toVertex):
     :return Triangle count of graph.
     """
     count = GraphTriangleCountOp(startEdge, fromVertex, toVertex).evaluate_c()
-    return np.sum(count, axis=0, dtype=np.uint64)
+    return ops.reduce_sum(count).evaluate_c()[0]
 
 def countTrianglesGPU(startEdge, fromVertex, toVertex):
     """Count the triangles on the GPU.
@@ -124,7 +116,7 @@ def countTrianglesGPU(startEdge, fromVertex, toVertex):
     :return Triangle count of graph.
     """
     count = GraphTriangleCountOp(startEdge, fromVertex, toVertex).evaluate_cuda()
-    return np.sum(count, axis=0, dtype=np.uint64)
+    return ops.reduce_sum(count).evaluate_cuda()[0]
 
 def countTrianglesNp(startEdge, fromVertex, toVertex):
     """Count the triangles using python.
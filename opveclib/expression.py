@@ -11,6 +11,8 @@
 
 from __future__ import absolute_import
 import ctypes
+import errno
+import importlib
 import string
 import re
 import os
@@ -19,27 +21,40 @@ import sys
 import six
 
 import numpy as np
-from tensorflow import logging
 
 # lazily compile the language proto to python library
-from .local import cache_directory
+from .local import cache_directory, logging
+from .cache import build_in_directory_once
+
+# create the cache directory if it does not exist before it is added to the path, otherwise the import system caches
+# that the directory has no modules and does not find the language module once it has been built
+if not os.path.isdir(cache_directory):
+    try:
+        os.makedirs(cache_directory)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
 sys.path.append(cache_directory)
 try:
     import language_pb2 as lang
 except ImportError:
-    this_file_path = os.path.abspath(__file__)
-    this_directory = os.path.split(this_file_path)[0]
-    proto_path = os.path.join(this_directory, 'language.proto')
-    try:
-        subprocess.check_output(['protoc', proto_path,
-                                 '--proto_path='+this_directory,
-                                 '--python_out='+cache_directory],
-                                stderr=subprocess.STDOUT,
-                                universal_newlines=True)
-    except subprocess.CalledProcessError as exception:
-        logging.log(logging.ERROR, 'protoc error: ' + exception.output)
-        raise
-
+    def _build_language_pb2(tmp_directory):
+        this_file_path = os.path.abspath(__file__)
+        this_directory = os.path.split(this_file_path)[0]
+        proto_path = os.path.join(this_directory, 'language.proto')
+        try:
+            subprocess.check_output(['protoc', proto_path,
+                                     '--proto_path='+this_directory,
+                                     '--python_out='+tmp_directory],
+                                    stderr=subprocess.STDOUT,
+                                    universal_newlines=True)
+        except subprocess.CalledProcessError as exception:
+            logging.log(logging.ERROR, 'protoc error: ' + exception.output)
+            raise
+
+    build_in_directory_once(os.path.join(cache_directory, 'language_pb2.py'), _build_language_pb2)
+    if hasattr(importlib, 'invalidate_caches'):
+        importlib.invalidate_caches()
     import language_pb2 as lang
 
 
@@ -250,6 +265,10 @@ class TensorType(object):
         return tt
 
 
+def _strip_margin(s):
+    return re.sub('\n[ \t]*\|', '\n', s)
+
+
 def _list_to_str(x):
     out = ''
     for i, cur in enumerate(x):
@@ -294,7 +313,7 @@ class ExpressionDAG(object):
 
         if type(item) is PositionTensor:
             if ExpressionDAG.workgroup_shape is None:
-                ExpressionDAG.workgroup_shape = item.proto_expr.uint32_data
+                ExpressionDAG.workgroup_shape = item.workgroup_shape
             else:
                 raise ValueError('Already defined the position tensor.')
 
@@ -411,6 +430,7 @@ class ExpressionDAG(object):
 
                     # perform the reordering
                     new_dag = lang.ExpressionDAG()
+                    new_dag.workgroup_shape.extend(proto.workgroup_shape)
                     num_expressions = len(proto.expressions)
                     for cur_index in range(num_expressions):
                         # copy expressions from old spot to new spot
@@ -451,6 +471,7 @@ class ExpressionDAG(object):
             lang.TENSOR: LocalTensor,
             lang.ASSIGN_VARIABLE: _AssignVariable,
             lang.ASSIGN_TENSOR: _AssignTensor,
+            lang.ATOMIC_ADD: _AtomicAdd,
             lang.READ_TENSOR: _ReadTensor,
             lang.RANGE: _Range,
             lang.ENDRANGE: _EndRange,
@@ -458,6 +479,10 @@ class ExpressionDAG(object):
             lang.ELSEIF: _ElseIf,
             lang.ELSE: _Else,
             lang.ENDIF: _EndIf,
+            lang.WHILE: _While,
+            lang.ENDWHILE: _EndWhile,
+            lang.BREAK: _Break,
+            lang.CONTINUE: _Continue,
             lang.ACOS: _UnaryMath,
             lang.ASIN: _UnaryMath,
             lang.ATAN: _UnaryMath,
@@ -492,7 +517,8 @@ class ExpressionDAG(object):
             lang.MIN: _BinaryMath,
             lang.MAX: _BinaryMath,
             lang.POW: _BinaryMath,
-            lang.ATAN2: _BinaryMath
+            lang.ATAN2: _BinaryMath,
+            lang.WHERE: _Where
         }
 
         ExpressionDAG.clear()
@@ -506,17 +532,11 @@ class ExpressionDAG(object):
             code_to_class[expr.code].from_proto(expr, input_exprs)
 
     @staticmethod
-    def generate(expression_dag, function_name):
-        """
-        Generate C and CUDA code for evaluating the operation defined in the supplied serialized expression dag
-        protocol buffer.
-        :param expression_dag: The protobuf
-        :param function_name: The name of the function to use
-        :return: a tuple containing the source for: the individual c function, individual cuda function, the
-          standalone cuda function launcher, the generic c++ interface, and the generic cuda interface
-        """
-        def _strip_margin(s):
-            return re.sub('\n[ \t]*\|', '\n', s)
+    def _parse(expression_dag, nested_position=False):
+        # rebuild the expression dag from its protobuf and collect the parts of the generated code which all backends
+        # share: the expression source of a single worker and the unpacking of the generic io parameters. A nested
+        # position is maintained by the loops of the backend over the dimensions of a multi-dimensional workgroup,
+        # rather than decomposed from the worker index.
         ExpressionDAG.from_proto(expression_dag)
 
         inputs = list()
@@ -533,13 +553,24 @@ class ExpressionDAG(object):
         num_inputs = len(inputs)
         num_outputs = len(outputs)
 
+        position.nested = nested_position
+
+        # only decompose the worker index into the position dimensions which are read
+        position.used_dims = set()
+        for expr in ExpressionDAG.exprs:
+            if type(expr) is _ReadTensor and expr.input_exprs[0] is position:
+                if type(expr.input_exprs[1]) is _ConstScalar:
+                    position.used_dims.add(expr.input_exprs[1].value())
+                else:
+                    position.used_dims = None
+                    break
+
         args = list()
         for arg in inputs + outputs:
             args.append(arg.gen_ptr())
 
         args_str = _list_to_str(args)
-        workgroup_shape = position.proto_expr.uint32_data
-        workgroup_block_size = [1]
+        workgroup_shape = position.workgroup_shape
         num_workers = 1
         for cur_dim in workgroup_shape:
             num_workers *= cur_dim
@@ -553,7 +584,142 @@ class ExpressionDAG(object):
             if cur_c != '':
                 expression_src += '        ' + cur_c
 
+        # Generate the c generic parameter interface for unpacking polymorphic io parameters
+        generic_args = []
+        io_ptrs = ''
+        for inp in inputs:
+            cur_index = inp.proto_expr.io_index
+            cur_name = 'in'+str(cur_index)
+            generic_args.append(cur_name + '.p_fixed_len')
+            elements = inp.size
+            tipe = inp.dtype.as_cstr()
+
+            io_ptrs += string.Template("""
+                |    if(inputs[${cur_index}]->length() != ${elements}) return 1;
+                |    union u_in${cur_index}{
+                |       const ${tipe} *p_arb_len;
+                |       const ${tipe} (*p_fixed_len)[${elements}];
+                |    };
+                |    union u_in${cur_index} in${cur_index};
+                |    in${cur_index}.p_arb_len = inputs[${cur_index}]->get<${tipe}>();
+                |""").substitute(locals())
+
+        for outp in outputs:
+            cur_index = outp.proto_expr.io_index
+            cur_name = 'out'+str(cur_index)
+            generic_args.append(cur_name + '.p_fixed_len')
+            elements = outp.size
+            tipe = outp.dtype.as_cstr()
+
+            io_ptrs += string.Template("""
+                |    if(outputs[${cur_index}]->length() != ${elements}) return 1;
+                |    union u_out${cur_index}{
+                |       ${tipe} *p_arb_len;
+                |       ${tipe} (*p_fixed_len)[${elements}];
+                |    };
+                |    union u_out${cur_index} out${cur_index};
+                |    out${cur_index}.p_arb_len = outputs[${cur_index}]->get<${tipe}>();
+                |""").substitute(locals())
+
+        args = _list_to_str(generic_args)
+
+        return inputs, outputs, num_inputs, num_outputs, args_str, num_workers, expression_src, io_ptrs, args
+
+    @staticmethod
+    def generate_c(expression_dag, function_name, cpu_threads=1):
+        """
+        Generate C code for evaluating the operation defined in the supplied serialized expression dag protocol buffer.
+        :param expression_dag: The protobuf
+        :param function_name: The name of the function to use
+        :param cpu_threads: The number of threads the generic c++ interface splits the workgroup across. 1 generates
+          a serial loop, 0 uses all cores available at run time.
+        :return: a tuple containing the source for: the individual c function and the generic c++ interface
+        """
+        inputs, outputs, num_inputs, num_outputs, args_str, num_workers, expression_src, io_ptrs, args = \
+            ExpressionDAG._parse(expression_dag, nested_position=len(expression_dag.workgroup_shape) > 1)
+
         # generate c function
+        # a parallel c function only covers the range of workers it is handed by the generic interface
+        worker_type = _worker_index_type(num_workers).as_cstr()
+        if cpu_threads == 1:
+            c_params = args_str
+            c_worker_begin = '0'
+            c_worker_end = str(num_workers)
+        else:
+            c_params = args_str + ', ' + worker_type + ' worker_begin, ' + worker_type + ' worker_end'
+            c_worker_begin = 'worker_begin'
+            c_worker_end = 'worker_end'
+
+        # the loop over the innermost dimension of the workgroup is vectorized when its workers are independent
+        vectorize = _independent_workers(ExpressionDAG.exprs)
+
+        # atomic additions are only needed when the workers are split across threads. Integers are added by the
+        # atomic builtin, floating point values by a compare and swap loop.
+        accumulated = _accumulated_outputs(ExpressionDAG.exprs)
+        if len(accumulated) == 0:
+            c_atomic_add = ''
+        elif cpu_threads == 1:
+            c_atomic_add = """
+            |//additions to outputs which are accumulated, by a single thread
+            |template<typename T> inline void atomic_add(T *address, T value){ *address += value; }
+            |"""
+        else:
+            c_atomic_add = """
+            |//atomic additions to outputs which are accumulated by several threads concurrently
+            |template<typename T> inline void atomic_add(T *address, T value){
+            |    __atomic_fetch_add(address, value, __ATOMIC_RELAXED);
+            |}
+            |template<typename T> inline void atomic_add_float(T *address, T value){
+            |    T expected;
+            |    __atomic_load(address, &expected, __ATOMIC_RELAXED);
+            |    T desired = expected + value;
+            |    while(!__atomic_compare_exchange(address, &expected, &desired, true, __ATOMIC_RELAXED, __ATOMIC_RELAXED)){
+            |        desired = expected + value;
+            |    }
+            |}
+            |inline void atomic_add(float *address, float value){ atomic_add_float(address, value); }
+            |inline void atomic_add(double *address, double value){ atomic_add_float(address, value); }
+            |"""
+        c_atomic_add = _strip_margin(c_atomic_add)
+
+        c_zero_outputs = ''
+        for outp in accumulated:
+            cur_index = outp.proto_expr.io_index
+            elements = outp.size
+            tipe = outp.dtype.as_cstr()
+            c_zero_outputs += string.Template("""
+                |    memset(out${cur_index}.p_arb_len, 0, ${elements}*sizeof(${tipe}));""").substitute(locals())
+        if c_zero_outputs != '':
+            c_zero_outputs = '\n|    //initialize the accumulated outputs with zeros' + c_zero_outputs + '\n|'
+
+        workgroup_shape = list(expression_dag.workgroup_shape)
+        if len(workgroup_shape) == 1:
+            c_simd = '\n|    #pragma omp simd' if vectorize else ''
+            c_loop_begin = string.Template("""${c_simd}
+            |    for(${worker_type} worker_index=${c_worker_begin}; worker_index < ${c_worker_end}; worker_index++){""")
+            c_loop_end = """
+            |    }"""
+        else:
+            # the workers of a multi-dimensional workgroup are covered row by row with a loop over the innermost
+            # dimension, so the worker index is only divided into the outer dimensions of the position once per row
+            inner_dim = workgroup_shape[-1]
+            row_position = _row_position_c(workgroup_shape, worker_type, '        ', assume_bounds=cpu_threads != 1)
+            c_simd = '\n|        #pragma omp simd' if vectorize else ''
+            c_loop_begin = string.Template("""
+            |    for(${worker_type} worker_index=${c_worker_begin}; worker_index < ${c_worker_end}; ){
+            |        const ${worker_type} worker_row = worker_index / ${inner_dim};${row_position}
+            |        const ${worker_type} worker_inner_begin = worker_index % ${inner_dim};
+            |        const ${worker_type} worker_inner_end = ${c_worker_end} - worker_index < ${inner_dim} - worker_inner_begin ? worker_inner_begin + (${c_worker_end} - worker_index) : ${inner_dim};${c_simd}
+            |        for(${worker_type} worker_inner=worker_inner_begin; worker_inner < worker_inner_end; worker_inner++){""")
+            c_loop_end = """
+            |        }
+            |        worker_index += worker_inner_end - worker_inner_begin;
+            |    }"""
+        c_loop_begin = _strip_margin(c_loop_begin.substitute(locals()))[1:]
+        c_loop_end = _strip_margin(c_loop_end)[1:]
+        c_workers_begin = _c_workers_begin
+        c_workers_end = _c_workers_end
+
         c_src = """
         |//Generated Code
         |#include <stdint.h>
@@ -566,18 +732,150 @@ class ExpressionDAG(object):
         |// code generation infrastructure.
         |#define abs_8(x) abs(x);
         |#define abs_16(x) abs(x);
-        |
-        |uint16_t ${function_name}(${args_str}){
-        |    for(uint32_t worker_index=0; worker_index < ${num_workers}; worker_index++){
+        |${c_atomic_add}
+        |uint16_t ${function_name}(${c_params}){
+        |    ${c_workers_begin}
+        |${c_loop_begin}
         |${expression_src}
-        |    }
+        |${c_loop_end}
+        |    ${c_workers_end}
         |    return 0;
         |}
         |"""
         c_src = string.Template(c_src).substitute(locals())
         c_src = _strip_margin(c_src)
 
+        if cpu_threads == 1:
+            c_launch = string.Template("""
+            |    return ${function_name}(${args});""").substitute(locals())
+        else:
+            # split the workgroup into contiguous chunks of workers, one per thread. The calling thread
+            # evaluates the first chunk itself.
+            c_launch = string.Template("""
+            |    ${worker_type} num_threads = ${cpu_threads};
+            |    if(num_threads == 0) num_threads = std::thread::hardware_concurrency();
+            |    if(num_threads == 0) num_threads = 1;
+            |    if(num_threads > ${num_workers}) num_threads = ${num_workers};
+            |    const ${worker_type} chunk_size = (${num_workers} + num_threads - 1) / num_threads;
+            |
+            |    std::vector<uint16_t> errors(num_threads, 0);
+            |    std::vector<std::thread> threads;
+            |    threads.reserve(num_threads - 1);
+            |    for(uint32_t thread_index = 1; thread_index < num_threads; thread_index++){
+            |        const ${worker_type} worker_begin = thread_index*chunk_size;
+            |        const ${worker_type} worker_end = worker_begin + chunk_size < ${num_workers} ? worker_begin + chunk_size : ${num_workers};
+            |        threads.emplace_back([&, thread_index, worker_begin, worker_end](){
+            |            errors[thread_index] = ${function_name}(${args}, worker_begin, worker_end);
+            |        });
+            |    }
+            |    errors[0] = ${function_name}(${args}, 0, chunk_size < ${num_workers} ? chunk_size : ${num_workers});
+            |
+            |    uint16_t err = 0;
+            |    for(uint32_t thread_index = 0; thread_index < num_threads; thread_index++){
+            |        if(thread_index > 0) threads[thread_index - 1].join();
+            |        if(errors[thread_index] != 0) err = errors[thread_index];
+            |    }
+            |    return err;""").substitute(locals())
+
+        c_generic = """
+        |#include "dynamiclibop.h"
+        |#include <vector>
+        |#include <memory>
+        |#include <thread>
+        |#include <string.h>
+        |
+        |${c_src}
+        |
+        |extern "C"
+        |uint16_t ${function_name}_generic_cpp(std::vector<std::shared_ptr<const InputParameter>> inputs, std::vector<std::shared_ptr<OutputParameter>> outputs){
+        |    //check that the number of inputs and outputs is correct
+        |    if(inputs.size() != ${num_inputs}){ return 1; }
+        |    if(outputs.size() != ${num_outputs}){ return 1; }
+        |
+        |    //check that the size of inputs and outputs is correct, and cast them as pointers to arrays
+        ${io_ptrs}${c_zero_outputs}
+        ${c_launch}
+        |}
+        |"""
+        c_generic = string.Template(c_generic).substitute(locals())
+        c_generic = _strip_margin(c_generic)
+
+        return c_src, c_generic
+
+    @staticmethod
+    def generate_cuda(expression_dag, function_name, elements_per_worker=1):
+        """
+        Generate CUDA code for evaluating the operation defined in the supplied serialized expression dag protocol
+        buffer.
+        :param expression_dag: The protobuf
+        :param function_name: The name of the function to use
+        :param elements_per_worker: The number of consecutive positions of the innermost workgroup dimension which
+          each cuda thread covers. The last thread of each row covers the remaining positions.
+        :return: a tuple containing the source for: the individual cuda function, the standalone cuda function
+          launcher, and the generic cuda interface
+        """
+        workgroup_shape = list(expression_dag.workgroup_shape)
+        elements_per_worker = min(elements_per_worker, workgroup_shape[-1])
+        inputs, outputs, num_inputs, num_outputs, args_str, num_workers, expression_src, io_ptrs, args = \
+            ExpressionDAG._parse(expression_dag, nested_position=elements_per_worker > 1)
+
         # Generate cuda function
+        worker_type = _worker_index_type(num_workers).as_cstr()
+        if elements_per_worker == 1:
+            num_kernel_workers = num_workers
+            kernel_body = expression_src
+        else:
+            # each thread covers a chunk of consecutive positions of a row of the workgroup with a loop over the
+            # innermost dimension, so the row is only decomposed into the outer dimensions of the position once
+            inner_dim = workgroup_shape[-1]
+            chunks_per_row = (inner_dim + elements_per_worker - 1) // elements_per_worker
+            num_kernel_workers = num_workers // inner_dim * chunks_per_row
+            row_position = _row_position_c(workgroup_shape, worker_type, '        ')
+            kernel_body = _strip_margin(string.Template("""
+            |        const ${worker_type} worker_row = worker_index / ${chunks_per_row};${row_position}
+            |        const ${worker_type} worker_inner_begin = (worker_index % ${chunks_per_row})*${elements_per_worker};
+            |        const ${worker_type} worker_inner_end = ${inner_dim} - worker_inner_begin < ${elements_per_worker} ? ${inner_dim} : worker_inner_begin + ${elements_per_worker};
+            |        for(${worker_type} worker_inner=worker_inner_begin; worker_inner < worker_inner_end; worker_inner++){
+            |${expression_src}
+            |        }
+            |""").substitute(locals()))[1:]
+        # atomic additions of 64 bit integers reinterpret them as the unsigned long long which atomicAdd takes, doubles
+        # are added by a compare and swap loop
+        accumulated = _accumulated_outputs(ExpressionDAG.exprs)
+        if len(accumulated) == 0:
+            cuda_atomic_add = ''
+        else:
+            cuda_atomic_add = _strip_margin("""
+            |//atomic additions to outputs which are accumulated by several threads concurrently
+            |inline __device__ void atomic_add(int32_t *address, int32_t value){ atomicAdd((int *)address, (int)value); }
+            |inline __device__ void atomic_add(uint32_t *address, uint32_t value){ atomicAdd((unsigned int *)address, (unsigned int)value); }
+            |inline __device__ void atomic_add(int64_t *address, int64_t value){ atomicAdd((unsigned long long *)address, (unsigned long long)value); }
+            |inline __device__ void atomic_add(uint64_t *address, uint64_t value){ atomicAdd((unsigned long long *)address, (unsigned long long)value); }
+            |inline __device__ void atomic_add(float *address, float value){ atomicAdd(address, value); }
+            |inline __device__ void atomic_add(double *address, double value){
+            |    unsigned long long *address_as_ull = (unsigned long long *)address;
+            |    unsigned long long old = *address_as_ull, assumed;
+            |    do {
+            |        assumed = old;
+            |        old = atomicCAS(address_as_ull, assumed, __double_as_longlong(value + __longlong_as_double(assumed)));
+            |    } while (assumed != old);
+            |}
+            |""")
+
+        cuda_zero_outputs = ''
+        launch_zero_outputs = ''
+        for outp in accumulated:
+            cur_index = outp.proto_expr.io_index
+            elements = outp.size
+            tipe = outp.dtype.as_cstr()
+            cuda_zero_outputs += string.Template("""
+                |    if(cuMemsetD8Async((CUdeviceptr)out${cur_index}.p_arb_len, 0, ${elements}*sizeof(${tipe}), stream) != CUDA_SUCCESS) return 1;""").substitute(locals())
+            launch_zero_outputs += string.Template("""
+                |    CUDA_SAFE_CALL(cuMemsetD8(d_out${cur_index}, 0, out${cur_index}_size));""").substitute(locals())
+        if cuda_zero_outputs != '':
+            cuda_zero_outputs = '\n|    //initialize the accumulated outputs with zeros' + cuda_zero_outputs + '\n|'
+            launch_zero_outputs = '\n|    //initialize the accumulated outputs with zeros' + launch_zero_outputs + '\n|'
+
         # TODO: make sure that these typedefs are consistent at runtime?
         cuda_defs = _strip_margin(string.Template("""
         |typedef char int8_t;
@@ -596,12 +894,12 @@ class ExpressionDAG(object):
         |//define integer absolute value function
         |inline __device__ int8_t abs_8(const int8_t  & x){ return ( x<0 ) ? -x : x;}
         |inline __device__ int16_t abs_16(const int16_t  & x){ return ( x<0 ) ? -x : x;}
-        |
+        |${cuda_atomic_add}
         |extern \"C\" __global__
         |void ${function_name}(${args_str}){
-        |    uint32_t worker_index = blockIdx.x * blockDim.x + threadIdx.x;
-        |    if (worker_index < ${num_workers}) {
-        |${expression_src}
+        |    ${worker_type} worker_index = (${worker_type})blockIdx.x * blockDim.x + threadIdx.x;
+        |    if (worker_index < ${num_kernel_workers}) {
+        |${kernel_body}
         |    }
         |}
         """).substitute(locals()))
@@ -699,10 +997,10 @@ class ExpressionDAG(object):
         |    //allocate memory on and copy inputs to the device
         |    CUdeviceptr ${device_ptrs_string};
         |
-        ${allocate_and_copy}
+        ${allocate_and_copy}${launch_zero_outputs}
         |
-        |    uint32_t num_blocks = ${num_workers} / threads_per_block;
-        |    if(${num_workers} % threads_per_block > 0){ num_blocks += 1;}
+        |    uint32_t num_blocks = ${num_kernel_workers} / threads_per_block;
+        |    if(${num_kernel_workers} % threads_per_block > 0){ num_blocks += 1;}
         |
         |    void *args[] = {${device_args_string}};
         |    CUDA_SAFE_CALL(
@@ -725,65 +1023,6 @@ class ExpressionDAG(object):
         cuda_launch_template = string.Template(cuda_launch_template).substitute(locals())
         cuda_launch_template = _strip_margin(cuda_launch_template)
 
-        # Generate the c generic parameter interface for unpacking polymorphic io parameters
-        generic_args = []
-        io_ptrs = ''
-        for inp in inputs:
-            cur_index = inp.proto_expr.io_index
-            cur_name = 'in'+str(cur_index)
-            generic_args.append(cur_name + '.p_fixed_len')
-            elements = inp.size
-            tipe = inp.dtype.as_cstr()
-
-            io_ptrs += string.Template("""
-                |    if(inputs[${cur_index}]->length() != ${elements}) return 1;
-                |    union u_in${cur_index}{
-                |       const ${tipe} *p_arb_len;
-                |       const ${tipe} (*p_fixed_len)[${elements}];
-                |    };
-                |    union u_in${cur_index} in${cur_index};
-                |    in${cur_index}.p_arb_len = inputs[${cur_index}]->get<${tipe}>();
-                |""").substitute(locals())
-
-        for outp in outputs:
-            cur_index = outp.proto_expr.io_index
-            cur_name = 'out'+str(cur_index)
-            generic_args.append(cur_name + '.p_fixed_len')
-            elements = outp.size
-            tipe = outp.dtype.as_cstr()
-
-            io_ptrs += string.Template("""
-                |    if(outputs[${cur_index}]->length() != ${elements}) return 1;
-                |    union u_out${cur_index}{
-                |       ${tipe} *p_arb_len;
-                |       ${tipe} (*p_fixed_len)[${elements}];
-                |    };
-                |    union u_out${cur_index} out${cur_index};
-                |    out${cur_index}.p_arb_len = outputs[${cur_index}]->get<${tipe}>();
-                |""").substitute(locals())
-
-        args = _list_to_str(generic_args)
-        c_generic = """
-        |#include "dynamiclibop.h"
-        |#include <vector>
-        |#include <memory>
-        |
-        |${c_src}
-        |
-        |extern "C"
-        |uint16_t ${function_name}_generic_cpp(std::vector<std::shared_ptr<const InputParameter>> inputs, std::vector<std::shared_ptr<OutputParameter>> outputs){
-        |    //check that the number of inputs and outputs is correct
-        |    if(inputs.size() != ${num_inputs}){ return 1; }
-        |    if(outputs.size() != ${num_outputs}){ return 1; }
-        |
-        |    //check that the size of inputs and outputs is correct, and cast them as pointers to arrays
-        ${io_ptrs}
-        |    return ${function_name}(${args});
-        |}
-        |"""
-        c_generic = string.Template(c_generic).substitute(locals())
-        c_generic = _strip_margin(c_generic)
-
         cuda_generic = """
         |#include "dynamiclibop.h"
         |#include <vector>
@@ -800,10 +1039,10 @@ class ExpressionDAG(object):
         |    if(outputs.size() != ${num_outputs}){ return 1; }
         |
         |    //check that the size of inputs and outputs is correct, and cast them as pointers to arrays
-        ${io_ptrs}
+        ${io_ptrs}${cuda_zero_outputs}
         |    //enqueue function on stream
-        |    uint32_t num_blocks = ${num_workers} / threads_per_block;
-        |    if(${num_workers} % threads_per_block > 0) num_blocks += 1;
+        |    uint32_t num_blocks = ${num_kernel_workers} / threads_per_block;
+        |    if(${num_kernel_workers} % threads_per_block > 0) num_blocks += 1;
         |    ${function_name}<<<num_blocks, threads_per_block, 0, stream>>>(${args});
         |    return 0;
         |}
@@ -811,8 +1050,25 @@ class ExpressionDAG(object):
         cuda_generic = string.Template(cuda_generic).substitute(locals())
         cuda_generic = _strip_margin(cuda_generic)
 
-        # Generate the cuda generic parameter interface for unpacking polymorphic io parameters
+        return cuda_src, cuda_launch_template, cuda_generic
 
+    @staticmethod
+    def generate(expression_dag, function_name, cpu_threads=1, elements_per_worker=1):
+        """
+        Generate C and CUDA code for evaluating the operation defined in the supplied serialized expression dag
+        protocol buffer.
+        :param expression_dag: The protobuf
+        :param function_name: The name of the function to use
+        :param cpu_threads: The number of threads the generic c++ interface splits the workgroup across. 1 generates
+          a serial loop, 0 uses all cores available at run time.
+        :param elements_per_worker: The number of consecutive positions of the innermost workgroup dimension which
+          each cuda thread covers.
+        :return: a tuple containing the source for: the individual c function, individual cuda function, the
+          standalone cuda function launcher, the generic c++ interface, and the generic cuda interface
+        """
+        c_src, c_generic = ExpressionDAG.generate_c(expression_dag, function_name, cpu_threads)
+        cuda_src, cuda_launch_template, cuda_generic = ExpressionDAG.generate_cuda(expression_dag, function_name,
+                                                                                   elements_per_worker)
         return c_src, cuda_src, cuda_launch_template, c_generic, cuda_generic
 
     @staticmethod
@@ -968,7 +1224,8 @@ def _to_scalar_index(target_shape, index):
      can be a tensor, or a mixed iterable of constants, scalar expressions, and 0-D tensor expressions.
     :param target: The tensor to be indexed
     :param index: The index tensor or iterable
-    :return: a scalar expression containing the index of the flattened target tensor memory
+    :return: a scalar expression containing the index of the flattened target tensor memory, which is a uint32 unless
+     the tensor has more than 2^32 elements
     """
     target_rank = len(target_shape)
     block_size = [1]
@@ -976,6 +1233,15 @@ def _to_scalar_index(target_shape, index):
         block_size.append(block_size[-1]*target_shape[cur_dim])
     block_size.reverse()
 
+    # index arithmetic is done in 32 bits unless the tensor has too many elements for it to address all of them
+    size = 1
+    for dim in target_shape:
+        size *= dim
+    if size <= 2**32:
+        index_type = uint32
+    else:
+        index_type = uint64
+
     # try to wrap index as a const tensor
     try:
         index_expr = _ConstTensor(index)
@@ -1023,8 +1289,8 @@ def _to_scalar_index(target_shape, index):
         for i, expr in enumerate(exprs):
             if not isinstance(expr, int):
                 # todo: optionally dynamically constrain each non-constant dimensional index to within shape bounds
-                # bound_expr = cast(minimum(maximum(expr, 0), target_shape[i]-1), uint64)
-                bound_expr = cast(expr, uint64)
+                # bound_expr = cast(minimum(maximum(expr, 0), target_shape[i]-1), index_type)
+                bound_expr = cast(expr, index_type)
             else:
                 bound_expr = expr
 
@@ -1065,8 +1331,8 @@ def _to_scalar_index(target_shape, index):
             cur_shape = target_shape[i]
             cur_index = _ReadTensor(index_expr, i)
             # todo: optionally dynamically constrain each dimensional index to within shape bounds
-            # bound_index = minimum(maximum(cast(cur_index, uint64), 0), cur_shape-1)
-            bound_index = cast(cur_index, uint64)
+            # bound_index = minimum(maximum(cast(cur_index, index_type), 0), cur_shape-1)
+            bound_index = cast(cur_index, index_type)
             if index is None:
                 index = bound_index*block_size[i]
             else:
@@ -1112,6 +1378,16 @@ def _tensor_type_polymorhpic(*args):
     return tensor_type
 
 
+def _restrict_pointer(name):
+    """
+    Qualify the pointer to the array of an io tensor, which is named (*name), as restrict. The io tensors of an
+    operator are distinct buffers and only its inputs may be the same, which are never written.
+    :param name: the name of the io tensor
+    :return: the declarator of the restricted pointer
+    """
+    return name.replace('(*', '(* __restrict__ ', 1)
+
+
 def input(*args):
     """
     Create a new input
@@ -1144,6 +1420,7 @@ class InputTensor(_TensorExpression, _Readable):
         tipe = self.dtype.as_cstr()
         name = self.name
         elems = self.size
+        name = _restrict_pointer(self.name)
         p = string.Template('const ${tipe} ${name}[${elems}]').substitute(locals())
 
         return p
@@ -1202,6 +1479,7 @@ class OutputTensor(_TensorExpression, _Writable):
         tipe = self.dtype.as_cstr()
         name = self.name
         elems = self.size
+        name = _restrict_pointer(self.name)
         p = string.Template('${tipe} ${name}[${elems}]').substitute(locals())
 
         return p
@@ -1330,6 +1608,143 @@ class _ConstTensor(_TensorExpression, _Readable):
         return ''
 
 
+def _worker_index_type(num_workers):
+    """
+    Workers are indexed with 32 bits unless the workgroup is too large for them to count all of its workers.
+    :param num_workers: the number of workers in the workgroup
+    :return: the DType of the worker index and of the position tensor
+    """
+    if num_workers < 2**32:
+        return uint32
+    else:
+        return uint64
+
+
+# comments which mark the beginning and the end of the loops over the workers in generated C++ code
+_c_workers_begin = '//loops over the workers'
+_c_workers_end = '//end of the loops over the workers'
+
+
+def _independent_workers(exprs):
+    """
+    Determine whether the workers along the innermost dimension of the workgroup are independent of each other, so
+    that the loop over them can be vectorized. Workers only share the outputs, which are never read, so they are
+    independent if they do not add to outputs atomically and every output is written at a single affine index: the
+    innermost dimension of the position times a non-zero constant plus an offset computed from constants and the
+    other dimensions of the position only. The workers of a row then write distinct elements, and no worker writes an
+    element another one writes at a different offset.
+    :param exprs: the expressions of the dag
+    :return: True if the workers are independent
+    """
+    position = None
+    for expr in exprs:
+        if type(expr) is PositionTensor:
+            position = expr
+    inner_dim = position.size - 1
+
+    def constant_value(expr):
+        while type(expr) is _Cast:
+            expr = expr.input_exprs[0]
+        if type(expr) is _ConstScalar:
+            return expr.value()
+        return None
+
+    def affine_form(expr):
+        # the coefficient of the innermost position in an affine index and a key which identifies the index by its
+        # structure, or None if the index is not affine in the position. Variables and tensor reads may change
+        # between writes or differ between workers, so they are not affine.
+        if type(expr) is _ConstScalar:
+            return 0, ('const', expr.dtype.proto_dtype, expr.value())
+        elif type(expr) is _ReadTensor and expr.input_exprs[0] is position:
+            dim = constant_value(expr.input_exprs[1])
+            if dim is None:
+                return None
+            elif dim == inner_dim:
+                return 1, ('position', dim)
+            else:
+                return 0, ('position', dim)
+        elif type(expr) is _Cast:
+            form = affine_form(expr.input_exprs[0])
+            if form is None:
+                return None
+            return form[0], ('cast', expr.dtype.proto_dtype, form[1])
+        elif type(expr) is _BinaryMath:
+            lhs, rhs = expr.input_exprs
+            lhs_form = affine_form(lhs)
+            rhs_form = affine_form(rhs)
+            if lhs_form is None or rhs_form is None:
+                return None
+            code = expr.proto_expr.code
+            key = (code, expr.dtype.proto_dtype, lhs_form[1], rhs_form[1])
+            if lhs_form[0] == 0 and rhs_form[0] == 0:
+                return 0, key
+            elif code == lang.ADD:
+                return lhs_form[0] + rhs_form[0], key
+            elif code == lang.SUBTRACT:
+                return lhs_form[0] - rhs_form[0], key
+            elif code == lang.MULTIPLY:
+                if constant_value(lhs) is not None:
+                    return constant_value(lhs)*rhs_form[0], key
+                elif constant_value(rhs) is not None:
+                    return lhs_form[0]*constant_value(rhs), key
+        return None
+
+    output_indices = {}
+    for expr in exprs:
+        if type(expr) is _AtomicAdd:
+            return False
+        if type(expr) is _AssignTensor and type(expr.input_exprs[0]) is OutputTensor:
+            form = affine_form(expr.input_exprs[1])
+            if form is None or form[0] == 0:
+                return False
+            if output_indices.setdefault(id(expr.input_exprs[0]), form[1]) != form[1]:
+                return False
+    return True
+
+
+def _accumulated_outputs(exprs):
+    """
+    Find the outputs which are added to atomically, which must be initialized with zeros before the workers run.
+    :param exprs: the expressions of the dag
+    :return: the list of accumulated output expressions
+    """
+    accumulated = []
+    for expr in exprs:
+        if type(expr) is _AtomicAdd and expr.input_exprs[0] not in accumulated:
+            accumulated.append(expr.input_exprs[0])
+    return accumulated
+
+
+def _row_position_c(workgroup_shape, worker_type, indent, assume_bounds=False):
+    """
+    Generate the C declarations which decompose the index of a row of the workgroup, worker_row, into the outer
+    dimensions of a nested position. A row covers the innermost dimension of the workgroup.
+    :param workgroup_shape: the shape of the workgroup
+    :param worker_type: the C type of the worker index
+    :param indent: the indentation of the declarations
+    :param assume_bounds: whether to tell g++ that the position lies within the workgroup, which it cannot prove
+      when the rows covered are only known at run time. Tensor indices computed from the position then cannot
+      overflow, which allows the loop over the row to be vectorized.
+    :return: the C source of the declarations, each on a new line
+    """
+    row_block_size = [1]
+    for cur_dim in workgroup_shape[-2:0:-1]:
+        row_block_size.append(row_block_size[-1]*cur_dim)
+    row_block_size.reverse()
+
+    row_position = ''
+    remainder = 'worker_row'
+    for cur_dim, cur_block in enumerate(row_block_size[:len(workgroup_shape)-1]):
+        row_position += string.Template("""
+        |${indent}const ${worker_type} worker_position_${cur_dim} = (${remainder})/${cur_block};""").substitute(locals())
+        if assume_bounds:
+            dim_size = workgroup_shape[cur_dim]
+            row_position += string.Template("""
+            |${indent}if(worker_position_${cur_dim} >= ${dim_size}) __builtin_unreachable();""").substitute(locals())
+        remainder = remainder + ' % ' + str(cur_block)
+    return row_position
+
+
 def position_in(workgroup_shape):
     """
     Define the workgroup shape and retrieve a tensor expression that refers to the current position in that
@@ -1353,17 +1768,32 @@ class PositionTensor(_TensorExpression, _Readable):
             self.workgroup_shape = workgroup_shape
 
         workgroup_dims = len(self.workgroup_shape)
-        tensor_type = TensorType([workgroup_dims], uint32)
+        num_workers = 1
+        for cur_dim in self.workgroup_shape:
+            num_workers *= cur_dim
+        tensor_type = TensorType([workgroup_dims], _worker_index_type(num_workers))
 
         super(self.__class__, self).__init__(lang.POSITION, tensor_type)
 
-        self.proto_expr.uint32_data.extend(self.workgroup_shape)
+        if self.dtype == uint32:
+            self.proto_expr.uint32_data.extend(self.workgroup_shape)
+        else:
+            self.proto_expr.uint64_data.extend(self.workgroup_shape)
+
+        # the dimensions of the position which are read, or None if any of them may be
+        self.used_dims = None
+
+        # whether the position is maintained by nested loops, see ExpressionDAG._parse
+        self.nested = False
 
         super(self.__class__, self)._register()
 
     @staticmethod
     def from_proto(proto, input_exprs):
-        return PositionTensor(proto.uint32_data)
+        if proto.tensor_type.dtype == lang.UINT64:
+            return PositionTensor(list(proto.uint64_data))
+        else:
+            return PositionTensor(list(proto.uint32_data))
 
     def gen_ptr(self):
         tipe = self.dtype.as_cstr()
@@ -1377,14 +1807,23 @@ class PositionTensor(_TensorExpression, _Readable):
             workgroup_block_size.append(workgroup_block_size[-1]*self.workgroup_shape[cur_dim])
         workgroup_block_size.reverse()
 
+        if self.used_dims is not None and len(self.used_dims) == 0:
+            return ''
+
         position_vals = []
         remainder = 'worker_index'
-        for cur_block in workgroup_block_size:
-            cur_index = '('+remainder+')/'+str(cur_block)
-            position_vals.append(cur_index)
+        for cur_dim, cur_block in enumerate(workgroup_block_size):
+            if self.used_dims is not None and cur_dim not in self.used_dims:
+                position_vals.append('0')
+            elif not self.nested:
+                position_vals.append('('+remainder+')/'+str(cur_block))
+            elif cur_dim < self.size-1:
+                position_vals.append('worker_position_'+str(cur_dim))
+            else:
+                position_vals.append('worker_inner')
             remainder = remainder + ' % ' + str(cur_block)
 
-        return 'const uint32_t position['+str(self.size)+'] = {' + _list_to_str(position_vals) + '};\n'
+        return 'const ' + self.dtype.as_cstr() + ' position['+str(self.size)+'] = {' + _list_to_str(position_vals) + '};\n'
 
 
 def variable(initial_value, dtype):
@@ -1768,6 +2207,79 @@ def logical_or(x, y):
     return _BinaryMath(x, y, lang.OR)
 
 
+def where(condition, x, y):
+    """
+    Select one of two values by a condition. Unlike an ``if_`` block, both values are evaluated and no branch is
+    generated, so the selection neither keeps the compiler from vectorizing the loop over the workers nor makes
+    CUDA threads diverge.
+
+    :param condition: The scalar expression which selects x if it is non-zero and y otherwise
+    :param x: The value if the condition holds
+    :param y: The value otherwise
+    :return: The selected scalar expression
+
+    :Example:
+
+    Clip ``input_tensor`` to a maximum value of 1::
+
+        y = input_tensor[some_index]
+        output_tensor[some_index] = where(y > 1, 1, y)
+    """
+    return _Where(condition, x, y)
+
+
+class _Where(Scalar):
+    """
+    The expression which selects one of two values by a condition
+    """
+    def __init__(self, condition, x, y):
+        if not issubclass(condition.__class__, Scalar):
+            if isinstance(condition, bool):
+                raise TypeError('Attempting to use a constant boolean, %s, as the condition of the operator where '
+                                'expression. Use the python conditional expression instead since this can be '
+                                'interpreted at operator definition time.' % condition)
+            raise TypeError('Condition must be a scalar expression, instead got: ' + str(condition))
+
+        # wrap constant values and cast them according to the type of the other value
+        values = []
+        for value in [x, y]:
+            try:
+                values.append(_ConstScalar(value))
+            except TypeError:
+                values.append(value)
+            if not issubclass(values[-1].__class__, Scalar):
+                raise TypeError('Values of where must be scalar expressions, got:\n' + str(values[-1]))
+
+        x_is_constant = type(values[0]) == _ConstScalar
+        y_is_constant = type(values[1]) == _ConstScalar
+        if x_is_constant and y_is_constant:
+            raise TypeError('Cannot select between two constants.')
+        elif x_is_constant:
+            values[0] = cast(values[0], values[1].dtype)
+        elif y_is_constant:
+            values[1] = cast(values[1], values[0].dtype)
+
+        t1 = values[0].proto_expr.dtype
+        t2 = values[1].proto_expr.dtype
+        if not t1 == t2:
+            t1_str = lang.DType.Name(t1)
+            t2_str = lang.DType.Name(t2)
+            raise TypeError('x type (' + t1_str + ') must be the same as y type (' + t2_str + ')')
+
+        super(self.__class__, self).__init__(lang.WHERE, values[0].dtype)
+
+        self.input_exprs = [condition] + values
+        super(self.__class__, self)._register()
+
+    @staticmethod
+    def from_proto(proto, input_exprs):
+        return _Where(input_exprs[0], input_exprs[1], input_exprs[2])
+
+    def gen_c(self):
+        condition, x, y = [expr.name for expr in self.input_exprs]
+        return self.dtype.as_cstr() + ' ' + self.name + ' = ' + condition + ' ? ' + x + ' : ' + y + ';\n'
+
+
 class LocalTensor(_TensorExpression, _Readable, _Writable):
     """
     Expression which references a worker-local tensor
@@ -1884,6 +2396,73 @@ class _AssignTensor(_Expression):
         return self.input_exprs[0].name + '[' + self.input_exprs[1].name + '] = ' + self.input_exprs[2].name + ';\n'
 
 
+def atomic_add(output_tensor, index, value):
+    """
+    Add a value to an element of an output, which other workers may add to concurrently. Outputs which are added to
+    are initialized with zeros before any worker runs, so that workers can scatter their contributions to shared
+    elements, such as the bins of a histogram. The order of the additions is not defined, so sums of floating point
+    values may differ from one evaluation to the next by rounding.
+
+    :param output_tensor: The output to add to
+    :param index: The index of the element
+    :param value: The value to add, which must be a 32 or 64 bit int or float of the same type as the output
+    :return: None
+
+    :Example:
+
+    Count the occurrences of each value of ``input_tensor`` in an output with ``num_bins`` elements::
+
+        pos = position_in(input_tensor.shape)
+        counts = output([num_bins], uint32)
+        atomic_add(counts, input_tensor[pos], 1)
+    """
+    _AtomicAdd(output_tensor, _to_scalar_index(output_tensor.shape, index), value)
+
+
+class _AtomicAdd(_Expression):
+    """
+    Expression for atomically adding to outputs
+    """
+    _dtypes = [lang.INT32, lang.INT64, lang.UINT32, lang.UINT64, lang.FLOAT32, lang.FLOAT64]
+
+    def __init__(self, tensor_expr, index_expr, value_expr):
+        super(self.__class__, self).__init__(lang.ATOMIC_ADD)
+
+        if type(tensor_expr) is not OutputTensor:
+            raise TypeError('Can only atomically add to outputs.')
+
+        index = _check_index(tensor_expr, index_expr)
+
+        # try to wrap value as an expression if it's not
+        if issubclass(value_expr.__class__, _Expression):
+            value = value_expr
+        else:
+            value = _ConstScalar(value_expr)
+            value = cast(value, tensor_expr.dtype)
+
+        # make sure that value is same type as tensor, and that it can be added to atomically
+        t1 = tensor_expr.proto_expr.tensor_type.dtype
+        t2 = value.proto_expr.dtype
+        if not t1 == t2:
+            t1_str = lang.DType.Name(t1)
+            t2_str = lang.DType.Name(t2)
+            raise TypeError('cannot add ' + t2_str + ' to ' + t1_str + ' tensor')
+        if t1 not in _AtomicAdd._dtypes:
+            raise TypeError('cannot atomically add to ' + lang.DType.Name(t1) + ' tensor. Must be one of: ' +
+                            str([lang.DType.Name(t) for t in _AtomicAdd._dtypes]))
+
+        self.input_exprs = [tensor_expr, index, value]
+        super(self.__class__, self)._register()
+
+    @staticmethod
+    def from_proto(proto, input_exprs):
+        return _AtomicAdd(input_exprs[0], input_exprs[1], input_exprs[2])
+
+    def gen_c(self):
+        return 'atomic_add(&' + self.input_exprs[0].name + '[' + self.input_exprs[1].name + '], ' + \
+            self.input_exprs[2].name + ');\n'
+
+
 class _ReadTensor(Scalar):
     """
     Expression for reading from tensors
@@ -2001,6 +2580,18 @@ class _Range(_Expression, six.Iterator):
         stop_name = self.input_exprs[2].name
         step_name = self.input_exprs[3].name
 
+        # the direction of a constant step is known, so it does not need to be tested in each iteration. A step of
+        # zero keeps the general condition, which runs no iterations.
+        step = self.input_exprs[3]
+        if type(step) is _Cast and type(step.input_exprs[0]) is _ConstScalar and step.input_exprs[0].value() != 0:
+            if step.input_exprs[0].value() > 0:
+                for_string = 'for(${index_name} = ${start_name}; ${index_name} < ${stop_name}; ' \
+                             '${index_name}+=${step_name}){\n'
+            else:
+                for_string = 'for(${index_name} = ${start_name}; ${index_name} > ${stop_name}; ' \
+                             '${index_name}+=${step_name}){\n'
+            return string.Template(for_string).substitute(locals())
+
         for_string = 'for(${index_name} = ${start_name}; ' \
                      '((${index_name} < ${stop_name})&&(${step_name}>0)) || ' \
                      '((${index_name} > ${stop_name})&&(${step_name}<0)); ' \
@@ -2024,6 +2615,172 @@ class _EndRange(_Expression):
         return '}\n'
 
 
+def _reevaluate(expr, copies=None):
+    """
+    Copy the expressions which compute a scalar from variables, tensors and constants to the end of the dag, so that
+    it is computed again from the values the variables have at that point.
+    :param expr: the scalar expression
+    :param copies: the copies of the expressions copied so far, by their ids
+    :return: the copied scalar expression
+    """
+    if copies is None:
+        copies = {}
+    if type(expr) in (Variable, _ConstScalar) or issubclass(expr.__class__, _TensorExpression):
+        return expr
+    if id(expr) not in copies:
+        input_exprs = [_reevaluate(input_expr, copies) for input_expr in expr.input_exprs]
+        copies[id(expr)] = type(expr).from_proto(expr.proto_expr, input_exprs)
+    return copies[id(expr)]
+
+
+def while_(condition):
+    """
+    Repeat the body of a ``with`` block as long as a condition holds. The condition is evaluated again before each
+    iteration, from the values the variables it depends on have at that point.
+
+    :param condition: The condition under which to evaluate the body of the with block again
+
+    :Example:
+
+    Count the number of times an element of ``input_tensor`` can be halved before it is smaller than 1::
+
+        y = variable(input_tensor[some_index], input_tensor.dtype)
+        count = variable(0, uint32)
+        with while_(y >= 1):
+            y <<= y/2
+            count <<= count + 1
+    """
+    return _While(condition)
+
+
+class _While(_Expression):
+    """
+    The while expression. The loop it begins is left by a break expression, which tests the condition at the
+    beginning of each iteration.
+    """
+    def __init__(self, condition=None):
+        if condition is not None and not issubclass(condition.__class__, Scalar):
+            if isinstance(condition, bool):
+                raise TypeError('Attempting to use a constant boolean, %s, with the operator while_ expression. Use '
+                                'the python while instead since this can be interpreted at operator '
+                                'definition time.' % condition)
+            raise TypeError('Condition must be a scalar expression, instead got: ' + str(condition))
+
+        super(self.__class__, self).__init__(lang.WHILE)
+        self.condition = condition
+        super(self.__class__, self)._register()
+
+    @staticmethod
+    def from_proto(proto, input_exprs):
+        return _While()
+
+    def gen_c(self):
+        return 'while(1){\n'
+
+    def __enter__(self):
+        with if_(logical_not(_reevaluate(self.condition))):
+            _Break()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _EndWhile()
+
+
+class _EndWhile(_Expression):
+    """
+    The end while expression
+    """
+    def __init__(self):
+        super(self.__class__, self).__init__(lang.ENDWHILE)
+        super(self.__class__, self)._register()
+
+    @staticmethod
+    def from_proto(proto, input_exprs):
+        return _EndWhile()
+
+    def gen_c(self):
+        return '}\n'
+
+
+def _check_in_loop(name):
+    # make sure that a loop is open at the end of the dag
+    depth = 0
+    for expr in ExpressionDAG.exprs:
+        if type(expr) in (_Range, _While):
+            depth += 1
+        elif type(expr) in (_EndRange, _EndWhile):
+            depth -= 1
+    if depth == 0:
+        raise SyntaxError(name + ' must be used within a range or while loop')
+
+
+def break_():
+    """
+    Leave the innermost range or while loop, must be used within one.
+
+    :Example:
+
+    Find the index of the first negative element of ``input_tensor``::
+
+        first = variable(input_tensor.size, uint32)
+        for i in arange(input_tensor.size):
+            with if_(input_tensor[i] < 0):
+                first <<= cast(i, uint32)
+                break_()
+    """
+    _Break()
+
+
+class _Break(_Expression):
+    """
+    The break expression
+    """
+    def __init__(self):
+        _check_in_loop('break_')
+        super(self.__class__, self).__init__(lang.BREAK)
+        super(self.__class__, self)._register()
+
+    @staticmethod
+    def from_proto(proto, input_exprs):
+        return _Break()
+
+    def gen_c(self):
+        return 'break;\n'
+
+
+def continue_():
+    """
+    Skip the rest of the current iteration of the innermost range or while loop, must be used within one.
+
+    :Example:
+
+    Sum the positive elements of ``input_tensor``::
+
+        accum = variable(0, input_tensor.dtype)
+        for i in arange(input_tensor.size):
+            with if_(input_tensor[i] <= 0):
+                continue_()
+            accum <<= accum + input_tensor[i]
+    """
+    _Continue()
+
+
+class _Continue(_Expression):
+    """
+    The continue expression
+    """
+    def __init__(self):
+        _check_in_loop('continue_')
+        super(self.__class__, self).__init__(lang.CONTINUE)
+        super(self.__class__, self)._register()
+
+    @staticmethod
+    def from_proto(proto, input_exprs):
+        return _Continue()
+
+    def gen_c(self):
+        return 'continue;\n'
+
+
 def if_(condition):
     """
     conditional execution, must be used as part of a ``with`` block
@@ -0,0 +1,90 @@
+/* Copyright 2016 Hewlett Packard Enterprise Development LP
+
+ Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+ the License. You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+ on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+ the specific language governing permissions and limitations under the License.*/
+
+#ifndef OPVECLIB_LIBRARYREGISTRY_H_
+#define OPVECLIB_LIBRARYREGISTRY_H_
+
+#include <dlfcn.h>
+#include <cstddef>
+#include <map>
+#include <mutex>
+#include <string>
+
+// Process-wide registry of the generated operator libraries which have been loaded with dlopen, and of the
+// functions resolved in them. Libraries are reference counted: each user acquires a library before resolving
+// functions in it and releases it when done, and the library is closed when its last reference is released.
+// The registry instance is a static local of an inline function, which the GNU toolchain makes unique across
+// all shared libraries in the process, so the test harnesses and the TensorFlow kernel share it.
+class LibraryRegistry {
+ public:
+    static LibraryRegistry& instance() {
+        static LibraryRegistry registry;
+        return registry;
+    }
+
+    // Load a library, or add a reference to it if it is already loaded.
+    // Returns false if the library cannot be loaded.
+    bool acquire(const std::string& path) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto library = libraries_.find(path);
+        if (library == libraries_.end()) {
+            void *handle = dlopen(path.c_str(), RTLD_LAZY);
+            if (handle == nullptr) return false;
+            library = libraries_.insert(std::make_pair(path, Library(handle))).first;
+        }
+        library->second.references++;
+        return true;
+    }
+
+    // Remove a reference to a library, and close it if it was the last one.
+    void release(const std::string& path) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto library = libraries_.find(path);
+        if (library == libraries_.end()) return;
+        if (--library->second.references == 0) {
+            dlclose(library->second.handle);
+            libraries_.erase(library);
+        }
+    }
+
+    // Resolve a function in a library which has been acquired.
+    // Returns nullptr if the library is not loaded or does not define the function.
+    void* function(const std::string& path, const std::string& name) {
+        static_assert(sizeof(void *) == sizeof(void (*)(void)),
+                      "object pointer and function pointer sizes must equal");
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto library = libraries_.find(path);
+        if (library == libraries_.end()) return nullptr;
+        auto function = library->second.functions.find(name);
+        if (function == library->second.functions.end()) {
+            void *f = dlsym(library->second.handle, name.c_str());
+            if (f == nullptr) return nullptr;
+            function = library->second.functions.insert(std::make_pair(name, f)).first;
+        }
+        return function->second;
+    }
+
+ private:
+    struct Library {
+        explicit Library(void *h) : handle(h), references(0) {}
+        void *handle;
+        size_t references;
+        std::map<std::string, void*> functions;
+    };
+
+    LibraryRegistry() {}
+    LibraryRegistry(const LibraryRegistry&) = delete;
+    LibraryRegistry& operator=(const LibraryRegistry&) = delete;
+
+    std::mutex mutex_;
+    std::map<std::string, Library> libraries_;
+};
+
+#endif  // OPVECLIB_LIBRARYREGISTRY_H_
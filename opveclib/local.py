@@ -10,8 +10,8 @@
 
 
 import os
-import errno
-import tensorflow as tf
+import sys
+import logging as _std_logging
 
 #: Version string for current version
 version = '0.3.4'
@@ -23,21 +23,85 @@ _base_cache_directory = os.getenv('OPVECLIB_HOME', os.path.join(os.path.expandus
 #: Directory where cached operators are stored
 cache_directory = os.path.join(_base_cache_directory, version)
 
-# create the cache directory if it does not exist
-try:
-    os.makedirs(cache_directory)
-except OSError as exception:
-    if exception.errno != errno.EEXIST:
-        raise
+#: Maximum size of the operator cache in bytes, least recently used operators are evicted when it is exceeded.
+#: Set in megabytes by OPVECLIB_CACHE_SIZE_MB, 0 for no limit.
+cache_size_limit = int(float(os.getenv('OPVECLIB_CACHE_SIZE_MB', '0')) * 2**20)
 
+#: Number of interpreted operators, with their generated code, which are kept for reuse by identical operators
+#: constructed later in the same process. The least recently used ones are dropped first, 0 keeps none.
+memo_size = int(os.getenv('OPVECLIB_MEMO_SIZE', '256'))
+
+#: Flag which indicates whether generated C++ operators split their workgroup across multiple threads by default
+parallel_cpu = os.getenv('OPVECLIB_PARALLEL_CPU', '0').lower() in ['1', 'true', 'yes', 'on']
+
+#: Default number of threads used by parallel C++ operators, 0 uses all available cores
+cpu_threads = int(os.getenv('OPVECLIB_CPU_THREADS', '0'))
+
+#: Default build profile of generated operator libraries, one of 'debug', 'release', 'native' or 'fast-math'
+build_profile = os.getenv('OPVECLIB_BUILD_PROFILE', 'release')
+
+#: Default factor by which ranges with a constant number of iterations, which are too large to be fully unrolled,
+#: are unrolled. 1 only unrolls small ranges fully, and 0 does not unroll any.
+unroll_factor = int(os.getenv('OPVECLIB_UNROLL_FACTOR', '4'))
+
+#: Default number of consecutive positions of the innermost workgroup dimension covered by each thread of generated
+#: CUDA operators
+elements_per_worker = int(os.getenv('OPVECLIB_ELEMENTS_PER_WORKER', '1'))
+
+#: Number of operator libraries which are compiled in the background at the same time, 0 uses all available cores
+compile_jobs = int(os.getenv('OPVECLIB_COMPILE_JOBS', '0'))
+
+
+class _Logging(object):
+    """
+    Logs through TensorFlow's logging module once TensorFlow has been imported, and through the standard 'opveclib'
+    logger before, so that logging does not import TensorFlow.
+    """
+    DEBUG = _std_logging.DEBUG
+    INFO = _std_logging.INFO
+    WARN = _std_logging.WARN
+    ERROR = _std_logging.ERROR
+    FATAL = _std_logging.FATAL
+
+    _logger = _std_logging.getLogger('opveclib')
+
+    @staticmethod
+    def log(level, msg):
+        tf = sys.modules.get('tensorflow')
+        if tf is None:
+            _Logging._logger.log(level, msg)
+        else:
+            tf.logging.log(level, msg)
+
+#: Logger with the same interface as TensorFlow's logging module
+logging = _Logging()
+
+
+class _CudaEnabled(object):
+    """
+    Flag which is true if CUDA operators are enabled. It is resolved when first tested, which imports TensorFlow to
+    find out whether it was built with CUDA, unless the CUDA directory does not exist.
+    """
+    def __init__(self):
+        self._enabled = None
+
+    def __bool__(self):
+        if self._enabled is None:
+            # test whether we have cuda installed and if the tensorflow cuda version is installed
+            if not os.path.exists(cuda_directory):
+                self._enabled = False
+                logging.log(logging.INFO, '*** CUDA directory not found - Running on CPU Only ***')
+            else:
+                import tensorflow as tf
+                self._enabled = tf.test.is_built_with_cuda()
+                if not self._enabled:
+                    logging.log(logging.INFO, '*** TensorFlow CUDA version not installed - Running on CPU Only ***')
+        return self._enabled
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return repr(bool(self))
 
 #: Flag which indicates whether or not CUDA operators are enabled
-cuda_enabled = True
-
-# test whether we have cuda installed and if the tensorflow cuda version is installed
-if not os.path.exists(cuda_directory):
-    cuda_enabled = False
-    tf.logging.log(tf.logging.INFO, '*** CUDA directory not found - Running on CPU Only ***')
-elif not tf.test.is_built_with_cuda():
-    cuda_enabled = False
-    tf.logging.log(tf.logging.INFO, '*** TensorFlow CUDA version not installed - Running on CPU Only ***')
+cuda_enabled = _CudaEnabled()
@@ -13,15 +13,22 @@ import ctypes
 import errno
 import hashlib
 import os
+import re
 import inspect
+import multiprocessing
 import subprocess
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
-import tensorflow as tf
 import numpy as np
 from numpy.ctypeslib import ndpointer
 
-from .expression import TensorType, ExpressionDAG, input, float32, float64, OutputTensor
-from .local import version, cache_directory, cuda_enabled, cuda_directory
+from .expression import DType, TensorType, ExpressionDAG, input, float32, float64, OutputTensor, _c_workers_begin, \
+    _c_workers_end
+from .cache import build_once, build_in_directory_once, Manifest
+from .optimizer import optimize
+from .local import version, cache_directory, cuda_enabled, cuda_directory, parallel_cpu, cpu_threads, build_profile, \
+    unroll_factor, elements_per_worker, cache_size_limit, compile_jobs, memo_size, logging
 
 
 class _TensorParam(ctypes.Structure):
@@ -30,6 +37,16 @@ class _TensorParam(ctypes.Structure):
                 ("len", ctypes.c_size_t)]
 
 
+def _aligned_empty(shape, dtype, alignment=64):
+    # allocate an uninitialized array whose data starts on a cache line, so that the vectorized loops of the
+    # generated operators write it with aligned stores
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape, dtype=np.int64))*dtype.itemsize
+    buff = np.empty(size + alignment, dtype=np.uint8)
+    offset = -buff.ctypes.data % alignment
+    return buff[offset:offset + size].view(dtype).reshape(shape)
+
+
 class Operator(object):
     """
     Class which is extended to define a new operator and its gradient.
@@ -40,11 +57,60 @@ class Operator(object):
     _conversion_registered = False
     _default_cuda_threads_per_block = 64
 
+    # interpreted and generated operators, keyed by operator class, input types and options, from the least to the
+    # most recently used
+    _memo = OrderedDict()
+    _memo_size = memo_size
+    _memo_attributes = ['output_types', 'op_expression_dag', 'op_name', 'op_argtypes', '_has_gradient', '_lazy']
+
+    # index of the operator libraries in the cache, used to evict the least recently used ones
+    _manifest = Manifest(cache_directory, cache_size_limit)
+
+    # pool of threads which run the compilers in the background, results of the builds in progress on it by library,
+    # and the builds which operators converted to TensorFlow without waiting still depend on
+    _compile_pool = None
+    _compile_results = {}
+    _pending_builds = []
+
+    # compiler flags for each named build profile of the generated operator libraries
+    _build_profiles = {
+        'debug': {'g++': ['-g', '-O0'], 'nvcc': ['-g', '-G']},
+        'release': {'g++': ['-O3'], 'nvcc': ['-O3', '--use_fast_math']},
+        'native': {'g++': ['-O3', '-march=native'], 'nvcc': ['-O3', '--use_fast_math']},
+        'fast-math': {'g++': ['-O3', '-ffast-math'], 'nvcc': ['-O3', '--use_fast_math']}
+    }
+
+    # copies without inputs of the operators converted to TensorFlow whose gradient libraries have not been built
+    # yet, keyed by the name of the gradient. Entries are dropped once the gradient has been built.
+    _deferred_gradients = {}
+
+    # test harness libraries used to evaluate operators without TensorFlow, loaded once per process. They keep the
+    # operator libraries they have run loaded until those are removed from the cache.
+    _test_c_lib = None
+    _test_cuda_lib = None
+
+    # the gradient and the code of each backend are interpreted and generated when they are first accessed
+    grad_expression_dag = property(lambda self: self._gradient()[0])
+    grad_name = property(lambda self: self._gradient()[1])
+    grad_argtypes = property(lambda self: self._gradient()[2])
+    op_c_src = property(lambda self: self._generated('op', 'C++')[0])
+    op_c_generic = property(lambda self: self._generated('op', 'C++')[1])
+    op_cuda_src = property(lambda self: self._generated('op', 'CUDA')[0])
+    op_cuda_launch_template = property(lambda self: self._generated('op', 'CUDA')[1])
+    op_cuda_generic = property(lambda self: self._generated('op', 'CUDA')[2])
+    grad_c_src = property(lambda self: self._generated('grad', 'C++')[0])
+    grad_c_generic = property(lambda self: self._generated('grad', 'C++')[1])
+    grad_cuda_src = property(lambda self: self._generated('grad', 'CUDA')[0])
+    grad_cuda_launch_template = property(lambda self: self._generated('grad', 'CUDA')[1])
+    grad_cuda_generic = property(lambda self: self._generated('grad', 'CUDA')[2])
+
     @staticmethod
     def _register_shape_inference():
         if Operator._inference_registered is False:
             Operator._inference_registered = True
 
+            import tensorflow as tf
+
             @tf.RegisterShape("DynamicLib")
             def _tensor_ops_shape(op):
                 return op.get_attr('out_shapes')
@@ -52,38 +118,42 @@ class Operator(object):
     @staticmethod
     def _load_dynamiclib_module():
         if Operator._dynamiclibop_module is None:
-            libname = 'dynamiclibop.so.' + version
-            dynamiclibop_path = os.path.join(cache_directory, libname)
-            if not os.path.exists(dynamiclibop_path):
-                # build the library if it does not exist already
+            import tensorflow as tf
+
+            dynamiclibop_path = Operator._support_library_path(
+                'dynamiclibop', ['dynamiclibop.cc', 'dynamiclibop.h', 'libraryregistry.h'])
+
+            # build the library if it does not exist already
+            def build(tmp_path):
                 tf_include = tf.sysconfig.get_include()
                 # resolve the directory of this file
                 this_file_path = os.path.abspath(__file__)
                 this_directory = os.path.split(this_file_path)[0]
                 try:
                     if cuda_enabled:
-                        tf.logging.log(tf.logging.INFO, '*** building dynamiclibop for GPU')
+                        logging.log(logging.INFO, '*** building dynamiclibop for GPU')
                         subprocess.check_output(['g++', '-fPIC', '-Wall', '-shared',
                                          '-std=c++11', '-O2', '-Wextra', '-DGOOGLE_CUDA=1',
-                                         '-o', dynamiclibop_path,
+                                         '-o', tmp_path,
                                          this_directory + '/dynamiclibop.cc',
                                          '-isystem', cuda_directory + '/include',
                                          '-isystem', tf_include],
                                           stderr=subprocess.STDOUT,
                                           universal_newlines=True)
                     else:
-                        tf.logging.log(tf.logging.INFO, '*** building dynamiclibop for CPU')
+                        logging.log(logging.INFO, '*** building dynamiclibop for CPU')
                         subprocess.check_output(['g++', '-fPIC', '-Wall', '-shared',
                                          '-std=c++11', '-O2', '-Wextra',
-                                         '-o', dynamiclibop_path,
+                                         '-o', tmp_path,
                                          this_directory + '/dynamiclibop.cc',
                                          '-isystem', tf_include],
                                           stderr=subprocess.STDOUT,
                                           universal_newlines=True)
                 except subprocess.CalledProcessError as exception:
-                    tf.logging.log(tf.logging.ERROR, 'g++ error: ' + exception.output)
+                    logging.log(logging.ERROR, 'g++ error: ' + exception.output)
                     raise
 
+            build_once(dynamiclibop_path, build)
             Operator._dynamiclibop_module = tf.load_op_library(dynamiclibop_path)
 
     @staticmethod
@@ -103,6 +173,18 @@ class Operator(object):
                 cpu_grad_lib = op.get_attr('cpu_grad_lib_path')
                 cuda_threads_per_block = op.get_attr('cuda_threads_per_block')
 
+                # the gradient libraries are built when TensorFlow first asks for them
+                if cpu_grad_name != '':
+                    grad_name = cpu_grad_name[:-len('_generic_cpp')]
+                    deferred = Operator._deferred_gradients.get(grad_name)
+                    if deferred is not None:
+                        deferred._build_gradient()
+                        Operator._deferred_gradients.pop(grad_name, None)
+                    elif not os.path.exists(cpu_grad_lib):
+                        raise RuntimeError('The gradient library ' + cpu_grad_lib + ' has not been built. Gradients '
+                                           'are built in the process which converted their operator to TensorFlow, '
+                                           'or ahead of time with precompile.')
+
                 if cpu_grad_name == '':
                     grads = []
                     for i in range(num_inputs):
@@ -174,39 +256,77 @@ class Operator(object):
     #         Operation._conversion_registered = True
 
     @staticmethod
-    def _make_generic_c(src, name):
+    def _generic_c_path(name, tag='', profile='release'):
+        # path of a generic c++ shared library in the operator cache. The tag distinguishes libraries generated
+        # from the same operator with different code generation options, the profile those built with different flags.
+        return os.path.join(cache_directory, name + '_generic_cpp' + tag + '_' + profile + '.so')
+
+    @staticmethod
+    def _generic_cuda_path(name, tag='', profile='release'):
+        # path of a generic cuda shared library in the operator cache, the tag and profile are those of
+        # _generic_c_path
+        return os.path.join(cache_directory, name + '_generic_cuda' + tag + '_' + profile + '.so')
+
+    @staticmethod
+    def _remove_from_cache(name):
+        # release the references the test harnesses hold to the libraries of an operator before removing them from
+        # the cache, so that the rebuilt libraries are loaded rather than the stale ones still mapped in the process
+        filenames = Operator._manifest.files(name)
+        for test_lib in [Operator._test_c_lib, Operator._test_cuda_lib]:
+            if test_lib is not None:
+                for filename in filenames:
+                    test_lib.testReleaseLibrary(os.path.join(cache_directory, filename).encode('utf-8'))
+        Operator._manifest.remove(name, filenames)
+
+    @staticmethod
+    def _make_generic_c(src, name, tag='', profile='release'):
         # look for generic c++ shared library in the operator cache
-        generic_cpp_so_path = os.path.join(cache_directory, name + '_generic_cpp.so')
-        if not os.path.exists(generic_cpp_so_path):
-            generic_cpp_path = os.path.join(cache_directory, name + '_generic_cpp.cpp')
+        generic_cpp_so_path = Operator._generic_c_path(name, tag, profile)
+        lib_name = os.path.splitext(os.path.basename(generic_cpp_so_path))[0]
+        generic_cpp_path = os.path.join(cache_directory, lib_name + '.cpp')
+        vectorization_path = os.path.join(cache_directory, lib_name + '.vec')
+        if os.path.exists(generic_cpp_so_path):
+            Operator._manifest.touch(name)
+            return generic_cpp_so_path
+
+        def build(tmp_so_path):
             with open(generic_cpp_path, 'w') as f:
                 f.write(src)
 
             this_file_path = os.path.abspath(__file__)
             this_directory = os.path.split(this_file_path)[0]
             try:
-                subprocess.check_output(['g++', '-fPIC', '-std=c++11', '-g', '-pedantic',
-                             '-Wall', '-Wextra',
+                subprocess.check_output(['g++', '-fPIC', '-std=c++11', '-pedantic',
+                             '-Wall', '-Wextra', '-pthread', '-fopenmp-simd',
+                             '-fopt-info-vec-optimized=' + vectorization_path] +
+                             Operator._build_profiles[profile]['g++'] + [
                              '-I'+this_directory,
                              '-shared',
-                             '-o', generic_cpp_so_path, generic_cpp_path],
+                             '-o', tmp_so_path, generic_cpp_path],
                               stderr=subprocess.STDOUT,
                               universal_newlines=True)
             except subprocess.CalledProcessError as exception:
-                tf.logging.log(tf.logging.ERROR, 'g++ error: ' + exception.output)
+                logging.log(logging.ERROR, 'g++ error: ' + exception.output)
                 raise
 
+        build_once(generic_cpp_so_path, build)
+        Operator._manifest.record(name, [generic_cpp_so_path, generic_cpp_path, vectorization_path], profile)
         return generic_cpp_so_path
 
     @staticmethod
-    def _make_generic_cuda(src, name):
+    def _make_generic_cuda(src, name, tag='', profile='release'):
         # look for generic cuda shared library in the operator cache
-        generic_cuda_so_path = os.path.join(cache_directory, name + '_generic_cuda.so')
-        if not os.path.exists(generic_cuda_so_path):
+        generic_cuda_so_path = Operator._generic_cuda_path(name, tag, profile)
+        lib_name = os.path.splitext(os.path.basename(generic_cuda_so_path))[0]
+        generic_cuda_path = os.path.join(cache_directory, lib_name + '.cu')
+        if os.path.exists(generic_cuda_so_path):
+            Operator._manifest.touch(name)
+            return generic_cuda_so_path
+
+        def build(tmp_so_path):
             # generate and compile generic cuda operator
             nvcc_path = os.path.join(cuda_directory, 'bin/nvcc')
-            generic_cuda_path = os.path.join(cache_directory, name + '_generic_cuda.cu')
-            generic_cuda_o_path = os.path.join(cache_directory, name + '_generic_cuda.o')
+            generic_cuda_o_path = os.path.join(cache_directory, lib_name + '.o')
 
             with open(generic_cuda_path, 'w') as f:
                 f.write(src)
@@ -214,23 +334,55 @@ class Operator(object):
             this_file_path = os.path.abspath(__file__)
             this_directory = os.path.split(this_file_path)[0]
             try:
-                subprocess.check_output([nvcc_path, '-O3', '--use_fast_math', '--relocatable-device-code=true', '--compile',
+                subprocess.check_output([nvcc_path] + Operator._build_profiles[profile]['nvcc'] +
+                            ['--relocatable-device-code=true', '--compile',
                              '-Xcompiler', '-fPIC', '-std=c++11', '-I'+this_directory,
                              generic_cuda_path, '-o', generic_cuda_o_path],
                              stderr=subprocess.STDOUT,
                              universal_newlines=True)
-                subprocess.check_output([nvcc_path, '-shared', '-o', generic_cuda_so_path, generic_cuda_o_path],
+                subprocess.check_output([nvcc_path, '-shared', '-o', tmp_so_path, generic_cuda_o_path],
                              stderr=subprocess.STDOUT,
                              universal_newlines=True)
             except subprocess.CalledProcessError as exception:
-                tf.logging.log(tf.logging.ERROR, 'nvcc error: ' + exception.output)
+                logging.log(logging.ERROR, 'nvcc error: ' + exception.output)
                 raise
 
             # clean up .o files
             subprocess.call(['rm', generic_cuda_o_path])
 
+        build_once(generic_cuda_so_path, build)
+        Operator._manifest.record(name, [generic_cuda_so_path, generic_cuda_path], profile)
         return generic_cuda_so_path
 
+    @staticmethod
+    def _memo_key(cls, input_types, options):
+        # build a hashable key which identifies an operator by its class, input types and options. Returns None
+        # if an option has a value that cannot be reliably compared, in which case the operator is not memoized.
+        def key_of(value):
+            # values of different types which compare equal, like 1, 1.0 and True, must not share a key
+            if value is None or isinstance(value, (bool, int, float, str)):
+                return type(value).__name__, value
+            elif isinstance(value, (list, tuple)):
+                return (type(value).__name__,) + tuple(key_of(elem) for elem in value)
+            elif isinstance(value, np.ndarray):
+                return value.dtype.str, value.shape, value.tobytes()
+            elif isinstance(value, np.generic):
+                return value.dtype.str, value.tobytes()
+            elif isinstance(value, DType):
+                return 'DType', value.proto_dtype
+            elif isinstance(value, TensorType):
+                return 'TensorType', value.as_proto().SerializeToString()
+            else:
+                raise TypeError()
+
+        try:
+            option_keys = tuple((name, key_of(options[name])) for name in sorted(options.keys()))
+        except TypeError:
+            return None
+
+        type_keys = tuple(t.as_proto().SerializeToString() for t in input_types)
+        return cls, type_keys, option_keys
+
     @staticmethod
     def _unwrap_single(x):
         if len(x) is 1:
@@ -246,10 +398,45 @@ class Operator(object):
             if name not in options:
                 options[name] = value
 
-        tf.logging.log(tf.logging.DEBUG, 'Creating Op ' + self.__class__.__name__)
+        logging.log(logging.DEBUG, 'Creating Op ' + self.__class__.__name__)
 
         set_default_option(self._options, 'verbose', False)
         set_default_option(self._options, 'clear_cache', False)
+        set_default_option(self._options, 'parallel_cpu', parallel_cpu)
+        set_default_option(self._options, 'cpu_threads', cpu_threads)
+        set_default_option(self._options, 'build_profile', build_profile)
+        set_default_option(self._options, 'unroll_factor', unroll_factor)
+        set_default_option(self._options, 'elements_per_worker', elements_per_worker)
+
+        if self._options['build_profile'] not in Operator._build_profiles:
+            raise ValueError('Unknown build profile ' + str(self._options['build_profile']) + '. Must be one of: ' +
+                             str(sorted(Operator._build_profiles.keys())))
+        self._build_profile = self._options['build_profile']
+
+        # resolve the number of threads used by the generated C++ operators
+        if not isinstance(self._options['cpu_threads'], int) or self._options['cpu_threads'] < 0:
+            raise ValueError('cpu_threads must be a non-negative int, but received: ' +
+                             str(self._options['cpu_threads']))
+        if self._options['parallel_cpu']:
+            self._cpu_threads = self._options['cpu_threads']
+            self._c_lib_tag = '_t' + str(self._cpu_threads)
+        else:
+            self._cpu_threads = 1
+            self._c_lib_tag = ''
+
+        if not isinstance(self._options['unroll_factor'], int) or self._options['unroll_factor'] < 0:
+            raise ValueError('unroll_factor must be a non-negative int, but received: ' +
+                             str(self._options['unroll_factor']))
+
+        # resolve the number of workgroup positions covered by each thread of the generated CUDA operators
+        if not isinstance(self._options['elements_per_worker'], int) or self._options['elements_per_worker'] < 1:
+            raise ValueError('elements_per_worker must be a positive int, but received: ' +
+                             str(self._options['elements_per_worker']))
+        self._elements_per_worker = self._options['elements_per_worker']
+        if self._elements_per_worker > 1:
+            self._cuda_lib_tag = '_k' + str(self._elements_per_worker)
+        else:
+            self._cuda_lib_tag = ''
 
         self._inputs = list(inputs)
 
@@ -262,117 +449,149 @@ class Operator(object):
                                 str(inp_n + 1) + ' in the Op constructor. ' +
                                 'Should this argument be passed as a constant (keyword argument) instead?')
 
-        def interpret_function(input_types, function):
-            f_name = function.__name__
-            num_inputs = len(input_types)
-
-            # parse arg spec of the function and build up a dictionary of defaults to be applied if constants
-            # of the same name are not passed to contructor
-            arg_spec = inspect.getargspec(function).args[1:]
-            defaults = inspect.getargspec(function).defaults
-            defaults_dict = {}
-            if defaults is not None:
-                for default_n, cur_default in enumerate(defaults):
-                    defaults_dict[arg_spec[default_n-len(defaults)]] = cur_default
-
-            # keep track of which names are present in the constants dict or the defaults dict.
-            input_names = []
-            constant_names = []
-            default_names = []
-            for arg in arg_spec:
-                if arg in list(self._options.keys()):
-                    constant_names.append(arg)
-                elif arg in list(defaults_dict.keys()):
-                    default_names.append(arg)
-                else:
-                    input_names.append(arg)
-
-            # raise an error if the number of non-keyword args in the constructor is different from the number of
-            # non-constant inputs to the function
-            if len(input_names) != num_inputs:
-                err_msg = '\n'
-                additional = ''
-                if len(constant_names) > 0:
-                    err_msg += f_name + ' function received ' + str(len(constant_names)) + ' constants:\n' + \
-                               str(constant_names) + '\n'
-                    additional = ' additional'
-
-                err_msg += 'Based on constructor call pattern, ' + f_name + ' function signature expects ' + \
-                           str(len(input_names)) + additional + \
-                           ' input tensor argument(s):\n' + str(input_names) + '\n'
-                err_msg += 'but was supplied with ' + str(num_inputs) + '.\n'
-                if len(input_names) > num_inputs:
-                    remaining_names = input_names[num_inputs - len(input_names):]
-                    err_msg += 'Should ' + str(remaining_names) + ' be passed to constructor as constant?'
-                raise TypeError(err_msg)
-
-            ExpressionDAG.clear()
-
-            # create input expressions
-            input_exprs = []
-            for cur_type in input_types:
-                input_exprs.append(input(cur_type))
-
-            args = []
-            expr_n = 0
-            for cur_arg in arg_spec:
-                if cur_arg in list(self._options.keys()):
-                    args.append(self._options[cur_arg])
-                elif cur_arg in defaults_dict:
-                    args.append(defaults_dict[cur_arg])
-                else:
-                    args.append(input_exprs[expr_n])
-                    expr_n += 1
+        # reuse the interpreted expression dag and generated code of an identical, previously constructed operator
+        memo_key = Operator._memo_key(self.__class__, self._input_types, self._options)
+        if memo_key in Operator._memo:
+            logging.log(logging.DEBUG, 'Reusing previously generated code for Op ' + self.__class__.__name__)
+            memoized = Operator._memo.pop(memo_key)
+            Operator._memo[memo_key] = memoized
+            self.__dict__.update(memoized)
+        else:
+            self._interpret()
+            if memo_key is not None and Operator._memo_size > 0:
+                Operator._memo[memo_key] = dict((name, getattr(self, name)) for name in Operator._memo_attributes)
+                while len(Operator._memo) > Operator._memo_size:
+                    Operator._memo.popitem(last=False)
+
+        # create cache directory if it doesn't already exist
+        try:
+            os.makedirs(cache_directory)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
 
-            # interpret function to build up ExpressionDAG
-            output_exprs = function(*args)
-            if output_exprs is None:
-                raise ValueError('No outputs returned from ' + f_name + ' function')
+        # clear cache of all files related to this operator. Those of the gradient are cleared when it is interpreted.
+        self._grad_cache_cleared = False
+        if self._options['clear_cache']:
+            Operator._remove_from_cache(self.op_name)
 
-            # wrap as list if only one output
-            try:
-                len(output_exprs)
-            except TypeError:
-                output_exprs = [output_exprs]
-
-            # make sure number of returned parameters equals the number of declared outputs
-            if len(output_exprs) != ExpressionDAG.num_outputs:
-                raise ValueError('Defined ' + str(ExpressionDAG.num_outputs) + ' outputs, but returned ' +
-                                 str(len(output_exprs)) +
-                                 '. Number of defined outputs must equal number of returned outputs')
-
-            # make sure all returned values are output expressions
-            # reorder output io_index according to return order instead of declaration order
-            output_types = []
-            prev_index = []
-            for index, expr in enumerate(output_exprs):
-                if type(expr) is not OutputTensor:
-                    raise TypeError('User functions must only return outputs. Instead got:\n' + str(expr))
-                prev_index.append(ExpressionDAG.expr_index(expr))
-                expr.proto_expr.io_index = index
-                output_types.append(TensorType.like(expr))
-            # reorder declaration of outputs in expression dag
-            prev_index.sort()
-            for index, expr in zip(prev_index, output_exprs):
-                ExpressionDAG.exprs[index] = expr
-                ExpressionDAG.expr_ids[index] = id(expr)
-
-            expression_dag = ExpressionDAG.as_proto()
-            ExpressionDAG.clear()
-
-            return output_types, expression_dag
-
-        self.output_types, self.op_expression_dag = interpret_function(self._input_types, self.op)
+        logging.log(logging.DEBUG, 'Finished creating Op ' + self.__class__.__name__)
 
-        # define a function name based on the operator hash
-        self.op_name = 'f' + hashlib.sha224(self.op_expression_dag.SerializeToString() + version.encode('utf-8')).hexdigest()
+        # initialize lazily defined functions and buffers used by evaluation infrastructure
+        self._op_c_function = None
+        self._op_cuda_function = None
+        self._output_buffers = None
+        self._output_params = None
+        self._input_params = None
+        self._active_eval_fcn = None
+
+    def _interpret_function(self, input_types, function):
+        # interpret a user function to build up its expression dag
+        f_name = function.__name__
+        num_inputs = len(input_types)
+
+        # parse arg spec of the function and build up a dictionary of defaults to be applied if constants
+        # of the same name are not passed to contructor
+        arg_spec = inspect.getargspec(function).args[1:]
+        defaults = inspect.getargspec(function).defaults
+        defaults_dict = {}
+        if defaults is not None:
+            for default_n, cur_default in enumerate(defaults):
+                defaults_dict[arg_spec[default_n-len(defaults)]] = cur_default
+
+        # keep track of which names are present in the constants dict or the defaults dict.
+        input_names = []
+        constant_names = []
+        default_names = []
+        for arg in arg_spec:
+            if arg in list(self._options.keys()):
+                constant_names.append(arg)
+            elif arg in list(defaults_dict.keys()):
+                default_names.append(arg)
+            else:
+                input_names.append(arg)
+
+        # raise an error if the number of non-keyword args in the constructor is different from the number of
+        # non-constant inputs to the function
+        if len(input_names) != num_inputs:
+            err_msg = '\n'
+            additional = ''
+            if len(constant_names) > 0:
+                err_msg += f_name + ' function received ' + str(len(constant_names)) + ' constants:\n' + \
+                           str(constant_names) + '\n'
+                additional = ' additional'
+
+            err_msg += 'Based on constructor call pattern, ' + f_name + ' function signature expects ' + \
+                       str(len(input_names)) + additional + \
+                       ' input tensor argument(s):\n' + str(input_names) + '\n'
+            err_msg += 'but was supplied with ' + str(num_inputs) + '.\n'
+            if len(input_names) > num_inputs:
+                remaining_names = input_names[num_inputs - len(input_names):]
+                err_msg += 'Should ' + str(remaining_names) + ' be passed to constructor as constant?'
+            raise TypeError(err_msg)
+
+        ExpressionDAG.clear()
+
+        # create input expressions
+        input_exprs = []
+        for cur_type in input_types:
+            input_exprs.append(input(cur_type))
+
+        args = []
+        expr_n = 0
+        for cur_arg in arg_spec:
+            if cur_arg in list(self._options.keys()):
+                args.append(self._options[cur_arg])
+            elif cur_arg in defaults_dict:
+                args.append(defaults_dict[cur_arg])
+            else:
+                args.append(input_exprs[expr_n])
+                expr_n += 1
 
-        tf.logging.log(tf.logging.DEBUG, 'Generating code for Op ' +
-                       self.__class__.__name__ + ' as ' + self.op_name)
+        # interpret function to build up ExpressionDAG
+        output_exprs = function(*args)
+        if output_exprs is None:
+            raise ValueError('No outputs returned from ' + f_name + ' function')
+
+        # wrap as list if only one output
+        try:
+            len(output_exprs)
+        except TypeError:
+            output_exprs = [output_exprs]
+
+        # make sure number of returned parameters equals the number of declared outputs
+        if len(output_exprs) != ExpressionDAG.num_outputs:
+            raise ValueError('Defined ' + str(ExpressionDAG.num_outputs) + ' outputs, but returned ' +
+                             str(len(output_exprs)) +
+                             '. Number of defined outputs must equal number of returned outputs')
+
+        # make sure all returned values are output expressions
+        # reorder output io_index according to return order instead of declaration order
+        output_types = []
+        prev_index = []
+        for index, expr in enumerate(output_exprs):
+            if type(expr) is not OutputTensor:
+                raise TypeError('User functions must only return outputs. Instead got:\n' + str(expr))
+            prev_index.append(ExpressionDAG.expr_index(expr))
+            expr.proto_expr.io_index = index
+            output_types.append(TensorType.like(expr))
+        # reorder declaration of outputs in expression dag
+        prev_index.sort()
+        for index, expr in zip(prev_index, output_exprs):
+            ExpressionDAG.exprs[index] = expr
+            ExpressionDAG.expr_ids[index] = id(expr)
+
+        expression_dag = optimize(ExpressionDAG.as_proto(), self._options['unroll_factor'])
+        ExpressionDAG.clear()
+
+        return output_types, expression_dag
+
+    def _interpret(self):
+        # interpret the op function. Code generation and the gradient are deferred until they are first needed.
+        self.output_types, self.op_expression_dag = self._interpret_function(self._input_types, self.op)
 
-        # generate code of the operator
-        self.op_c_src, self.op_cuda_src, self.op_cuda_launch_template, self.op_c_generic, self.op_cuda_generic = \
-            ExpressionDAG.generate(self.op_expression_dag, self.op_name)
+        # define a function name based on the operator hash
+        self.op_name = 'f' + hashlib.sha224(self.op_expression_dag.SerializeToString() + version.encode('utf-8')).hexdigest()
 
         # define the c types for op input and output arguments
         self.op_argtypes = []
@@ -386,88 +605,89 @@ class Operator(object):
             p = ndpointer(t, flags="C_CONTIGUOUS")
             self.op_argtypes.append(p)
 
-        # parse grad function
+        # check whether a grad function is defined
         try:
             self.grad()
 
         # grad not defined
         except ValueError:
-            self.grad_expression_dag = None
-            self.grad_name = None
-            self.grad_c_src = None
-            self.grad_cuda_src = None
-            self.grad_cuda_launch_template = None
-            self.grad_c_generic = None
-            self.grad_cuda_generic = None
-            self.grad_argtypes = None
+            self._has_gradient = False
         except TypeError:
-            tf.logging.log(tf.logging.DEBUG, 'Creating gradient for Op ' + self.__class__.__name__)
-            grad_arg_spec = inspect.getargspec(self.grad).args[1:]
-
-            # make sure initial part of gradient function signature matches op function signature
-            for arg_n, op_arg in enumerate(inspect.getargspec(self.op).args[1:]):
-                if op_arg != grad_arg_spec[arg_n]:
-                    raise TypeError('Gradient function must have same initial argument names as the op function. ' +
-                                    'Expected arg "' + str(op_arg) + '", but got "' + str(grad_arg_spec[arg_n]) + '".')
-            grad_input_types = []
-            for t in self._input_types:
-                grad_input_types.append(TensorType.like(t))
-            for t in self.output_types:
-                grad_input_types.append(TensorType.like(t))
-
-            grad_types, self.grad_expression_dag = interpret_function(grad_input_types, self.grad)
-
-            for grad_n, grad_type in enumerate(grad_types):
-                if grad_type != self._input_types[grad_n]:
-                    raise TypeError('Gradient function must output tensor list with a types identical '
-                                    'to the op functions inputs.')
-
-            self.grad_name = 'f' + hashlib.sha224(self.grad_expression_dag.SerializeToString() + version.encode('utf-8')).hexdigest()
-            tf.logging.log(tf.logging.DEBUG, 'Generating code for gradient for Op ' +
-                           self.__class__.__name__ + ' as ' + self.grad_name)
-            self.grad_c_src, self.grad_cuda_src, self.grad_cuda_launch_template, self.grad_c_generic, \
-                self.grad_cuda_generic = ExpressionDAG.generate(self.grad_expression_dag, self.grad_name)
-
-            # define c types of grad arguments
-            self.grad_argtypes = []
-            for at in self.op_argtypes:
-                self.grad_argtypes.append(at)
-
-            for in_cur in self._input_types:
-                t = in_cur.dtype.as_ctypes()
-                p = ndpointer(t, flags="C_CONTIGUOUS")
-                self.grad_argtypes.append(p)
-
+            self._has_gradient = True
         else:
             raise TypeError('Badly formed gradient function. Gradient function requires arguments.')
 
-        # create cache directory if it doesn't already exist
-        try:
-            os.makedirs(cache_directory)
-        except OSError as exception:
-            if exception.errno != errno.EEXIST:
-                raise
-
-        # clear cache of all files related to this operator
-        if self._options['clear_cache']:
-            for filename in os.listdir(cache_directory):
-                if self.op_name in filename:
-                    os.remove(os.path.join(cache_directory, filename))
-                if self.grad_name is not None and self.grad_name in filename:
-                    os.remove(os.path.join(cache_directory, filename))
-
-        tf.logging.log(tf.logging.DEBUG, 'Finished creating Op ' + self.__class__.__name__)
-
-        # initialize lazily defined functions and buffers used by evaluation infrastructure
-        self._op_c_function = None
-        self._op_cuda_function = None
-        self._output_buffers = None
-        self._output_params = None
-        self._input_params = None
-        self._active_eval_fcn = None
+        # lazily interpreted gradient and generated code, shared with memoized copies of this operator
+        self._lazy = {}
 
-        self._test_cuda_op = None
-        self._test_c_op = None
+    def _gradient(self):
+        # interpret the grad function the first time the gradient is needed
+        if 'grad' not in self._lazy:
+            if not self._has_gradient:
+                self._lazy['grad'] = None, None, None
+            else:
+                logging.log(logging.DEBUG, 'Creating gradient for Op ' + self.__class__.__name__)
+                grad_arg_spec = inspect.getargspec(self.grad).args[1:]
+
+                # make sure initial part of gradient function signature matches op function signature
+                for arg_n, op_arg in enumerate(inspect.getargspec(self.op).args[1:]):
+                    if op_arg != grad_arg_spec[arg_n]:
+                        raise TypeError('Gradient function must have same initial argument names as the op function. ' +
+                                        'Expected arg "' + str(op_arg) + '", but got "' + str(grad_arg_spec[arg_n]) +
+                                        '".')
+                grad_input_types = []
+                for t in self._input_types:
+                    grad_input_types.append(TensorType.like(t))
+                for t in self.output_types:
+                    grad_input_types.append(TensorType.like(t))
+
+                grad_types, grad_expression_dag = self._interpret_function(grad_input_types, self.grad)
+
+                for grad_n, grad_type in enumerate(grad_types):
+                    if grad_type != self._input_types[grad_n]:
+                        raise TypeError('Gradient function must output tensor list with a types identical '
+                                        'to the op functions inputs.')
+
+                grad_name = 'f' + hashlib.sha224(grad_expression_dag.SerializeToString() + version.encode('utf-8')).hexdigest()
+
+                # define c types of grad arguments
+                grad_argtypes = []
+                for at in self.op_argtypes:
+                    grad_argtypes.append(at)
+
+                for in_cur in self._input_types:
+                    t = in_cur.dtype.as_ctypes()
+                    p = ndpointer(t, flags="C_CONTIGUOUS")
+                    grad_argtypes.append(p)
+
+                self._lazy['grad'] = grad_expression_dag, grad_name, grad_argtypes
+
+        # clear cache of all files related to the gradient
+        grad_name = self._lazy['grad'][1]
+        if self._options['clear_cache'] and not self._grad_cache_cleared and grad_name is not None:
+            Operator._remove_from_cache(grad_name)
+        self._grad_cache_cleared = True
+
+        return self._lazy['grad']
+
+    def _generated(self, function, backend):
+        # generate the code of the op or grad function for the C++ or CUDA backend the first time it is needed
+        key = (function, backend)
+        if key not in self._lazy:
+            if function == 'op':
+                expression_dag, name = self.op_expression_dag, self.op_name
+            else:
+                expression_dag, name = self.grad_expression_dag, self.grad_name
+                if expression_dag is None:
+                    return None, None, None
+
+            logging.log(logging.DEBUG, 'Generating ' + backend + ' code for ' + function + ' of Op ' +
+                           self.__class__.__name__ + ' as ' + name)
+            if backend == 'C++':
+                self._lazy[key] = ExpressionDAG.generate_c(expression_dag, name, self._cpu_threads)
+            else:
+                self._lazy[key] = ExpressionDAG.generate_cuda(expression_dag, name, self._elements_per_worker)
+        return self._lazy[key]
 
     def op(self, *input_tensors, **constants):
         """
@@ -503,7 +723,7 @@ class Operator(object):
             self._output_buffers = []
             for out_cur in self.output_types:
                 t = out_cur.dtype.as_numpy()
-                new_buff = np.empty(out_cur.shape, dtype=t)
+                new_buff = _aligned_empty(out_cur.shape, t)
                 self._output_buffers.append(new_buff)
 
             outputs = []
@@ -519,26 +739,40 @@ class Operator(object):
             for out in self._output_buffers:
                 out[:] = 0
 
+    @staticmethod
+    def _support_library_path(name, sources):
+        # the cached path of a library built from sources in this directory. It is keyed on a hash of the sources as
+        # well as the version, so that a library built from older sources is rebuilt rather than loaded.
+        this_directory = os.path.split(os.path.abspath(__file__))[0]
+        source_hash = hashlib.sha224()
+        for source in sources:
+            with open(os.path.join(this_directory, source), 'rb') as source_file:
+                source_hash.update(source_file.read())
+        return os.path.join(cache_directory, name + '.so.' + version + '.' + source_hash.hexdigest()[:16])
+
     @staticmethod
     def _check_proto():
         # build the protobuf header file. This must match the version of protoc
         # and libprotobuf-dev that is installed on the user system. Otherwise the generated file
         # will be incompatible with the protoc system header files.
         proto_header = os.path.join(cache_directory, 'language.pb.h')
-        if not os.path.exists(proto_header):
+
+        def build(tmp_directory):
             this_file_path = os.path.abspath(__file__)
             this_directory = os.path.split(this_file_path)[0]
             proto_path = os.path.join(this_directory, 'language.proto')
 
             try:
                 subprocess.check_output(['protoc', proto_path, '--proto_path='+this_directory,
-                             '--cpp_out='+cache_directory],
+                             '--cpp_out='+tmp_directory],
                              stderr=subprocess.STDOUT,
                              universal_newlines=True)
             except subprocess.CalledProcessError as exception:
-                tf.logging.log(tf.logging.ERROR, 'protoc error: ' + exception.output)
+                logging.log(logging.ERROR, 'protoc error: ' + exception.output)
                 raise
 
+        build_in_directory_once(proto_header, build)
+
     def evaluate_c(self, profiling_iterations=None):
         """
         Evaluate dthe compiled C code for this operator, mainly used for testing. This function uses a test operator
@@ -554,7 +788,8 @@ class Operator(object):
         """
 
         # get the C test function from it's .so (compiles if necessary)
-        lib_path = Operator._make_generic_c(self.op_c_generic, self.op_name).encode('utf-8')
+        lib_path = Operator._make_generic_c(self.op_c_generic, self.op_name, self._c_lib_tag,
+                                            self._build_profile).encode('utf-8')
         fcn_name = (self.op_name + '_generic_cpp').encode('utf-8')
 
         self._define_eval_params(lib_path, fcn_name)
@@ -573,11 +808,11 @@ class Operator(object):
         num_inputs = len(self._input_types)
         num_outputs = len(self.output_types)
 
-        if self._test_c_op is None:
-            testlib_path = os.path.join(cache_directory, 'libtestcop.so.'+version)
-            try:
-                libtest = ctypes.cdll.LoadLibrary(testlib_path)
-            except OSError:
+        if Operator._test_c_lib is None:
+            testlib_path = Operator._support_library_path(
+                'libtestcop', ['testcop.cc', 'dynamiclibop.h', 'libraryregistry.h', 'language.proto'])
+
+            def build(tmp_path):
                 Operator._check_proto()
                 this_file_path = os.path.abspath(__file__)
                 this_directory = os.path.split(this_file_path)[0]
@@ -587,35 +822,36 @@ class Operator(object):
 
                 try:
                     subprocess.check_output(['g++', '-fPIC', '-Wall', '-shared',
-                                 '-std=c++11', '-Ofast', '-Wextra',
+                                 '-std=c++11', '-Ofast', '-Wextra', '-pthread',
                                  '-I'+this_directory,
                                  '-I'+cache_directory,
-                                 '-o', testlib_path, cc_path],
+                                 '-o', tmp_path, cc_path, '-ldl'],
                                  stderr=subprocess.STDOUT,
                                  universal_newlines=True)
                 except subprocess.CalledProcessError as exception:
-                    tf.logging.log(tf.logging.ERROR, 'g++ error: ' + exception.output)
+                    logging.log(logging.ERROR, 'g++ error: ' + exception.output)
                     raise
 
-                libtest = ctypes.cdll.LoadLibrary(testlib_path)
-
-            self._test_c_op = libtest.testCOperator
-            self._test_c_op.restype = ctypes.c_int16
-            self._test_c_op.argtypes = \
+            libtest = ctypes.cdll.LoadLibrary(build_once(testlib_path, build))
+            libtest.testReleaseLibrary.restype = None
+            libtest.testReleaseLibrary.argtypes = [ctypes.c_char_p]
+            libtest.testCOperator.restype = ctypes.c_int16
+            libtest.testCOperator.argtypes = \
                 [ctypes.c_char_p, ctypes.c_char_p,
                  ndpointer(dtype=_TensorParam, flags="C_CONTIGUOUS"), ctypes.c_size_t,
                  ndpointer(dtype=_TensorParam, flags="C_CONTIGUOUS"), ctypes.c_size_t,
                  ndpointer(dtype=ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_size_t]
+            Operator._test_c_lib = libtest
 
         # run the operator
-        err = self._test_c_op(lib_path, fcn_name,
-                              self._input_params, ctypes.c_size_t(num_inputs),
-                              self._output_params, ctypes.c_size_t(num_outputs),
-                              eval_times_ms,
-                              ctypes.c_size_t(iters))
+        err = Operator._test_c_lib.testCOperator(lib_path, fcn_name,
+                                                 self._input_params, ctypes.c_size_t(num_inputs),
+                                                 self._output_params, ctypes.c_size_t(num_outputs),
+                                                 eval_times_ms,
+                                                 ctypes.c_size_t(iters))
 
         if err != 0 or np.isnan(eval_times_ms).any():
-            tf.logging.log(tf.logging.ERROR, 'Test C operator failed for Op ' + self.__class__.__name__)
+            logging.log(logging.ERROR, 'Test C operator failed for Op ' + self.__class__.__name__)
             raise ValueError('Test C operator failed for Op ' + self.__class__.__name__)
 
         if profiling_iterations is None:
@@ -623,6 +859,37 @@ class Operator(object):
         else:
             return Operator._unwrap_single(self._output_buffers), eval_times_ms
 
+    def vectorized_c(self):
+        """
+        Report whether g++ vectorized the loops over the workers of the compiled C code for this operator. The loop
+        over the innermost workgroup dimension is marked for vectorization when the workers are independent of each
+        other, and g++ may vectorize it or the loops within a worker. Compiles the operator if necessary.
+
+        :return: True if a loop over or within the workers was vectorized, None if the loops over the workers cannot
+            be found in the generated code
+        """
+        lib_path = Operator._make_generic_c(self.op_c_generic, self.op_name, self._c_lib_tag, self._build_profile)
+        vectorization_path = os.path.splitext(lib_path)[0] + '.vec'
+        if not os.path.exists(vectorization_path):
+            return False
+
+        # g++ reports a vectorized loop at the location of one of its statements, so look for reports between the
+        # comments the generator places around the loops over the workers
+        lines = [line.strip() for line in self.op_c_generic.split('\n')]
+        if _c_workers_begin not in lines or _c_workers_end not in lines:
+            return None
+        loop_begin = lines.index(_c_workers_begin) + 1
+        loop_end = lines.index(_c_workers_end, loop_begin) + 1
+        report = re.compile(re.escape(os.path.splitext(os.path.basename(lib_path))[0]) +
+                            r'\.cpp:(\d+):\d+: optimized: loop vectorized')
+
+        with open(vectorization_path) as f:
+            for line in f:
+                match = report.search(line)
+                if match is not None and loop_begin < int(match.group(1)) <= loop_end:
+                    return True
+        return False
+
     def evaluate_cuda(self, cuda_threads_per_block=_default_cuda_threads_per_block, profiling_iterations=None):
         """
         Evaluate the compiled CUDA code for this operator, mainly used for testing. This function uses a test operator
@@ -641,7 +908,8 @@ class Operator(object):
             raise RuntimeError('CUDA is not enabled')
 
         # get the CUDA test function from it's .so (compiles if necessary)
-        lib_path = Operator._make_generic_cuda(self.op_cuda_generic, self.op_name).encode('utf-8')
+        lib_path = Operator._make_generic_cuda(self.op_cuda_generic, self.op_name, self._cuda_lib_tag,
+                                               self._build_profile).encode('utf-8')
         fcn_name = (self.op_name + '_generic_cuda').encode('utf-8')
         self._define_eval_params(lib_path, fcn_name)
 
@@ -660,11 +928,11 @@ class Operator(object):
         eval_times_ms[:] = np.nan
 
         # lazily compile testcudaop.cc
-        if self._test_cuda_op is None:
-            testlib_path = os.path.join(cache_directory, 'libtestcudaop.so.'+version)
-            try:
-                libtest = ctypes.cdll.LoadLibrary(testlib_path)
-            except OSError:
+        if Operator._test_cuda_lib is None:
+            testlib_path = Operator._support_library_path(
+                'libtestcudaop', ['testcudaop.cc', 'dynamiclibop.h', 'libraryregistry.h', 'language.proto'])
+
+            def build(tmp_path):
                 Operator._check_proto()
                 this_file_path = os.path.abspath(__file__)
                 this_directory = os.path.split(this_file_path)[0]
@@ -692,35 +960,36 @@ class Operator(object):
                                      stderr=subprocess.STDOUT,
                                      universal_newlines=True)
                     subprocess.check_output(['g++', '-shared',
-                                     '-o', testlib_path, o_path, linko_path],
+                                     '-o', tmp_path, o_path, linko_path],
                                      stderr=subprocess.STDOUT,
                                      universal_newlines=True)
                 except subprocess.CalledProcessError as exception:
-                    tf.logging.log(tf.logging.ERROR, 'nvcc error: ' + exception.output)
+                    logging.log(logging.ERROR, 'nvcc error: ' + exception.output)
                     raise
 
                 # clean up .o files
                 subprocess.call(['rm', o_path, linko_path])
 
-                libtest = ctypes.cdll.LoadLibrary(testlib_path)
-
-            self._test_cuda_op = libtest.testCUDAOperator
-            self._test_cuda_op.restype = ctypes.c_int16
-            self._test_cuda_op.argtypes = \
+            libtest = ctypes.cdll.LoadLibrary(build_once(testlib_path, build))
+            libtest.testReleaseLibrary.restype = None
+            libtest.testReleaseLibrary.argtypes = [ctypes.c_char_p]
+            libtest.testCUDAOperator.restype = ctypes.c_int16
+            libtest.testCUDAOperator.argtypes = \
                 [ctypes.c_char_p, ctypes.c_char_p,
                  ndpointer(dtype=_TensorParam, flags="C_CONTIGUOUS"), ctypes.c_size_t,
                  ndpointer(dtype=_TensorParam, flags="C_CONTIGUOUS"), ctypes.c_size_t,
                  ctypes.c_uint16,
                  ndpointer(dtype=ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_size_t]
+            Operator._test_cuda_lib = libtest
 
-        err = self._test_cuda_op(lib_path, fcn_name,
-                                 self._input_params, ctypes.c_size_t(num_inputs),
-                                 self._output_params, ctypes.c_size_t(num_outputs),
-                                 ctypes.c_uint16(cuda_threads_per_block),
-                                 eval_times_ms, ctypes.c_size_t(iters))
+        err = Operator._test_cuda_lib.testCUDAOperator(lib_path, fcn_name,
+                                                       self._input_params, ctypes.c_size_t(num_inputs),
+                                                       self._output_params, ctypes.c_size_t(num_outputs),
+                                                       ctypes.c_uint16(cuda_threads_per_block),
+                                                       eval_times_ms, ctypes.c_size_t(iters))
 
         if err != 0 or np.isnan(eval_times_ms).any():
-            tf.logging.log(tf.logging.ERROR, 'Test CUDA operator failed for Op ' + self.__class__.__name__)
+            logging.log(logging.ERROR, 'Test CUDA operator failed for Op ' + self.__class__.__name__)
             raise ValueError('Test CUDA operator failed for Op ' + self.__class__.__name__)
 
         if profiling_iterations is None:
@@ -780,40 +1049,133 @@ class Operator(object):
     #     self._grad_cuda_function(*(self._inputs + list(grads) + self._grad_output_buffers + [cuda_threads_per_block]))
     #     return Operator._unwrap_single(self._grad_output_buffers)
 
-    def as_tensorflow(self, cuda_threads_per_block=_default_cuda_threads_per_block):
+    def _library_builds(self, functions=('op', 'grad')):
+        # list the libraries needed to run the op and grad functions of this operator, as tuples of a description,
+        # the path of the library, the function which builds it and its arguments
+        builds = []
+        for function in functions:
+            if function == 'op':
+                name, description = self.op_name, ''
+            else:
+                name, description = self.grad_name, ' gradient'
+            if name is None:
+                continue
+
+            builds.append(('C++' + description, Operator._generic_c_path(name, self._c_lib_tag, self._build_profile),
+                           Operator._make_generic_c,
+                           (self._generated(function, 'C++')[1], name, self._c_lib_tag, self._build_profile)))
+            if cuda_enabled:
+                builds.append(('CUDA' + description,
+                               Operator._generic_cuda_path(name, self._cuda_lib_tag, self._build_profile),
+                               Operator._make_generic_cuda,
+                               (self._generated(function, 'CUDA')[2], name, self._cuda_lib_tag, self._build_profile)))
+        return builds
+
+    def _without_inputs(self):
+        # a copy of this operator which shares its interpreted and generated code but none of its inputs and
+        # evaluation buffers, so that it can build its libraries without keeping the inputs alive
+        copy = object.__new__(self.__class__)
+        copy.__dict__.update(self.__dict__)
+        copy._inputs = None
+        copy._op_c_function = None
+        copy._op_cuda_function = None
+        copy._output_buffers = None
+        copy._output_params = None
+        copy._input_params = None
+        copy._active_eval_fcn = None
+        return copy
+
+    def _build_gradient(self):
+        # build the libraries of the gradient, returns the function names and library paths of the TensorFlow
+        # gradient operator
+        lib_paths = {}
+        results = []
+        for library, path, function, args in self._library_builds(['grad']):
+            logging.log(logging.DEBUG, 'Compiling generic ' + library + ' for Op ' + self.__class__.__name__)
+            lib_paths[library] = path
+            results.append(Operator._compile_async(function, args))
+        for result in results:
+            result.get()
+
+        cpu_grad_name = self.grad_name + '_generic_cpp'
+        gpu_grad_name = self.grad_name + '_generic_cuda' if cuda_enabled else ''
+        return cpu_grad_name, lib_paths['C++ gradient'], gpu_grad_name, lib_paths.get('CUDA gradient', '')
+
+    @staticmethod
+    def _compile_async(function, args):
+        # run a library build on the background compiler pool and return a result whose get() method waits for the
+        # build to finish. A build of the same library which is still in progress is shared instead of repeated.
+        # Finished builds are dropped, so only those in progress are kept.
+        for finished_key in [cur_key for cur_key, cur_result in Operator._compile_results.items()
+                             if cur_result.ready()]:
+            del Operator._compile_results[finished_key]
+
+        key = (function, args[1:])
+        result = Operator._compile_results.get(key)
+        if result is None:
+            if Operator._compile_pool is None:
+                Operator._compile_pool = ThreadPool(compile_jobs if compile_jobs > 0 else multiprocessing.cpu_count())
+            result = Operator._compile_pool.apply_async(function, args)
+            Operator._compile_results[key] = result
+        return result
+
+    @staticmethod
+    def wait_for_builds():
+        """
+        Wait until the libraries of all operators which were converted with ``as_tensorflow(wait_for_build=False)``
+        are built. This must be called before a TensorFlow session runs any of these operators.
+
+        :return: None
+        """
+        pending = Operator._pending_builds
+        Operator._pending_builds = []
+        for result in pending:
+            result.get()
+
+    def as_tensorflow(self, cuda_threads_per_block=_default_cuda_threads_per_block, wait_for_build=True):
         """
         Create a TensorFlow operator based on this operation and register it with the current TensorFlow Graph. The
         inputs to the operator must be numpy arrays or TensorFlow tensors. The operation will be evaluated later
         by the TensorFlow session.
 
         :param cuda_threads_per_block: number of cuda threads to use per thread block
+        :param wait_for_build: if True, wait until the libraries of this operator are built. Otherwise they are built
+            in the background while the graph is constructed, and Operator.wait_for_builds must be called before
+            the graph is run.
 
         :return: A TensorFlow operator.
         """
-        tf.logging.log(tf.logging.DEBUG, 'Compiling generic C++ for Op ' + self.__class__.__name__)
-        cpu_op_lib = Operator._make_generic_c(self.op_c_generic, self.op_name)
-        if cuda_enabled:
-            tf.logging.log(tf.logging.DEBUG, 'Compiling generic CUDA for Op ' + self.__class__.__name__)
-            cuda_op_lib = Operator._make_generic_cuda(self.op_cuda_generic, self.op_name)
-        else:
-            cuda_op_lib = ''
-
-        if self.grad_name is None:
-            gpu_grad_name = ''
-            gpu_grad_lib = ''
-            cpu_grad_name = ''
-            cpu_grad_lib = ''
-        else:
-            tf.logging.log(tf.logging.DEBUG, 'Compiling generic C++ for gradient of Op ' + self.__class__.__name__)
-            cpu_grad_lib = Operator._make_generic_c(self.grad_c_generic, self.grad_name)
-            cpu_grad_name = self.grad_name + '_generic_cpp'
+        # build the libraries of the operator concurrently
+        lib_paths = {}
+        results = []
+        for library, path, function, args in self._library_builds(['op']):
+            logging.log(logging.DEBUG, 'Compiling generic ' + library + ' for Op ' + self.__class__.__name__)
+            lib_paths[library] = path
+            results.append(Operator._compile_async(function, args))
+
+        cpu_op_lib = lib_paths['C++']
+        cuda_op_lib = lib_paths.get('CUDA', '')
+
+        # the gradient is interpreted to name its libraries, which are generated and built when TensorFlow first
+        # asks for them. Until then a copy of this operator without its inputs is kept to build them.
+        if self._has_gradient:
+            grad_name = self.grad_name
+            cpu_grad_name = grad_name + '_generic_cpp'
+            cpu_grad_lib = Operator._generic_c_path(grad_name, self._c_lib_tag, self._build_profile)
             if cuda_enabled:
-                tf.logging.log(tf.logging.DEBUG, 'Compiling generic CUDA for gradient of Op ' + self.__class__.__name__)
-                gpu_grad_lib = Operator._make_generic_cuda(self.grad_cuda_generic, self.grad_name)
-                gpu_grad_name = self.grad_name + '_generic_cuda'
+                gpu_grad_name = grad_name + '_generic_cuda'
+                gpu_grad_lib = Operator._generic_cuda_path(grad_name, self._cuda_lib_tag, self._build_profile)
             else:
                 gpu_grad_name = ''
                 gpu_grad_lib = ''
+            built = os.path.exists(cpu_grad_lib) and (gpu_grad_lib == '' or os.path.exists(gpu_grad_lib))
+            if not built and grad_name not in Operator._deferred_gradients:
+                Operator._deferred_gradients[grad_name] = self._without_inputs()
+        else:
+            cpu_grad_name = ''
+            cpu_grad_lib = ''
+            gpu_grad_name = ''
+            gpu_grad_lib = ''
 
         out_shapes = []
         out_types = []
@@ -831,6 +1193,13 @@ class Operator(object):
         Operator._register_shape_inference()
         Operator._load_dynamiclib_module()
         Operator._register_gradient()
+
+        if wait_for_build:
+            for result in results:
+                result.get()
+        else:
+            Operator._pending_builds.extend(results)
+
         tf_op = Operator._dynamiclibop_module.dynamic_lib(inputs=self._inputs,
                                                           out_shapes=out_shapes,
                                                           out_types=out_types,
@@ -0,0 +1,1102 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+"""
+Optimization passes over serialized expression dags. Each pass takes an ExpressionDAG protobuf and returns a new,
+equivalent one from which smaller code is generated. Passes must only emit dags which ExpressionDAG.from_proto can
+rebuild expression by expression, so a constant is always referenced through a cast to the type it is used as, just
+like the interpreter does.
+"""
+
+from __future__ import absolute_import
+import numpy as np
+
+from .expression import lang, DType
+
+_unary_codes = frozenset([lang.ACOS, lang.ASIN, lang.ATAN, lang.COS, lang.COSH, lang.SIN, lang.SINH, lang.TAN,
+                          lang.TANH, lang.EXP, lang.LOG, lang.LOG10, lang.SQRT, lang.CEIL, lang.FLOOR, lang.ABS,
+                          lang.NEGATE, lang.NOT])
+
+_binary_codes = frozenset([lang.ADD, lang.SUBTRACT, lang.MULTIPLY, lang.DIVIDE, lang.MODULO, lang.AND, lang.OR,
+                           lang.EQUAL, lang.NOTEQUAL, lang.LESS, lang.LESS_EQ, lang.GREATER, lang.GREATER_EQ,
+                           lang.MIN, lang.MAX, lang.POW, lang.ATAN2])
+
+# expressions without side effects, which can be removed when nothing refers to them
+_removable_codes = frozenset([lang.CONST_SCALAR, lang.CONST_TENSOR, lang.CAST, lang.READ_TENSOR, lang.WHERE]) | \
+    _unary_codes | _binary_codes
+
+# binary expressions whose operands can be swapped. The C expressions of the minimum and maximum only commute for
+# integers, since they tell apart -0 and +0 and propagate NaN depending on the order of their operands.
+_commutative_codes = frozenset([lang.ADD, lang.MULTIPLY, lang.EQUAL, lang.NOTEQUAL, lang.AND, lang.OR])
+
+_integer_dtypes = frozenset([lang.INT8, lang.INT16, lang.INT32, lang.INT64,
+                             lang.UINT8, lang.UINT16, lang.UINT32, lang.UINT64])
+
+_float_dtypes = frozenset([lang.FLOAT32, lang.FLOAT64])
+
+_unsigned_dtypes = frozenset([lang.UINT8, lang.UINT16, lang.UINT32, lang.UINT64])
+
+# the maximum number of expressions that unrolling a range may produce from its body
+_unroll_budget = 256
+
+# the maximum number of expressions in the branches of a conditional block which is turned into selections, all of
+# which are evaluated afterwards
+_select_budget = 32
+
+
+class _DAGBuilder(object):
+    """
+    Builds up a new expression dag from the expressions of an existing one, keeping track of where each of the
+    existing expressions ended up.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.dag = lang.ExpressionDAG()
+        self.dag.workgroup_shape.extend(source.workgroup_shape)
+        self.new_index = {}
+
+    def operands(self, index):
+        # new indices of the operands of an expression of the source dag
+        return [self.new_index[op] for op in self.source.references[index].operand_indices]
+
+    def add(self, expr, operands):
+        self.dag.expressions.add().CopyFrom(expr)
+        self.dag.references.add().operand_indices.extend(operands)
+        return len(self.dag.expressions) - 1
+
+    def add_scalar(self, code, dtype, operands):
+        expr = lang.Expression()
+        expr.code = code
+        expr.dtype = dtype
+        return self.add(expr, operands)
+
+
+def _reorder(expression_dag, order):
+    # copy the expressions of a dag in a new order, in which operands must still precede the expressions which refer
+    # to them
+    builder = _DAGBuilder(expression_dag)
+    for i in order:
+        builder.new_index[i] = builder.add(expression_dag.expressions[i], builder.operands(i))
+    return builder.dag
+
+
+def _select(expression_dag, keep):
+    # copy the expressions of a dag for which keep is True
+    builder = _DAGBuilder(expression_dag)
+    for i, expr in enumerate(expression_dag.expressions):
+        if keep[i]:
+            builder.new_index[i] = builder.add(expr, builder.operands(i))
+    return builder.dag
+
+
+def _remove_unused(expression_dag):
+    # remove side effect free expressions which nothing refers to. Operands always precede the expressions which
+    # refer to them, so a single backwards sweep finds all of them.
+    num_expressions = len(expression_dag.expressions)
+    users = [0]*num_expressions
+    for refs in expression_dag.references:
+        for op in refs.operand_indices:
+            users[op] += 1
+
+    keep = [True]*num_expressions
+    for i in range(num_expressions-1, -1, -1):
+        if users[i] == 0 and expression_dag.expressions[i].code in _removable_codes:
+            keep[i] = False
+            for op in expression_dag.references[i].operand_indices:
+                users[op] -= 1
+
+    return _select(expression_dag, keep)
+
+
+def _is_snapshot(dag, index):
+    # whether expression values refer to the value of this expression at the point where they are defined. This is
+    # not the case for variables, which are referred to by name and change when they are assigned to, and for
+    # constant scalars, which are only ever referred to through casts.
+    return dag.expressions[index].code not in (lang.VARIABLE, lang.CONST_SCALAR)
+
+
+def _constant_value(dag, index):
+    # the value of an expression which casts a constant, as the interpreter and the folding pass emit constants, or
+    # None if it is not one
+    expr = dag.expressions[index]
+    if expr.code == lang.CAST:
+        const = dag.expressions[dag.references[index].operand_indices[0]]
+        if const.code == lang.CONST_SCALAR:
+            if const.dtype == lang.INT64:
+                return _convert(int(const.sint64_data[0]), expr.dtype)
+            else:
+                return _convert(np.float64(const.double_data[0]), expr.dtype)
+    return None
+
+
+def _integer_range(dtype):
+    info = np.iinfo(DType(dtype).as_numpy())
+    return int(info.min), int(info.max), info.bits
+
+
+def _wrap(value, dtype):
+    # convert an integer to an integer type the way C does on the supported platforms, by truncating its two's
+    # complement representation
+    low, high, bits = _integer_range(dtype)
+    value %= 2**bits
+    if value > high:
+        value -= 2**bits
+    return value
+
+
+def _convert(value, dtype):
+    """
+    Convert a constant value to a data type with C semantics.
+
+    :return: the converted value, or None if C does not define the conversion
+    """
+    if dtype in _integer_dtypes:
+        if isinstance(value, np.floating):
+            if not np.isfinite(value):
+                return None
+            # floats are truncated towards zero, and converting them to a type which cannot hold the result is
+            # undefined
+            value = int(value)
+            low, high, bits = _integer_range(dtype)
+            if value < low or value > high:
+                return None
+            return value
+        return _wrap(value, dtype)
+    elif dtype in _float_dtypes:
+        return DType(dtype).as_numpy()(value)
+    else:
+        return None
+
+
+def _integer_result(value, dtype, wraps):
+    # the value of an integer operation stored into a variable of its type, or None if it overflows and C leaves
+    # the result undefined. Types narrower than int are promoted before the operation is applied, so only their
+    # multiplications can overflow.
+    low, high, bits = _integer_range(dtype)
+    if low <= value <= high:
+        return value
+    if bits < 32:
+        if -2**31 <= value < 2**31:
+            return _wrap(value, dtype)
+        return None
+    if low == 0 and wraps:
+        return _wrap(value, dtype)
+    return None
+
+
+def _fold_unary(code, value, dtype):
+    if dtype in _integer_dtypes:
+        if code == lang.NEGATE:
+            return _integer_result(-value, dtype, True)
+        elif code == lang.ABS:
+            return _integer_result(abs(value), dtype, True)
+        elif code == lang.NOT:
+            return int(value == 0)
+    elif dtype in _float_dtypes:
+        np_type = DType(dtype).as_numpy()
+        with np.errstate(all='ignore'):
+            if code == lang.NEGATE:
+                result = -value
+            elif code == lang.ABS:
+                result = np.abs(value)
+            elif code == lang.NOT:
+                result = value == 0
+            elif code == lang.CEIL:
+                result = np.ceil(value)
+            elif code == lang.FLOOR:
+                result = np.floor(value)
+            elif code == lang.SQRT:
+                result = np.sqrt(value)
+            else:
+                # transcendental functions are not folded, since libm does not necessarily round them like numpy
+                return None
+        result = np_type(result)
+        if np.isfinite(result):
+            return result
+    return None
+
+
+def _compare(code, x, y):
+    if code == lang.EQUAL:
+        return x == y
+    elif code == lang.NOTEQUAL:
+        return x != y
+    elif code == lang.LESS:
+        return x < y
+    elif code == lang.LESS_EQ:
+        return x <= y
+    elif code == lang.GREATER:
+        return x > y
+    elif code == lang.GREATER_EQ:
+        return x >= y
+    elif code == lang.AND:
+        return x != 0 and y != 0
+    elif code == lang.OR:
+        return x != 0 or y != 0
+    else:
+        return None
+
+
+def _fold_binary(code, x, y, dtype):
+    if dtype in _integer_dtypes:
+        comparison = _compare(code, x, y)
+        if comparison is not None:
+            return int(comparison)
+        elif code == lang.ADD:
+            return _integer_result(x + y, dtype, True)
+        elif code == lang.SUBTRACT:
+            return _integer_result(x - y, dtype, True)
+        elif code == lang.MULTIPLY:
+            return _integer_result(x * y, dtype, True)
+        elif code in (lang.DIVIDE, lang.MODULO):
+            if y == 0:
+                return None
+            # C rounds quotients towards zero, and leaves both results undefined if the quotient overflows
+            quotient = abs(x) // abs(y)
+            if (x < 0) != (y < 0):
+                quotient = -quotient
+            if _integer_result(quotient, dtype, False) is None:
+                return None
+            if code == lang.DIVIDE:
+                return _integer_result(quotient, dtype, False)
+            return x - y*quotient
+        elif code == lang.MIN:
+            return x if x < y else y
+        elif code == lang.MAX:
+            return x if x > y else y
+    elif dtype in _float_dtypes:
+        np_type = DType(dtype).as_numpy()
+        with np.errstate(all='ignore'):
+            comparison = _compare(code, x, y)
+            if comparison is not None:
+                result = comparison
+            elif code == lang.ADD:
+                result = x + y
+            elif code == lang.SUBTRACT:
+                result = x - y
+            elif code == lang.MULTIPLY:
+                result = x * y
+            elif code == lang.DIVIDE:
+                result = x / y
+            elif code == lang.MODULO:
+                result = np.fmod(x, y)
+            elif code == lang.MIN:
+                result = x if x < y else y
+            elif code == lang.MAX:
+                result = x if x > y else y
+            else:
+                return None
+        result = np_type(result)
+        if np.isfinite(result):
+            return result
+    return None
+
+
+class _ConstantFolder(object):
+    """
+    Rewrites a dag expression by expression, tracking the values of all expressions which are known at
+    interpretation time.
+    """
+    def __init__(self, expression_dag):
+        self.builder = _DAGBuilder(expression_dag)
+        self.dag = self.builder.dag
+        self.values = {}
+
+    def constant(self, value, dtype):
+        # add a constant of a type, returns its index or None if it cannot be represented in the dag
+        if value is None:
+            return None
+
+        const = lang.Expression()
+        const.code = lang.CONST_SCALAR
+        if dtype in _integer_dtypes:
+            if not -2**63 <= value < 2**63:
+                return None
+            const.dtype = lang.INT64
+            const.sint64_data.append(int(value))
+        else:
+            # constants are emitted with their python string representation, so they must survive the round trip
+            if float(str(float(value))) != float(value):
+                return None
+            const.dtype = lang.FLOAT64
+            const.double_data.append(float(value))
+
+        const_index = self.builder.add(const, [])
+        cast_index = self.builder.add_scalar(lang.CAST, dtype, [const_index])
+        self.values[cast_index] = value
+        return cast_index
+
+    def offset(self, code, dtype, operands):
+        # split an integer sum into its non-constant term and the constant which is added to it
+        if dtype in _integer_dtypes and code in (lang.ADD, lang.SUBTRACT):
+            x, y = operands
+            if y in self.values and x not in self.values:
+                return x, self.values[y] if code == lang.ADD else -self.values[y]
+            elif x in self.values and y not in self.values and code == lang.ADD:
+                return y, self.values[x]
+        return None, 0
+
+    def add_offset(self, base, total, dtype):
+        # add an expression which adds a constant to a base expression, returns its index or None if the constant
+        # cannot be represented
+        low, high, bits = _integer_range(dtype)
+        if low == 0:
+            # unsigned arithmetic is modular, so large offsets are better subtracted
+            total = _wrap(total, dtype)
+            if total > high // 2:
+                total -= 2**bits
+        if total == 0:
+            return base
+        if total < low or total > high:
+            return None
+
+        code = lang.ADD
+        if total < 0 and -total <= high:
+            code = lang.SUBTRACT
+            total = -total
+        const_index = self.constant(total, dtype)
+        if const_index is None:
+            return None
+        return self.builder.add_scalar(code, dtype, [base, const_index])
+
+    def fold(self, expr, operands):
+        # returns the index of an expression which is equivalent to expr, or None if expr has to be kept as it is
+        code = expr.code
+        values = [self.values.get(op) for op in operands]
+
+        if code == lang.CONST_SCALAR:
+            index = self.builder.add(expr, operands)
+            if expr.dtype == lang.INT64:
+                self.values[index] = int(expr.sint64_data[0])
+            else:
+                self.values[index] = np.float64(expr.double_data[0])
+            return index
+
+        elif code == lang.CAST:
+            source = self.dag.expressions[operands[0]]
+            if source.code == lang.CONST_SCALAR:
+                index = self.builder.add(expr, operands)
+                value = _convert(values[0], expr.dtype)
+                if value is not None:
+                    self.values[index] = value
+                return index
+            elif values[0] is not None:
+                return self.constant(_convert(values[0], expr.dtype), expr.dtype)
+            elif source.dtype == expr.dtype and _is_snapshot(self.dag, operands[0]):
+                return operands[0]
+
+        elif code in _unary_codes:
+            if values[0] is not None:
+                return self.constant(_fold_unary(code, values[0], expr.dtype), expr.dtype)
+
+        elif code == lang.WHERE:
+            condition, x, y = operands
+            if values[0] is not None or x == y:
+                selected = x if x == y or values[0] != 0 else y
+                if _is_snapshot(self.dag, selected):
+                    return selected
+
+        elif code in _binary_codes:
+            x, y = operands
+            x_value, y_value = values
+            if x_value is not None and y_value is not None:
+                return self.constant(_fold_binary(code, x_value, y_value, expr.dtype), expr.dtype)
+
+            # algebraic identities. For floats, adding zero turns -0 into +0 and is not an identity.
+            is_integer = expr.dtype in _integer_dtypes
+            if code == lang.ADD and is_integer:
+                if y_value == 0 and _is_snapshot(self.dag, x):
+                    return x
+                if x_value == 0 and _is_snapshot(self.dag, y):
+                    return y
+            elif code == lang.SUBTRACT:
+                if y_value == 0 and (is_integer or not np.signbit(y_value)) and _is_snapshot(self.dag, x):
+                    return x
+            elif code == lang.MULTIPLY:
+                if y_value == 1 and _is_snapshot(self.dag, x):
+                    return x
+                if x_value == 1 and _is_snapshot(self.dag, y):
+                    return y
+                if is_integer and (x_value == 0 or y_value == 0):
+                    return self.constant(0, expr.dtype)
+            elif code == lang.DIVIDE:
+                if y_value == 1 and _is_snapshot(self.dag, x):
+                    return x
+
+            # merge the constants of nested integer sums, e.g. (x - 2) + 5 into x + 3
+            base, total = self.offset(code, expr.dtype, operands)
+            if base is not None:
+                inner = self.dag.expressions[base]
+                inner_base, inner_total = self.offset(inner.code, inner.dtype,
+                                                      self.dag.references[base].operand_indices)
+                if inner_base is not None and _is_snapshot(self.dag, inner_base):
+                    return self.add_offset(inner_base, inner_total + total, expr.dtype)
+
+        return None
+
+    def run(self):
+        for i, expr in enumerate(self.builder.source.expressions):
+            operands = self.builder.operands(i)
+            index = self.fold(expr, operands)
+            if index is None:
+                index = self.builder.add(expr, operands)
+            self.builder.new_index[i] = index
+        return self.dag
+
+
+def fold_constants(expression_dag):
+    """
+    Evaluate the expressions of a dag whose values are known at interpretation time, and simplify algebraic
+    identities such as x*1 and x+0. Constant offsets of integer sums, which commonly arise from index arithmetic,
+    are merged into one.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :return: the optimized ExpressionDAG protobuf
+    """
+    return _remove_unused(_ConstantFolder(expression_dag).run())
+
+
+def _written_in_loop(expression_dag, loop_index):
+    # the variables and tensors which are assigned to anywhere in the body of a range or while loop, including the
+    # index of a range
+    written = set()
+    depth = 0
+    for i in range(loop_index, len(expression_dag.expressions)):
+        code = expression_dag.expressions[i].code
+        if code in (lang.RANGE, lang.ASSIGN_VARIABLE, lang.ASSIGN_TENSOR):
+            written.add(expression_dag.references[i].operand_indices[0])
+        if code in (lang.RANGE, lang.WHILE):
+            depth += 1
+        elif code in (lang.ENDRANGE, lang.ENDWHILE):
+            depth -= 1
+            if depth == 0:
+                break
+    return written
+
+
+def _exits_loop(expression_dag, loop_index, end_index):
+    # whether the body of a loop, or of a loop nested in it, contains a break or continue expression
+    return any(expression_dag.expressions[i].code in (lang.BREAK, lang.CONTINUE)
+               for i in range(loop_index + 1, end_index))
+
+
+def eliminate_common_subexpressions(expression_dag):
+    """
+    Merge side effect free expressions which compute the same value. An expression is replaced by an identical one
+    which precedes it in the same or an enclosing block, as long as none of the variables and local tensors it
+    depends on may have been assigned to in between.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :return: the optimized ExpressionDAG protobuf
+    """
+    builder = _DAGBuilder(expression_dag)
+    dag = builder.dag
+
+    # the expressions available in each enclosing block, keyed by their content and operands, and the variables and
+    # local tensors which the value of each expression depends on
+    scopes = [{}]
+    dependencies = {}
+
+    def invalidate(locations):
+        for scope in scopes:
+            for key in [key for key, index in scope.items() if dependencies[index] & locations]:
+                del scope[key]
+
+    for i, expr in enumerate(expression_dag.expressions):
+        operands = builder.operands(i)
+        code = expr.code
+
+        if code in _removable_codes:
+            if code in _commutative_codes and (code not in (lang.MIN, lang.MAX) or expr.dtype in _integer_dtypes):
+                key = expr.SerializeToString(), tuple(sorted(operands))
+            else:
+                key = expr.SerializeToString(), tuple(operands)
+
+            for scope in reversed(scopes):
+                if key in scope:
+                    builder.new_index[i] = scope[key]
+                    break
+            else:
+                index = builder.add(expr, operands)
+                builder.new_index[i] = index
+
+                depends_on = set()
+                for op in operands:
+                    depends_on |= dependencies.get(op, frozenset())
+                    if dag.expressions[op].code == lang.VARIABLE:
+                        depends_on.add(op)
+                if code == lang.READ_TENSOR and dag.expressions[operands[0]].code == lang.TENSOR:
+                    depends_on.add(operands[0])
+                dependencies[index] = frozenset(depends_on)
+                scopes[-1][key] = index
+            continue
+
+        builder.new_index[i] = builder.add(expr, operands)
+        if code in (lang.ASSIGN_VARIABLE, lang.ASSIGN_TENSOR):
+            invalidate(set([operands[0]]))
+        elif code in (lang.RANGE, lang.WHILE):
+            # the body of a loop is repeated, so values it assigns to anywhere differ between iterations
+            written = _written_in_loop(expression_dag, i)
+            invalidate(set(builder.new_index[w] for w in written if w in builder.new_index))
+            scopes.append({})
+        elif code == lang.IF:
+            scopes.append({})
+        elif code in (lang.ELSEIF, lang.ELSE):
+            scopes[-1] = {}
+        elif code in (lang.ENDRANGE, lang.ENDWHILE, lang.ENDIF):
+            scopes.pop()
+
+    return dag
+
+
+def _control_blocks(expression_dag):
+    # group the expressions which open, continue and close each range, while loop and conditional block. Returns
+    # the control expressions of each block, the block each control expression belongs to, and the innermost block
+    # which encloses each expression.
+    blocks = []
+    member_of = {}
+    enclosing = []
+    open_blocks = []
+    for i, expr in enumerate(expression_dag.expressions):
+        code = expr.code
+        if code in (lang.RANGE, lang.WHILE, lang.IF):
+            enclosing.append(open_blocks[-1] if open_blocks else None)
+            open_blocks.append(len(blocks))
+            blocks.append([])
+        elif code in (lang.ELSEIF, lang.ELSE, lang.ENDRANGE, lang.ENDWHILE, lang.ENDIF):
+            enclosing.append(open_blocks[-2] if len(open_blocks) > 1 else None)
+        else:
+            enclosing.append(open_blocks[-1] if open_blocks else None)
+            continue
+
+        member_of[i] = open_blocks[-1]
+        blocks[open_blocks[-1]].append(i)
+        if code in (lang.ENDRANGE, lang.ENDWHILE, lang.ENDIF):
+            open_blocks.pop()
+    return blocks, member_of, enclosing
+
+
+def eliminate_dead_code(expression_dag):
+    """
+    Remove all expressions which do not contribute to the outputs. An expression is live if an assignment or atomic
+    addition to an output depends on it, directly or through the variables and local tensors it is assigned to.
+    Loops and conditional blocks are live if anything inside them is, and so are the blocks which break out of or
+    continue loops. Variables and local tensors which are never read are removed along with all assignments to them.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :return: the optimized ExpressionDAG protobuf
+    """
+    expressions = expression_dag.expressions
+    references = expression_dag.references
+    blocks, member_of, enclosing = _control_blocks(expression_dag)
+
+    # the expressions which assign to each variable and local tensor
+    writers = {}
+    for i, expr in enumerate(expressions):
+        if expr.code in (lang.ASSIGN_VARIABLE, lang.ASSIGN_TENSOR, lang.RANGE):
+            writers.setdefault(references[i].operand_indices[0], []).append(i)
+
+    live = set()
+    read = set()
+    pending = []
+
+    def mark(index):
+        if index not in live:
+            live.add(index)
+            pending.append(index)
+
+    for i, expr in enumerate(expressions):
+        if expr.code in (lang.INPUT, lang.OUTPUT, lang.POSITION):
+            mark(i)
+        elif expr.code == lang.ASSIGN_TENSOR and expressions[references[i].operand_indices[0]].code == lang.OUTPUT:
+            mark(i)
+        elif expr.code in (lang.ATOMIC_ADD, lang.BREAK, lang.CONTINUE):
+            mark(i)
+
+    while pending:
+        i = pending.pop()
+        code = expressions[i].code
+
+        # an expression inside a block needs the whole block, and the blocks enclosing it
+        if enclosing[i] is not None:
+            for control in blocks[enclosing[i]]:
+                mark(control)
+        if i in member_of:
+            for control in blocks[member_of[i]]:
+                mark(control)
+
+        for slot, op in enumerate(references[i].operand_indices):
+            mark(op)
+            # assignments only need their target to be declared. Once it is read, all assignments to it are live.
+            if slot == 0 and code in (lang.ASSIGN_VARIABLE, lang.ASSIGN_TENSOR, lang.ATOMIC_ADD):
+                continue
+            if op not in read:
+                read.add(op)
+                for writer in writers.get(op, []):
+                    mark(writer)
+
+    return _select(expression_dag, [i in live for i in range(len(expressions))])
+
+
+def _select_block(expression_dag, if_index):
+    # turn a conditional block whose branches only compute values and assign them into selections between the
+    # values. An assignment to a variable becomes an assignment of a selection between the value and the variable
+    # itself, which only changes it if the branch is taken, so the branches can be evaluated one after another. An
+    # element of a tensor must be assigned in every branch, and the selection between its values is assigned after
+    # the last branch.
+    expressions = expression_dag.expressions
+    references = expression_dag.references
+    blocks, member_of, enclosing = _control_blocks(expression_dag)
+    controls = blocks[member_of[if_index]]
+    end_index = controls[-1]
+    if end_index - if_index + 1 - len(controls) > _select_budget:
+        return expression_dag
+
+    # the condition of each branch, which is None for an else branch
+    conditions = []
+    branches = []
+    for control, next_control in zip(controls[:-1], controls[1:]):
+        if expressions[control].code == lang.ELSE:
+            conditions.append(None)
+        else:
+            conditions.append(references[control].operand_indices[0])
+        branches.append(range(control + 1, next_control))
+
+    # all other expressions of the branches are evaluated whether the branch is taken or not, so they must neither
+    # read tensors nor divide integers by values they may fault for
+    written = set()
+    reads = set()
+    tensor_writes = []
+    for branch in branches:
+        writes = []
+        for i in branch:
+            code = expressions[i].code
+            operands = references[i].operand_indices
+            if code == lang.ASSIGN_VARIABLE:
+                written.add(operands[0])
+            elif code == lang.ASSIGN_TENSOR:
+                written.add(operands[0])
+                writes.append((operands[0], operands[1], operands[2]))
+            elif code not in _removable_codes:
+                return expression_dag
+            elif code == lang.READ_TENSOR:
+                if expressions[operands[1]].code != lang.CONST_SCALAR and \
+                        _constant_value(expression_dag, operands[1]) is None:
+                    return expression_dag
+                reads.add(operands[0])
+            elif code in (lang.DIVIDE, lang.MODULO) and expressions[i].dtype in _integer_dtypes and \
+                    not _constant_value(expression_dag, operands[1]):
+                return expression_dag
+        tensor_writes.append(writes)
+
+    # the conditions and the elements assigned must not change within the block, nor the values assigned to
+    # tensors, which are only assigned after the last branch
+    if any(condition in written for condition in conditions) or reads & written:
+        return expression_dag
+    elements = [(tensor, index) for tensor, index, value in tensor_writes[0]]
+    if any(tensor_writes):
+        if conditions[-1] is not None or len(set(elements)) != len(elements):
+            return expression_dag
+        for writes in tensor_writes:
+            if [(tensor, index) for tensor, index, value in writes] != elements or \
+                    any(index in written or value in written for tensor, index, value in writes):
+                return expression_dag
+
+    builder = _DAGBuilder(expression_dag)
+    for i in range(if_index):
+        builder.new_index[i] = builder.add(expressions[i], builder.operands(i))
+
+    def select(condition, x, y, dtype):
+        return builder.add_scalar(lang.WHERE, dtype, [builder.new_index[condition], x, y])
+
+    tensor_values = {}
+    for branch_index, branch in enumerate(branches):
+        for i in branch:
+            code = expressions[i].code
+            operands = builder.operands(i)
+            if code == lang.ASSIGN_TENSOR:
+                tensor_values.setdefault(tuple(references[i].operand_indices[:2]), []).append(operands[2])
+            elif code == lang.ASSIGN_VARIABLE:
+                # the variable keeps its value unless this branch is taken, which requires that the conditions of
+                # the branches before it do not hold
+                variable, value = operands
+                dtype = expressions[references[i].operand_indices[0]].dtype
+                if conditions[branch_index] is not None:
+                    value = select(conditions[branch_index], value, variable, dtype)
+                for condition in reversed(conditions[:branch_index]):
+                    value = select(condition, variable, value, dtype)
+                builder.new_index[i] = builder.add(expressions[i], [variable, value])
+            else:
+                builder.new_index[i] = builder.add(expressions[i], operands)
+
+    for tensor, index in elements:
+        values = tensor_values[(tensor, index)]
+        dtype = expressions[tensor].tensor_type.dtype
+        value = values[-1]
+        for condition, branch_value in reversed(list(zip(conditions[:-1], values[:-1]))):
+            value = select(condition, branch_value, value, dtype)
+        builder.add_scalar(lang.ASSIGN_TENSOR, lang.UNDEFINED_TYPE,
+                           [builder.new_index[tensor], builder.new_index[index], value])
+
+    for i in range(end_index + 1, len(expressions)):
+        builder.new_index[i] = builder.add(expressions[i], builder.operands(i))
+
+    return builder.dag
+
+
+def select_branches(expression_dag):
+    """
+    Replace small conditional blocks whose branches only compute values and assign them by selections between the
+    values, which need no branches and so neither keep the compiler from vectorizing nor make CUDA threads
+    diverge. Variables may be assigned in any of the branches, while an element of a tensor must be assigned in
+    every branch of a block with an else branch. The branches must not read tensors at indices which are not
+    constant, or divide integers by values which are not, since they are evaluated whether they are taken or not.
+    Blocks are processed from the innermost outwards.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :return: the optimized ExpressionDAG protobuf
+    """
+    # replacing a block only changes the expressions within it, so the positions of the blocks which start before
+    # it do not change
+    if_indices = [i for i, expr in enumerate(expression_dag.expressions) if expr.code == lang.IF]
+    for if_index in reversed(if_indices):
+        expression_dag = _select_block(expression_dag, if_index)
+    return expression_dag
+
+
+def _trip_count(expression_dag, range_index):
+    # the number of iterations of a range if its bounds are constant, otherwise None
+    start, stop, step = [_constant_value(expression_dag, op)
+                         for op in expression_dag.references[range_index].operand_indices[1:]]
+    if start is None or stop is None or step is None:
+        return None
+    if step > 0 and start < stop:
+        return int(np.ceil((stop - start) / float(step)))
+    elif step < 0 and start > stop:
+        return int(np.ceil((start - stop) / float(-step)))
+    return 0
+
+
+def _hoist_from_range(expression_dag, range_index):
+    # move the loop invariant expressions at the top level of the body of a range in front of it
+    blocks, member_of, enclosing = _control_blocks(expression_dag)
+    block = member_of[range_index]
+    end_index = blocks[block][-1]
+    written = _written_in_loop(expression_dag, range_index)
+
+    # the body is only known to be evaluated at least once if the bounds are constant and it is not left early.
+    # Otherwise, reads and integer divisions, which may fault for values the body would never see, must not be
+    # evaluated speculatively.
+    speculative = not _trip_count(expression_dag, range_index) or _exits_loop(expression_dag, range_index, end_index)
+
+    invariant = set()
+    for i in range(range_index + 1, end_index):
+        expr = expression_dag.expressions[i]
+        operands = expression_dag.references[i].operand_indices
+        if enclosing[i] != block or expr.code not in _removable_codes:
+            continue
+        if speculative:
+            if expr.code == lang.READ_TENSOR:
+                continue
+            if expr.code in (lang.DIVIDE, lang.MODULO) and expr.dtype in _integer_dtypes and \
+                    not _constant_value(expression_dag, operands[1]):
+                continue
+        if all(op in invariant or (op < range_index and op not in written) for op in operands):
+            invariant.add(i)
+
+    if len(invariant) == 0:
+        return expression_dag
+
+    num_expressions = len(expression_dag.expressions)
+    order = list(range(range_index)) + sorted(invariant) + \
+        [i for i in range(range_index, num_expressions) if i not in invariant]
+    return _reorder(expression_dag, order)
+
+
+def hoist_loop_invariants(expression_dag):
+    """
+    Move expressions out of ranges whose value does not change between iterations, because they neither depend on
+    the range index nor on any variable or local tensor which is assigned to in the range. Ranges are processed
+    from the innermost outwards, so expressions move out of as many nested ranges as they are invariant in.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :return: the optimized ExpressionDAG protobuf
+    """
+    # hoisting out of a range only moves expressions within and in front of it, so the positions of the ranges
+    # which start before it do not change
+    range_indices = [i for i, expr in enumerate(expression_dag.expressions) if expr.code == lang.RANGE]
+    for range_index in reversed(range_indices):
+        expression_dag = _hoist_from_range(expression_dag, range_index)
+    return expression_dag
+
+
+def _unroll_range(expression_dag, range_index, factor):
+    # fully unroll a range with a constant number of iterations if it is small enough, or otherwise repeat its body
+    # factor times per iteration, followed by the remaining iterations
+    expressions = expression_dag.expressions
+    references = expression_dag.references
+    blocks, member_of, enclosing = _control_blocks(expression_dag)
+    end_index = blocks[member_of[range_index]][-1]
+    index_variable, start, stop, step = references[range_index].operand_indices
+    dtype = expressions[index_variable].dtype
+
+    # floating point indices accumulate rounding errors, which the unrolled values would not reproduce
+    trip_count = _trip_count(expression_dag, range_index)
+    if not trip_count or dtype not in _integer_dtypes or _assigns_index(expression_dag, range_index, end_index) or \
+            _exits_loop(expression_dag, range_index, end_index):
+        return expression_dag
+    start_value = _constant_value(expression_dag, start)
+    step_value = _constant_value(expression_dag, step)
+
+    body = range(range_index + 1, end_index)
+    if trip_count*len(body) <= _unroll_budget:
+        unrolled_trips = 0
+    elif 1 < factor <= trip_count and factor*len(body) <= _unroll_budget:
+        unrolled_trips = trip_count - trip_count % factor
+    else:
+        return expression_dag
+
+    builder = _DAGBuilder(expression_dag)
+    for i in range(range_index):
+        builder.new_index[i] = builder.add(expressions[i], builder.operands(i))
+
+    def constant(value):
+        const = lang.Expression()
+        const.code = lang.CONST_SCALAR
+        const.dtype = lang.INT64
+        const.sint64_data.append(_wrap(value, lang.INT64))
+        return builder.add_scalar(lang.CAST, dtype, [builder.add(const, [])])
+
+    def copy_body(index):
+        # copy the body for one iteration, in which the range index has the value of another expression
+        for i in body:
+            operands = [index if op == index_variable else builder.new_index[op] for op in references[i].operand_indices]
+            builder.new_index[i] = builder.add(expressions[i], operands)
+
+    new_index = builder.new_index[index_variable]
+    if unrolled_trips > 0:
+        unrolled_stop = constant(start_value + unrolled_trips*step_value)
+        builder.add(expressions[range_index], [new_index, builder.new_index[start], unrolled_stop,
+                                               constant(factor*step_value)])
+        for offset in range(factor):
+            if offset == 0:
+                copy_body(new_index)
+            else:
+                copy_body(builder.add_scalar(lang.ADD, dtype, [new_index, constant(offset*step_value)]))
+        builder.add(expressions[end_index], [])
+
+    for iteration in range(unrolled_trips, trip_count):
+        copy_body(constant(start_value + iteration*step_value))
+
+    # the index is left with the value it has after the last iteration
+    builder.add_scalar(lang.ASSIGN_VARIABLE, lang.UNDEFINED_TYPE,
+                       [new_index, constant(start_value + trip_count*step_value)])
+
+    for i in range(end_index + 1, len(expressions)):
+        builder.new_index[i] = builder.add(expressions[i], builder.operands(i))
+
+    return builder.dag
+
+
+def unroll_ranges(expression_dag, factor):
+    """
+    Unroll ranges with an integer index and a constant number of iterations. A range whose unrolled body is small
+    enough is replaced by a copy of its body for each iteration, in which the index is a constant. Otherwise, the
+    body is repeated factor times in each iteration of a range with a factor times larger step, and the iterations
+    which remain are fully unrolled after it. Ranges which contain break or continue expressions are not unrolled.
+    Ranges are processed from the innermost outwards.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :param factor: the number of times bodies of ranges which are too large to be fully unrolled are repeated, 1
+      only unrolls ranges fully and 0 does not unroll any
+    :return: the optimized ExpressionDAG protobuf
+    """
+    if factor == 0:
+        return expression_dag
+
+    # unrolling a range only changes the expressions within it, so the positions of the ranges which start before
+    # it do not change until the expressions it leaves unused are removed
+    range_indices = [i for i, expr in enumerate(expression_dag.expressions) if expr.code == lang.RANGE]
+    for range_index in reversed(range_indices):
+        expression_dag = _unroll_range(expression_dag, range_index, factor)
+    return _remove_unused(expression_dag)
+
+
+def _assigns_index(expression_dag, range_index, end_index):
+    # whether the body of a range assigns to its index, other than the range itself
+    index_variable = expression_dag.references[range_index].operand_indices[0]
+    for i in range(range_index + 1, end_index):
+        if expression_dag.expressions[i].code in (lang.ASSIGN_VARIABLE, lang.RANGE) and \
+                expression_dag.references[i].operand_indices[0] == index_variable:
+            return True
+    return False
+
+
+def _index_coefficients(expression_dag, range_index, end_index):
+    # find the integer expressions in the body of a range which are affine functions of its integer index.
+    # Unsigned arithmetic is modular, so a sum of index multiples and values which do not change in the range
+    # advances by a constant from one iteration to the next. Signed arithmetic only differs where it overflows,
+    # which C leaves undefined, and casts to unsigned types which are not wider are modular as well. Returns the
+    # coefficient of the index in each of them, including the index itself.
+    expressions = expression_dag.expressions
+    references = expression_dag.references
+    index_variable = references[range_index].operand_indices[0]
+    written = _written_in_loop(expression_dag, range_index)
+
+    coefficients = {index_variable: 1}
+    for i in range(range_index + 1, end_index):
+        expr = expressions[i]
+        operands = references[i].operand_indices
+        if expr.dtype not in _integer_dtypes:
+            continue
+        modulus = 2**_integer_range(expr.dtype)[2]
+
+        coefficient = None
+        if expr.code == lang.CAST:
+            source = expressions[operands[0]].dtype
+            if operands[0] in coefficients and expr.dtype in _unsigned_dtypes and \
+                    _integer_range(expr.dtype)[2] <= _integer_range(source)[2]:
+                coefficient = coefficients[operands[0]]
+        elif expr.code in (lang.ADD, lang.SUBTRACT):
+            terms = []
+            for op in operands:
+                if op in coefficients:
+                    terms.append(coefficients[op])
+                elif op < range_index and op not in written:
+                    terms.append(0)
+            if len(terms) == 2 and (operands[0] in coefficients or operands[1] in coefficients):
+                coefficient = terms[0] + terms[1] if expr.code == lang.ADD else terms[0] - terms[1]
+        elif expr.code == lang.MULTIPLY:
+            x, y = operands
+            if y in coefficients:
+                x, y = y, x
+            factor = _constant_value(expression_dag, y)
+            if x in coefficients and factor is not None:
+                coefficient = coefficients[x]*factor
+
+        if coefficient is not None:
+            coefficients[i] = coefficient % modulus
+    return coefficients
+
+
+def _reduce_in_range(expression_dag, range_index):
+    # replace the affine tensor indices in the body of a range by variables which are advanced at the end of each
+    # iteration
+    expressions = expression_dag.expressions
+    references = expression_dag.references
+    blocks, member_of, enclosing = _control_blocks(expression_dag)
+    end_index = blocks[member_of[range_index]][-1]
+    index_variable, start, stop, step = references[range_index].operand_indices
+
+    # a continue expression would skip advancing the indices at the end of the iteration
+    step_value = _constant_value(expression_dag, step)
+    if step_value is None or expressions[index_variable].dtype not in _integer_dtypes or \
+            _assigns_index(expression_dag, range_index, end_index) or \
+            _exits_loop(expression_dag, range_index, end_index):
+        return expression_dag
+
+    # only unsigned indices which take more than a cast of the range index to compute are worth a variable
+    coefficients = _index_coefficients(expression_dag, range_index, end_index)
+    indices = set()
+    for i in range(range_index + 1, end_index):
+        if expressions[i].code in (lang.READ_TENSOR, lang.ASSIGN_TENSOR, lang.ATOMIC_ADD):
+            index = references[i].operand_indices[1]
+            if index in coefficients and expressions[index].dtype in _unsigned_dtypes and \
+                    (expressions[index].code != lang.CAST or references[index].operand_indices[0] != index_variable):
+                indices.add(index)
+    if len(indices) == 0:
+        return expression_dag
+
+    builder = _DAGBuilder(expression_dag)
+    for i in range(range_index):
+        builder.new_index[i] = builder.add(expressions[i], builder.operands(i))
+
+    # the initial value of each index is computed in front of the range from its start
+    initial = {}
+
+    def evaluate_at_start(i):
+        if i == index_variable:
+            return builder.new_index[start]
+        if i < range_index:
+            return builder.new_index[i]
+        if i not in initial:
+            initial[i] = builder.add(expressions[i], [evaluate_at_start(op) for op in references[i].operand_indices])
+        return initial[i]
+
+    zero = lang.Expression()
+    zero.code = lang.CONST_SCALAR
+    zero.dtype = lang.INT64
+    zero.sint64_data.append(0)
+
+    offsets = {}
+    for index in sorted(indices):
+        dtype = expressions[index].dtype
+        variable = builder.add_scalar(lang.VARIABLE, dtype, [builder.add(zero, [])])
+        builder.add_scalar(lang.ASSIGN_VARIABLE, lang.UNDEFINED_TYPE, [variable, evaluate_at_start(index)])
+        offsets[index] = variable
+
+    for i in range(range_index, end_index):
+        if i in offsets:
+            builder.new_index[i] = offsets[i]
+        else:
+            builder.new_index[i] = builder.add(expressions[i], builder.operands(i))
+
+    for index, variable in sorted(offsets.items()):
+        dtype = expressions[index].dtype
+        increment = lang.Expression()
+        increment.code = lang.CONST_SCALAR
+        increment.dtype = lang.INT64
+        increment.sint64_data.append(_wrap(coefficients[index]*step_value, lang.INT64))
+        increment_index = builder.add_scalar(lang.CAST, dtype, [builder.add(increment, [])])
+        advanced = builder.add_scalar(lang.ADD, dtype, [variable, increment_index])
+        builder.add_scalar(lang.ASSIGN_VARIABLE, lang.UNDEFINED_TYPE, [variable, advanced])
+
+    for i in range(end_index, len(expressions)):
+        builder.new_index[i] = builder.add(expressions[i], builder.operands(i))
+
+    return builder.dag
+
+
+def reduce_index_strength(expression_dag):
+    """
+    Replace the tensor indices in the body of a range which are affine in its index, such as the
+    cast(i, uint64)*stride + offset sums tensor indexing generates, by variables that are initialized in front of
+    the range and advanced by a constant at the end of each iteration. Ranges are processed from the innermost
+    outwards, and only ranges with a constant step which contain no break or continue expressions are reduced.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :return: the optimized ExpressionDAG protobuf
+    """
+    # reducing a range only adds expressions within and in front of it, so the positions of the ranges which start
+    # before it do not change until the expressions it leaves unused are removed
+    range_indices = [i for i, expr in enumerate(expression_dag.expressions) if expr.code == lang.RANGE]
+    for range_index in reversed(range_indices):
+        expression_dag = _reduce_in_range(expression_dag, range_index)
+    return _remove_unused(expression_dag)
+
+
+def optimize(expression_dag, unroll_factor=1):
+    """
+    Run all optimization passes over a dag.
+
+    :param expression_dag: the ExpressionDAG protobuf
+    :param unroll_factor: the factor by which ranges which are too large to be fully unrolled are unrolled, see
+      unroll_ranges
+    :return: the optimized ExpressionDAG protobuf
+    """
+    expression_dag = select_branches(eliminate_common_subexpressions(fold_constants(expression_dag)))
+    expression_dag = unroll_ranges(hoist_loop_invariants(expression_dag), unroll_factor)
+
+    # unrolled bodies use constant indices, which fold, and share subexpressions between iterations
+    expression_dag = eliminate_common_subexpressions(fold_constants(expression_dag))
+    expression_dag = reduce_index_strength(hoist_loop_invariants(expression_dag))
+
+    # the initial values of reduced indices often fold, and the increments are constants which can be hoisted
+    return eliminate_dead_code(hoist_loop_invariants(fold_constants(expression_dag)))
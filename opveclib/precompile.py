@@ -0,0 +1,175 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+"""
+Ahead of time compilation of operator libraries, so that the first evaluation of an operator does not have to wait
+for the compiler. Operators declare the input signatures to precompile in a ``precompile_signatures`` class
+attribute. Each signature is a tuple of input tensor types, optionally followed by a dict of constants:
+
+.. code-block:: python
+
+    class Scale(Operator):
+        precompile_signatures = [(TensorType([1024], float32),),
+                                 (TensorType([1024], float64), {'factor': 2.0})]
+
+        def op(self, x, factor=1.0):
+            ...
+
+All libraries of all operators in the given modules are then built by a pool of parallel compiler processes:
+
+.. code-block:: console
+
+    python -m opveclib.precompile --jobs 8 --report report.json mypackage.ops
+"""
+
+from __future__ import print_function
+import argparse
+import importlib
+import inspect
+import json
+import multiprocessing
+import sys
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from .operator import Operator
+from .expression import TensorType
+
+
+def find_operators(module):
+    """
+    Find the operators defined in a module which declare signatures to precompile.
+
+    :param module: the module
+    :return: list of operator classes, in the order they are defined in
+    """
+    operators = []
+    for name, value in inspect.getmembers(module, inspect.isclass):
+        if issubclass(value, Operator) and value is not Operator and value.__module__ == module.__name__:
+            operators.append(value)
+
+    def line_of(cls):
+        try:
+            return inspect.getsourcelines(cls)[1]
+        except (IOError, TypeError):
+            return 0
+
+    return sorted(operators, key=line_of)
+
+
+def _split_signature(signature):
+    signature = tuple(signature)
+    if len(signature) > 0 and isinstance(signature[-1], dict):
+        return signature[:-1], signature[-1]
+    else:
+        return signature, {}
+
+
+def _describe_signature(inputs, constants):
+    types = []
+    for inp in inputs:
+        t = TensorType.like(inp)
+        types.append({'shape': list(t.shape), 'dtype': t.dtype.as_numpy().__name__})
+    return {'inputs': types, 'constants': dict((name, repr(value)) for name, value in constants.items())}
+
+
+def precompile(modules, jobs=None):
+    """
+    Build the libraries of all operators in a list of modules for their declared signatures.
+
+    :param modules: list of modules
+    :param jobs: number of libraries that are built in parallel, defaults to the number of cores
+    :return: a report, which is a list with one dict for each operator signature, library or error
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    def build(function, args):
+        start = time.time()
+        try:
+            path = function(*args)
+        except Exception:
+            return {'status': 'failed', 'error': traceback.format_exc(), 'seconds': time.time() - start}
+        return {'status': 'built', 'path': path, 'seconds': time.time() - start}
+
+    # operators are interpreted one after another since the expression DAG is shared, only compilation is parallel
+    report = []
+    pending = []
+    pool = ThreadPool(jobs)
+    try:
+        for module in modules:
+            for cls in find_operators(module):
+                operator_name = module.__name__ + '.' + cls.__name__
+                signatures = getattr(cls, 'precompile_signatures', None)
+                if not signatures:
+                    report.append({'operator': operator_name, 'status': 'skipped',
+                                   'error': 'no precompile_signatures declared'})
+                    continue
+
+                for signature in signatures:
+                    inputs, constants = _split_signature(signature)
+                    entry = {'operator': operator_name, 'signature': _describe_signature(inputs, constants)}
+                    try:
+                        op = cls(*inputs, **constants)
+                    except Exception:
+                        entry.update({'status': 'failed', 'error': traceback.format_exc()})
+                        report.append(entry)
+                        continue
+
+                    for library, path, function, args in op._library_builds():
+                        library_entry = dict(entry, library=library)
+                        report.append(library_entry)
+                        pending.append((library_entry, pool.apply_async(build, (function, args))))
+
+        for library_entry, result in pending:
+            library_entry.update(result.get())
+    finally:
+        pool.close()
+        pool.join()
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m opveclib.precompile',
+                                     description='Build the libraries of operators ahead of time.')
+    parser.add_argument('modules', nargs='+', help='modules which define the operators to build')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of libraries built in parallel, defaults to the number of cores')
+    parser.add_argument('-r', '--report', default='precompile_report.json',
+                        help='path of the JSON report which is written (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('jobs must be a positive int')
+
+    modules = [importlib.import_module(name) for name in args.modules]
+    report = precompile(modules, args.jobs)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+    failed = 0
+    for entry in report:
+        description = entry['operator'] + ' ' + entry.get('library', '')
+        if entry['status'] == 'built':
+            print('built   %s in %.1f s' % (description, entry['seconds']))
+        elif entry['status'] == 'skipped':
+            print('skipped %s: %s' % (description, entry['error']))
+        else:
+            failed += 1
+            print('failed  %s\n%s' % (description, entry['error']))
+    print('report written to ' + args.report)
+
+    return 1 if failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
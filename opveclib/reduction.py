@@ -0,0 +1,329 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+"""
+Reductions of a tensor along an axis. A reduction is evaluated hierarchically as a sequence of operators: each
+worker of a stage reduces a contiguous chunk of the axis to a partial result, and the partial results are reduced
+by the next stage until a single one is left. On the CPU a stage of partials is followed by a single combining stage,
+on CUDA the chunks are kept small and the partials are reduced as a tree of stages.
+"""
+
+from __future__ import absolute_import
+import numpy as np
+
+from .expression import DType, TensorType, int64, float32, float64, position_in, output, variable, cast, where, arange, minimum, maximum
+from .operator import Operator
+
+# the number of workers below which the axis of a reduction evaluated by the C++ operators is split into chunks
+_cpu_workers = 64
+
+# the smallest chunk that the C++ operators reduce per worker
+_cpu_min_chunk = 256
+
+# the number of workers below which the axis of a reduction evaluated by the CUDA operators is split into chunks
+_cuda_workers = 8192
+
+# the number of partial results combined by each worker of a stage of the CUDA operators
+_cuda_fan_in = 64
+
+_kinds = ['sum', 'max', 'min']
+
+
+def _chunks(length, num_outputs, min_workers, fan_in):
+    # the chunk lengths reduced by the successive stages of a reduction of an axis of the given length. The axis is
+    # split as long as there are too few outputs to keep the workers busy, the last stage reduces what is left.
+    chunks = []
+    while num_outputs < min_workers and length > fan_in:
+        chunks.append(fan_in)
+        length = (length + fan_in - 1) // fan_in
+    chunks.append(length)
+    return chunks
+
+
+def _reduce_chunks(x, kind, axis, chunk, final, dtype=None, arg=False, index=None):
+    # reduce each chunk of the axis of x. Arg reductions also return the positions of the extremes along the axis.
+    # If index is not None, x holds partial results of an arg reduction and index the positions they were found at.
+    length = x.shape[axis]
+    num_chunks = (length + chunk - 1) // chunk
+    workgroup_shape = list(x.shape)
+    workgroup_shape[axis] = num_chunks
+    pos = position_in(workgroup_shape)
+
+    def resolve_position(axis_n):
+        return [axis_n if cur_dim == axis else pos[cur_dim] for cur_dim in range(x.rank)]
+
+    # the final stage drops the reduced axis
+    if final:
+        out_shape = [num_elements for cur_dim, num_elements in enumerate(x.shape) if cur_dim != axis]
+        out_pos = [pos[cur_dim] for cur_dim in range(x.rank) if cur_dim != axis]
+        if len(out_shape) == 0:
+            out_shape = [1]
+            out_pos = [pos[axis]]
+    else:
+        out_shape = workgroup_shape
+        out_pos = pos
+
+    if num_chunks == 1:
+        begin = 0
+        end = length
+    else:
+        begin = pos[axis]*chunk
+        if length % chunk == 0:
+            end = begin + chunk
+        else:
+            end = minimum(begin + chunk, length)
+
+    def value_at(axis_n):
+        if dtype is None or dtype == x.dtype:
+            return x[resolve_position(axis_n)]
+        else:
+            return cast(x[resolve_position(axis_n)], dtype)
+
+    accum_dtype = x.dtype if dtype is None else dtype
+    accum = variable(value_at(begin), accum_dtype)
+    out = output(out_shape, accum_dtype)
+
+    if kind == 'sum':
+        for i in arange(begin + 1, end):
+            accum <<= accum + value_at(i)
+        out[out_pos] = accum
+        return out
+    elif not arg and kind == 'max':
+        for i in arange(begin + 1, end):
+            accum <<= maximum(accum, value_at(i))
+        out[out_pos] = accum
+        return out
+    elif not arg and kind == 'min':
+        for i in arange(begin + 1, end):
+            accum <<= minimum(accum, value_at(i))
+        out[out_pos] = accum
+        return out
+
+    # keep the first of equal extremes, like numpy does. Chunks are reduced in order, so comparing strictly also
+    # keeps the first one when partial results are combined.
+    if index is not None:
+        accum_arg = variable(index[resolve_position(begin)], int64)
+    elif num_chunks == 1:
+        accum_arg = variable(0, int64)
+    else:
+        accum_arg = variable(cast(begin, int64), int64)
+    arg_out = output(out_shape, int64)
+
+    for i in arange(begin + 1, end):
+        cur = value_at(i)
+        if kind == 'max':
+            better = cur > accum
+        else:
+            better = cur < accum
+        if index is None:
+            accum_arg <<= where(better, cast(i, int64), accum_arg)
+        else:
+            accum_arg <<= where(better, index[resolve_position(i)], accum_arg)
+        accum <<= where(better, cur, accum)
+
+    out[out_pos] = accum
+    arg_out[out_pos] = accum_arg
+    return out, arg_out
+
+
+class _Reduce(Operator):
+    def op(self, x, kind, axis, chunk, final, dtype):
+        return _reduce_chunks(x, kind, axis, chunk, final, dtype=dtype)
+
+
+class _ArgReduce(Operator):
+    def op(self, x, kind, axis, chunk, final):
+        return _reduce_chunks(x, kind, axis, chunk, final, arg=True)
+
+
+class _ArgCombine(Operator):
+    def op(self, x, index, kind, axis, chunk, final):
+        return _reduce_chunks(x, kind, axis, chunk, final, arg=True, index=index)
+
+
+class Reduction(object):
+    """
+    A reduction of a tensor along an axis, which is evaluated as a sequence of operators. The input tensor must be a
+    numpy array, or a TensorFlow tensor if the reduction is only converted to a TensorFlow operator.
+    """
+    def __init__(self, x, kind, axis, arg, dtype, options):
+        if kind not in _kinds:
+            raise ValueError('Unknown reduction ' + str(kind) + '. Must be one of: ' + str(_kinds))
+
+        shape = [int(num_elements) for num_elements in x.shape]
+        if axis is None:
+            axis = 0
+            shape = [int(np.prod(shape))]
+            self._flatten = len(x.shape) != 1
+        else:
+            if not isinstance(axis, int) or axis < -len(shape) or axis >= len(shape):
+                raise ValueError('axis must be None or an int indexing one of the ' + str(len(shape)) +
+                                 ' axes of the tensor, but received: ' + str(axis))
+            axis %= len(shape)
+            self._flatten = False
+
+        if shape[axis] == 0:
+            raise ValueError('Cannot reduce an axis without elements')
+
+        if dtype is not None:
+            dtype = DType(dtype)
+
+        self._x = x
+        self._kind = kind
+        self._axis = axis
+        self._arg = arg
+        self._dtype = dtype
+        self._options = options
+        self._length = shape[axis]
+        self._num_outputs = int(np.prod(shape)) // shape[axis]
+
+    def _evaluate(self, chunks, x, evaluate):
+        # evaluate the stages one after another, feeding the partial results of each into the next
+        index = None
+        for stage_n, chunk in enumerate(chunks):
+            final = stage_n == len(chunks) - 1
+            constants = dict(self._options, kind=self._kind, axis=self._axis, chunk=chunk, final=final)
+            if not self._arg:
+                x = evaluate(_Reduce(x, dtype=self._dtype, **constants))
+            elif index is None:
+                x, index = evaluate(_ArgReduce(x, **constants))
+            else:
+                x, index = evaluate(_ArgCombine(x, index, **constants))
+
+        if self._arg:
+            return index
+        else:
+            return x
+
+    def _cpu_chunks(self):
+        workers_per_output = (_cpu_workers + self._num_outputs - 1) // self._num_outputs
+        fan_in = max((self._length + workers_per_output - 1) // workers_per_output, _cpu_min_chunk)
+        return _chunks(self._length, self._num_outputs, _cpu_workers, fan_in)
+
+    def _cuda_chunks(self):
+        return _chunks(self._length, self._num_outputs, _cuda_workers, _cuda_fan_in)
+
+    def _flat_input(self):
+        if self._flatten:
+            return np.reshape(self._x, [-1])
+        else:
+            return self._x
+
+    def evaluate_c(self):
+        """
+        Evaluate the reduction with the generated C++ operators.
+
+        :return: A numpy array with the reduced axis removed, or of shape [1] if no other axes are left. Arg
+            reductions return the int64 positions of the extremes along the axis.
+        """
+        return self._evaluate(self._cpu_chunks(), self._flat_input(), lambda op: op.evaluate_c())
+
+    def evaluate_cuda(self, cuda_threads_per_block=Operator._default_cuda_threads_per_block):
+        """
+        Evaluate the reduction with the generated CUDA operators.
+
+        :param cuda_threads_per_block: number of cuda threads to use per thread block
+        :return: A numpy array with the reduced axis removed, or of shape [1] if no other axes are left. Arg
+            reductions return the int64 positions of the extremes along the axis.
+        """
+        return self._evaluate(self._cuda_chunks(), self._flat_input(),
+                              lambda op: op.evaluate_cuda(cuda_threads_per_block=cuda_threads_per_block))
+
+    def as_tensorflow(self, cuda_threads_per_block=Operator._default_cuda_threads_per_block):
+        """
+        Create the TensorFlow operators of the stages of this reduction and register them with the current
+        TensorFlow Graph. The stages are split for the CUDA operators. Like other TensorFlow operators, they only
+        support float32 and float64 tensors, so neither arg reductions nor reductions of integers can be converted.
+
+        :param cuda_threads_per_block: number of cuda threads to use per thread block
+        :return: The TensorFlow tensor holding the result of the reduction.
+        :raises NotImplementedError: if the input or the result of the reduction is not of type float32 or float64
+        """
+        input_dtype = TensorType.like(self._x).dtype
+        if self._arg:
+            result_dtype = int64
+        elif self._dtype is not None:
+            result_dtype = self._dtype
+        else:
+            result_dtype = input_dtype
+        if input_dtype not in [float32, float64] or result_dtype not in [float32, float64]:
+            raise NotImplementedError('Only reductions of floats and doubles to floats and doubles can be converted '
+                                      'to TensorFlow, but received a reduction of ' + str(input_dtype) + ' to ' +
+                                      str(result_dtype) + '.')
+
+        x = self._x
+        if self._flatten:
+            import tensorflow as tf
+            x = tf.reshape(x, [-1])
+        return self._evaluate(self._cuda_chunks(), x,
+                              lambda op: op.as_tensorflow(cuda_threads_per_block=cuda_threads_per_block))
+
+
+def reduce_sum(x, axis=None, dtype=None, **options):
+    """
+    Sum the elements of a tensor along an axis.
+
+    :param x: The input tensor
+    :param axis: The axis to sum over, or None to sum all elements
+    :param dtype: The data type the elements are summed as, defaults to the type of the input
+    :param options: Options passed on to the operators which evaluate the reduction
+    :return: The Reduction
+    """
+    return Reduction(x, 'sum', axis, False, dtype, options)
+
+
+def reduce_max(x, axis=None, **options):
+    """
+    Find the maximum of the elements of a tensor along an axis.
+
+    :param x: The input tensor
+    :param axis: The axis to reduce, or None to reduce all elements
+    :param options: Options passed on to the operators which evaluate the reduction
+    :return: The Reduction
+    """
+    return Reduction(x, 'max', axis, False, None, options)
+
+
+def reduce_min(x, axis=None, **options):
+    """
+    Find the minimum of the elements of a tensor along an axis.
+
+    :param x: The input tensor
+    :param axis: The axis to reduce, or None to reduce all elements
+    :param options: Options passed on to the operators which evaluate the reduction
+    :return: The Reduction
+    """
+    return Reduction(x, 'min', axis, False, None, options)
+
+
+def reduce_argmax(x, axis=None, **options):
+    """
+    Find the position of the maximum of the elements of a tensor along an axis. Of equal maxima the first one is
+    found.
+
+    :param x: The input tensor
+    :param axis: The axis to reduce, or None to find the position in the flattened tensor
+    :param options: Options passed on to the operators which evaluate the reduction
+    :return: The Reduction
+    """
+    return Reduction(x, 'max', axis, True, None, options)
+
+
+def reduce_argmin(x, axis=None, **options):
+    """
+    Find the position of the minimum of the elements of a tensor along an axis. Of equal minima the first one is
+    found.
+
+    :param x: The input tensor
+    :param axis: The axis to reduce, or None to find the position in the flattened tensor
+    :param options: Options passed on to the operators which evaluate the reduction
+    :return: The Reduction
+    """
+    return Reduction(x, 'min', axis, True, None, options)
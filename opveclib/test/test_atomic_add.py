@@ -0,0 +1,105 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..local import cuda_enabled
+from ..expression import position_in, output, atomic_add, if_, uint32, int16
+
+
+class Histogram(Operator):
+    def op(self, x, num_bins):
+        pos = position_in(x.shape)
+        counts = output([num_bins], uint32)
+        atomic_add(counts, x[pos], 1)
+        return counts
+
+
+class ScatterPositive(Operator):
+    def op(self, x, index, num_bins):
+        pos = position_in(x.shape)
+        sums = output([num_bins], x.dtype)
+        with if_(x[pos] > 0):
+            atomic_add(sums, index[pos], x[pos])
+        return sums
+
+
+class AddToInput(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output(x.shape, x.dtype)
+        atomic_add(x, pos, 1)
+        return out
+
+
+class AddInt16(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output(x.shape, int16)
+        atomic_add(out, pos, 1)
+        return out
+
+
+class TestAtomicAdd(unittest.TestCase):
+    def test_generate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.zeros(100, dtype=np.uint32)
+
+        # the outputs which are added to are zeroed by the generic interfaces, and additions are only atomic when
+        # the workers are split across threads
+        op = Histogram(x, num_bins=10)
+        assert 'atomic_add(&(*out0)[' in op.op_c_src
+        assert '*address += value;' in op.op_c_src
+        assert 'memset(out0.p_arb_len, 0, 10*sizeof(uint32_t));' in op.op_c_generic
+        assert '#pragma omp simd' not in op.op_c_src
+        assert 'cuMemsetD8Async((CUdeviceptr)out0.p_arb_len, 0, 10*sizeof(uint32_t), stream)' in op.op_cuda_generic
+        assert 'atomicAdd((unsigned int *)address, (unsigned int)value)' in op.op_cuda_generic
+        assert '__atomic_fetch_add' in Histogram(x, num_bins=10, parallel_cpu=True).op_c_src
+
+        # additions within a conditional block are not turned into selections
+        src = ScatterPositive(np.zeros(100, dtype=np.float32), x, num_bins=10).op_c_src
+        assert 'if(' in src and 'atomic_add(' in src
+
+        with self.assertRaises(TypeError):
+            AddToInput(np.zeros(10, dtype=np.float32))
+        with self.assertRaises(TypeError):
+            AddInt16(np.zeros(10, dtype=np.float32))
+
+    def test_evaluate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        rng = np.random.RandomState(1)
+        index = rng.randint(0, 10, 10000).astype(np.uint32)
+        x = rng.uniform(-1, 1, 10000)
+        expected_counts = np.bincount(index, minlength=10)
+        expected_sums = np.bincount(index, weights=np.maximum(x, 0), minlength=10)
+
+        for parallel in [False, True]:
+            op = Histogram(index, num_bins=10, parallel_cpu=parallel)
+            assert np.array_equal(op.evaluate_c(), expected_counts)
+
+            # outputs are zeroed again for each evaluation
+            counts, times = op.evaluate_c(profiling_iterations=3)
+            assert np.array_equal(counts, expected_counts)
+
+            for dtype in [np.float32, np.float64]:
+                op = ScatterPositive(x.astype(dtype), index, num_bins=10, parallel_cpu=parallel)
+                assert np.allclose(op.evaluate_c(), expected_sums, rtol=1e-4)
+
+        if cuda_enabled:
+            assert np.array_equal(Histogram(index, num_bins=10).evaluate_cuda(), expected_counts)
+            for dtype in [np.float32, np.float64]:
+                op = ScatterPositive(x.astype(dtype), index, num_bins=10)
+                assert np.allclose(op.evaluate_cuda(), expected_sums, rtol=1e-4)
+
+if __name__ == '__main__':
+    unittest.main()
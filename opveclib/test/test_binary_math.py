@@ -13,7 +13,8 @@ import unittest
 import numpy as np
 from sys import _getframe
 from ..operator import Operator
-from ..expression import output_like, position_in, minimum, maximum, power, arctan2, logical_and, logical_or
+from ..expression import output_like, position_in, minimum, maximum, power, arctan2, logical_and, logical_or, \
+    where
 from ..local import cuda_enabled
 
 
@@ -98,6 +99,8 @@ class TestBinary(unittest.TestCase):
         gen(x, y, lambda a, b: a >= b, lambda a, b: np.greater_equal(a, b))
         gen(x, y, lambda a, b: minimum(a, b), lambda a, b: np.minimum(a, b))
         gen(x, y, lambda a, b: maximum(a, b), lambda a, b: np.maximum(a, b))
+        gen(x, y, lambda a, b: where(a < b, b, a), lambda a, b: np.where(a < b, b, a))
+        gen(x, y, lambda a, b: where(a, b, 1), lambda a, b: np.where(a != 0, b, 1))
 
         fp = [np.float32, np.float64]
         if dtype in fp:
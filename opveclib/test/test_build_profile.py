@@ -0,0 +1,49 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import os
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import position_in, output_like
+from ..local import cache_directory
+
+
+class Scale(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = x[pos]*2.0
+        return out
+
+
+class TestBuildProfile(unittest.TestCase):
+    def test(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.random(100)
+
+        # each profile is built as a separate library in the operator cache
+        for profile in ['debug', 'release', 'native', 'fast-math']:
+            op = Scale(x, build_profile=profile, clear_cache=True)
+            assert np.allclose(op.evaluate_c(), 2*x)
+            lib = op.op_name + '_generic_cpp_' + profile + '.so'
+            assert os.path.exists(os.path.join(cache_directory, lib))
+
+        try:
+            Scale(x, build_profile='fastest')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Unknown build profiles should be rejected')
+
+if __name__ == '__main__':
+    unittest.main()
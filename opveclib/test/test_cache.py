@@ -0,0 +1,157 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from sys import _getframe
+from ..cache import build_once, Manifest
+
+
+def _slow_build(tmp_path):
+    # record every build that is started, then write the file slowly
+    with open(os.path.join(os.path.dirname(tmp_path), 'builds'), 'a') as f:
+        f.write('.')
+    with open(tmp_path, 'w') as f:
+        f.write('partial')
+        f.flush()
+        time.sleep(0.2)
+        f.write(' complete')
+
+
+def _build_and_read(path):
+    with open(build_once(path, _slow_build)) as f:
+        return f.read()
+
+
+class TestCache(unittest.TestCase):
+    def test_build_once(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'lib.so')
+            pool = multiprocessing.Pool(4)
+            contents = pool.map(_build_and_read, [path]*8)
+            pool.close()
+            pool.join()
+
+            # every process sees the complete file, but it is only built once
+            assert contents == ['partial complete']*8
+            with open(os.path.join(directory, 'builds')) as f:
+                assert f.read() == '.'
+            assert sorted(os.listdir(directory)) == ['builds', 'lib.so', 'lib.so.lock']
+        finally:
+            shutil.rmtree(directory)
+
+    def test_failed_build(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'lib.so')
+
+            def failing_build(tmp_path):
+                with open(tmp_path, 'w') as f:
+                    f.write('partial')
+                raise RuntimeError()
+
+            try:
+                build_once(path, failing_build)
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError('Build errors should be raised')
+
+            # a failed build leaves neither the final nor the temporary file behind
+            assert sorted(os.listdir(directory)) == ['lib.so.lock']
+        finally:
+            shutil.rmtree(directory)
+
+    def test_manifest(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        directory = tempfile.mkdtemp()
+        try:
+            manifest = Manifest(directory, size_limit=250, touch_interval=0)
+
+            def build(name):
+                path = os.path.join(directory, name + '_generic_cpp_release.so')
+                build_once(path, lambda tmp_path: open(tmp_path, 'w').write('x'*100))
+                manifest.record(name, [path], 'release')
+
+            build('a')
+            build('b')
+            entry = manifest.entry('a')
+            assert entry['files'] == ['a_generic_cpp_release.so']
+            assert entry['size'] == 100
+            assert entry['profiles'] == ['release']
+
+            # using a makes b the least recently used operator, which is evicted once the limit is exceeded
+            time.sleep(0.01)
+            manifest.touch('a')
+            time.sleep(0.01)
+            build('c')
+            assert manifest.entry('b') is None
+            assert sorted(os.listdir(directory)) == ['a_generic_cpp_release.so', 'a_generic_cpp_release.so.lock',
+                                                     'c_generic_cpp_release.so', 'c_generic_cpp_release.so.lock',
+                                                     'manifest.json', 'manifest.json.lock', 'manifest.size']
+
+            # uses are appended to the log rather than rewriting the snapshot
+            snapshot_time = os.path.getmtime(manifest.path)
+            time.sleep(0.01)
+            manifest.touch('c')
+            assert os.path.getmtime(manifest.path) == snapshot_time
+            assert os.path.exists(manifest.log_path)
+
+            assert manifest.remove('a')
+            assert not manifest.remove('a')
+            assert not os.path.exists(os.path.join(directory, 'a_generic_cpp_release.so'))
+            assert manifest.entry('a') is None
+            assert manifest.entry('c') is not None
+        finally:
+            shutil.rmtree(directory)
+
+    def test_unindexed_files(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        directory = tempfile.mkdtemp()
+        try:
+            manifest = Manifest(directory, size_limit=250, touch_interval=0)
+
+            # operator files which were built before the manifest existed
+            old_name = 'f' + '0'*56
+            for extension in ['.so', '.cpp']:
+                with open(os.path.join(directory, old_name + '_generic_cpp_release' + extension), 'w') as f:
+                    f.write('x'*100)
+            older_name = 'f' + '1'*56
+            with open(os.path.join(directory, older_name + '_generic_cpp_release.so'), 'w') as f:
+                f.write('x'*100)
+            os.utime(os.path.join(directory, older_name + '_generic_cpp_release.so'), (0, 0))
+
+            # they are indexed when the manifest is first looked up, so that the least recently used ones are evicted
+            assert len(manifest.files(old_name)) == 2
+            path = os.path.join(directory, 'a_generic_cpp_release.so')
+            build_once(path, lambda tmp_path: open(tmp_path, 'w').write('x'*10))
+            manifest.record('a', [path], 'release')
+            assert manifest.entry(older_name) is None
+            assert manifest.entry(old_name)['size'] == 200
+            filenames = manifest.files(old_name)
+            assert sorted(filenames) == [old_name + '_generic_cpp_release.cpp', old_name + '_generic_cpp_release.so']
+
+            # and cleared like the files the manifest recorded
+            assert manifest.remove(old_name, filenames)
+            assert manifest.files(old_name) == []
+            assert not os.path.exists(os.path.join(directory, old_name + '_generic_cpp_release.so'))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
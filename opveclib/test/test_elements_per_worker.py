@@ -0,0 +1,75 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..local import cuda_enabled
+from ..expression import position_in, output_like, cast
+
+
+class AddPosition(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = x[pos] + cast(10*pos[0] + pos[len(x.shape)-1], x.dtype)
+        return out
+
+
+def _reference(x):
+    rows, cols = np.indices(x.shape[:1] + x.shape[-1:])
+    return x + (10*rows + cols).reshape(x.shape[:1] + (1,)*(len(x.shape)-2) + x.shape[-1:])
+
+
+class TestElementsPerWorker(unittest.TestCase):
+    def test_generate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.zeros((3, 5, 10), dtype=np.float32)
+
+        # by default each cuda thread covers a single worker
+        src = AddPosition(x).op_cuda_generic
+        assert 'if (worker_index < 150)' in src
+        assert 'worker_inner' not in src
+
+        # coarsened threads cover consecutive chunks of 4 positions of each row, the last one the remaining 2
+        src = AddPosition(x, elements_per_worker=4).op_cuda_generic
+        assert 'if (worker_index < 45)' in src
+        assert 'uint32_t num_blocks = 45 / threads_per_block;' in src
+        assert 'const uint32_t worker_row = worker_index / 3;' in src
+        assert 'const uint32_t worker_position_0 = (worker_row)/5;' in src
+        assert 'const uint32_t worker_inner_begin = (worker_index % 3)*4;' in src
+        assert 'const uint32_t worker_inner_end = 10 - worker_inner_begin < 4 ? 10 : worker_inner_begin + 4;' in src
+        assert 'position[3] = {worker_position_0, worker_position_1, worker_inner}' in src
+
+        # a chunk never exceeds a row
+        src = AddPosition(np.zeros(7, dtype=np.float32), elements_per_worker=100).op_cuda_generic
+        assert 'if (worker_index < 1)' in src
+        assert 'worker_inner_end = 7 - worker_inner_begin < 7 ? 7 : worker_inner_begin + 7;' in src
+
+        # the position is only decomposed from the worker index on the CPU
+        c_src = AddPosition(np.zeros(7, dtype=np.float32), elements_per_worker=4).op_c_src
+        assert 'worker_inner' not in c_src
+
+        with self.assertRaises(ValueError):
+            AddPosition(x, elements_per_worker=0)
+
+    def test_evaluate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, (3, 5, 10)).astype(np.float32)
+        for k in [1, 3, 4, 10, 16]:
+            op = AddPosition(x, elements_per_worker=k, clear_cache=True)
+            assert np.allclose(op.evaluate_c(), _reference(x))
+            if cuda_enabled:
+                assert np.allclose(op.evaluate_cuda(), _reference(x))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -349,6 +349,11 @@ class TestTensorExpression(unittest.TestCase):
 
         catch_error(lambda x: _to_scalar_index(target_shape, x), _EndIf, TypeError)
 
+        # indices are computed in 32 bits unless the tensor has too many elements to be addressed by them
+        assert _to_scalar_index(target_shape, [variable(0, int64), 0]).dtype == uint32
+        assert _to_scalar_index((2**16, 2**16), [variable(0, int64), 0]).dtype == uint32
+        assert _to_scalar_index((2**16, 2**16 + 1), [variable(0, int64), 0]).dtype == uint64
+
     def test_unary_math(self):
         print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
         ExpressionDAG.clear()
@@ -0,0 +1,71 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from sys import _getframe
+
+# imports opveclib and evaluates an operator on numpy arrays in a fresh interpreter, then reports the time the
+# import took and whether TensorFlow has been loaded
+_script = """
+from __future__ import print_function
+import sys
+import time
+start = time.time()
+import opveclib
+import_time = time.time() - start
+import numpy as np
+
+class Double(opveclib.Operator):
+    def op(self, x):
+        pos = opveclib.position_in(x.shape)
+        out = opveclib.output_like(x)
+        out[pos] = 2*x[pos]
+        return out
+
+x = np.arange(5, dtype=np.float32)
+assert np.allclose(Double(x).evaluate_c(), 2*x)
+print(import_time, 'tensorflow' in sys.modules)
+"""
+
+
+class TestImportTime(unittest.TestCase):
+    def test(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        package_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.check_output([sys.executable, '-c', _script], cwd=package_directory,
+                                         universal_newlines=True)
+        import_time, tensorflow_loaded = output.split()[-2:]
+        print('import opveclib took ' + str(float(import_time)*1000) + ' ms')
+
+        # numpy-only users must not pay for importing TensorFlow
+        assert tensorflow_loaded == 'False'
+
+    def test_empty_home(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        package_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        home = tempfile.mkdtemp()
+        try:
+            # the cache directory and the language module are created by the first import
+            env = dict(os.environ, HOME=home)
+            env.pop('OPVECLIB_HOME', None)
+            subprocess.check_output([sys.executable, '-c', _script], cwd=package_directory, env=env,
+                                    universal_newlines=True)
+            assert os.path.isdir(os.path.join(home, '.opveclib'))
+        finally:
+            shutil.rmtree(home)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import ExpressionDAG, PositionTensor, position_in, output_like, input, output, float32, uint32, \
+    uint64
+
+
+class Double(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = 2*x[pos]
+        return out
+
+
+def _double_dag(shape):
+    # the dag of an operator which doubles a tensor of a shape, which is too large to be evaluated in the tests
+    ExpressionDAG.clear()
+    x = input(shape, float32)
+    pos = position_in(shape)
+    out = output(shape, float32)
+    out[pos] = 2*x[pos]
+    dag = ExpressionDAG.as_proto()
+    ExpressionDAG.clear()
+    return dag
+
+
+class TestLargeWorkgroup(unittest.TestCase):
+    def test_position(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        ExpressionDAG.clear()
+        assert PositionTensor([2**16, 2**16 - 1]).dtype == uint32
+        ExpressionDAG.clear()
+        pos = PositionTensor([2**16, 2**16])
+        ExpressionDAG.clear()
+        assert pos.dtype == uint64
+        assert PositionTensor.from_proto(pos.proto_expr, []).proto_expr == pos.proto_expr
+        ExpressionDAG.clear()
+
+    def test_generate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        # workgroups which fit in 32 bits are indexed with them
+        c_src, c_generic = ExpressionDAG.generate_c(_double_dag([1000]), 'double_small', 4)
+        assert 'uint32_t worker_index' in c_src
+        assert 'uint64_t' not in c_src
+
+        # larger workgroups switch the worker index and the position to 64 bits, on both the CPU and the GPU
+        dag = _double_dag([10**10])
+        assert list(dag.workgroup_shape) == [10**10]
+        c_src, c_generic = ExpressionDAG.generate_c(dag, 'double_large', 4)
+        assert 'uint64_t worker_begin, uint64_t worker_end' in c_src
+        assert 'uint64_t worker_index' in c_src
+        assert 'const uint64_t position[1]' in c_src
+        assert 'const uint64_t chunk_size' in c_generic
+
+        cuda_src, cuda_launch_template, cuda_generic = ExpressionDAG.generate_cuda(dag, 'double_large')
+        assert 'uint64_t worker_index = (uint64_t)blockIdx.x' in cuda_src
+        assert 'if (worker_index < 10000000000)' in cuda_src
+
+    def test_evaluate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.arange(11, dtype=np.float32)
+        assert np.allclose(Double(x, clear_cache=True).evaluate_c(), 2*x)
+
+if __name__ == '__main__':
+    unittest.main()
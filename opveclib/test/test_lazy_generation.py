@@ -0,0 +1,68 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import position_in, output_like
+
+
+class Square(Operator):
+    grad_interpretations = 0
+
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = x[pos]*x[pos]
+
+        return out
+
+    def grad(self, x, dout):
+        Square.grad_interpretations += 1
+        pos = position_in(x.shape)
+        dx = output_like(x)
+        dx[pos] = 2*x[pos]*dout[pos]
+
+        return dx
+
+
+class TestLazyGeneration(unittest.TestCase):
+    def test(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, 7)
+        op = Square(x, clear_cache=True)
+
+        # constructing and evaluating the operator neither interprets the gradient nor generates CUDA code
+        assert np.allclose(op.evaluate_c(), x*x)
+        assert Square.grad_interpretations == 0
+        assert ('op', 'C++') in op._lazy
+        assert ('op', 'CUDA') not in op._lazy
+
+        # the gradient is interpreted once it is first accessed, and only its C++ code is generated
+        assert op.grad_name is not None
+        assert Square.grad_interpretations == 1
+        assert op.grad_name + '_generic_cpp' in op.grad_c_generic
+        assert ('grad', 'CUDA') not in op._lazy
+        assert op.grad_name is not None
+        assert Square.grad_interpretations == 1
+
+        # a copy without the inputs shares the interpreted gradient and can build its libraries
+        copy = op._without_inputs()
+        assert copy._inputs is None and op._inputs is not None
+        assert copy.grad_name == op.grad_name
+        assert Square.grad_interpretations == 1
+        cpu_grad_name, cpu_grad_lib, gpu_grad_name, gpu_grad_lib = copy._build_gradient()
+        assert cpu_grad_name == op.grad_name + '_generic_cpp'
+        assert cpu_grad_lib == Operator._generic_c_path(op.grad_name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import os
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..local import version
+from ..expression import position_in, output_like
+
+
+class Negate(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = -x[pos]
+
+        return out
+
+
+class TestLibraryHandles(unittest.TestCase):
+    def test(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, 11).astype(np.float32)
+        op = Negate(x, clear_cache=True)
+
+        # the operator library is loaded once and reused by every evaluation
+        result, times = op.evaluate_c(profiling_iterations=20)
+        assert np.allclose(result, -x)
+        assert np.all(times >= 0)
+        assert np.allclose(op.evaluate_c(), -x)
+
+        # clearing the cache releases the loaded library, so the rebuilt one is loaded in its place
+        lib_path = Operator._generic_c_path(op.op_name, profile=op._build_profile)
+        assert os.path.exists(lib_path)
+        cleared = Negate(x, clear_cache=True)
+        assert not os.path.exists(lib_path)
+        assert np.allclose(cleared.evaluate_c(), -x)
+        assert os.path.exists(lib_path)
+
+    def test_support_libraries(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        # libraries built from the sources of the package are keyed on their sources, not only the version
+        test_c_path = Operator._support_library_path('libtestcop', ['testcop.cc', 'language.proto'])
+        assert os.path.basename(test_c_path).startswith('libtestcop.so.' + version + '.')
+        assert test_c_path == Operator._support_library_path('libtestcop', ['testcop.cc', 'language.proto'])
+        assert test_c_path != Operator._support_library_path('libtestcop', ['testcop.cc'])
+
+        Negate(np.zeros(3, dtype=np.float32)).evaluate_c()
+        assert os.path.exists(Operator._support_library_path(
+            'libtestcop', ['testcop.cc', 'dynamiclibop.h', 'libraryregistry.h', 'language.proto']))
+
+    def test_compile_results(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        # the results of background builds are only kept while the builds are in progress
+        for size in [5, 6, 7]:
+            op = Negate(np.zeros(size, dtype=np.float32), clear_cache=True)
+            for library, path, function, args in op._library_builds(['op']):
+                Operator._compile_async(function, args).get()
+                assert os.path.exists(path)
+        assert all(args[0] == op.op_name for function, args in Operator._compile_results)
+
+if __name__ == '__main__':
+    unittest.main()
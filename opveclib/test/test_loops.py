@@ -0,0 +1,124 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..local import cuda_enabled
+from ..expression import position_in, output, variable, cast, arange, if_, while_, break_, continue_, lang, uint32
+
+
+class Halvings(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        y = variable(x[pos], x.dtype)
+        count = variable(0, uint32)
+        with while_(y >= 1):
+            y <<= y/2
+            count <<= count + 1
+        out = output(x.shape, uint32)
+        out[pos] = count
+        return out
+
+
+class FirstNegative(Operator):
+    def op(self, x):
+        pos = position_in(x.shape[0])
+        first = variable(x.shape[1], uint32)
+        for i in arange(x.shape[1]):
+            with if_(x[pos[0], i] < 0):
+                first <<= cast(i, uint32)
+                break_()
+        out = output(x.shape[0], uint32)
+        out[pos] = first
+        return out
+
+
+class SumPositive(Operator):
+    def op(self, x):
+        pos = position_in(x.shape[0])
+        accum = variable(0, x.dtype)
+        for i in arange(x.shape[1]):
+            with if_(x[pos[0], i] <= 0):
+                continue_()
+            accum <<= accum + x[pos[0], i]
+        out = output(x.shape[0], x.dtype)
+        out[pos] = accum
+        return out
+
+
+class BreakOutsideLoop(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output(x.shape, x.dtype)
+        with if_(x[pos] < 0):
+            break_()
+        out[pos] = x[pos]
+        return out
+
+
+class ConstantWhile(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output(x.shape, x.dtype)
+        with while_(True):
+            out[pos] = x[pos]
+        return out
+
+
+def _codes(op):
+    return [expr.code for expr in op.op_expression_dag.expressions]
+
+
+class TestLoops(unittest.TestCase):
+    def test_generate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.zeros((4, 16), dtype=np.float32)
+
+        # the condition of a while loop is evaluated again at the beginning of each iteration
+        src = Halvings(x).op_c_src
+        assert 'while(1){' in src
+        assert src.index('while(1){') < src.index('break;')
+
+        # ranges which are left early are neither unrolled nor strength reduced
+        for op in [FirstNegative(x, unroll_factor=4), SumPositive(x, unroll_factor=4)]:
+            codes = _codes(op)
+            assert codes.count(lang.RANGE) == 1
+            assert codes.count(lang.VARIABLE) == 2
+        assert lang.BREAK in _codes(FirstNegative(x))
+        assert lang.CONTINUE in _codes(SumPositive(x))
+
+        with self.assertRaises(SyntaxError):
+            BreakOutsideLoop(x)
+        with self.assertRaises(TypeError):
+            ConstantWhile(x)
+
+    def test_evaluate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        rng = np.random.RandomState(1)
+        x = rng.uniform(0, 100, (4, 16)).astype(np.float32)
+        halvings = np.where(x >= 1, np.floor(np.log2(np.maximum(x, 1))) + 1, 0)
+
+        x_signed = rng.uniform(-0.2, 1, (20, 16)).astype(np.float32)
+        first_negative = np.where((x_signed < 0).any(axis=1), np.argmax(x_signed < 0, axis=1), 16)
+        sum_positive = np.where(x_signed > 0, x_signed, 0).sum(axis=1)
+
+        results = [(Halvings(x), halvings),
+                   (FirstNegative(x_signed), first_negative),
+                   (SumPositive(x_signed), sum_positive)]
+        for op, expected in results:
+            assert np.allclose(op.evaluate_c(), expected)
+            if cuda_enabled:
+                assert np.allclose(op.evaluate_cuda(), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import position_in, output_like
+
+
+class Offset(Operator):
+    interpretations = 0
+
+    def op(self, x, offset):
+        Offset.interpretations += 1
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = x[pos] + offset
+        return out
+
+
+class TestMemoize(unittest.TestCase):
+    def test(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.random(10)
+        y = np.random.random(10)
+
+        first = Offset(x, offset=1.0)
+        count = Offset.interpretations
+
+        # same class, input types and constants reuses the interpreted operator
+        second = Offset(y, offset=1.0)
+        assert Offset.interpretations == count
+        assert second.op_expression_dag is first.op_expression_dag
+        assert np.allclose(second.evaluate_c(), y + 1)
+
+        # any difference in input types or constants interprets the operator again
+        Offset(x.astype(np.float32), offset=1.0)
+        assert Offset.interpretations == count + 1
+        third = Offset(x, offset=2.0)
+        assert Offset.interpretations == count + 2
+        assert third.op_name != first.op_name
+        assert np.allclose(third.evaluate_c(), x + 2)
+
+        # constants which compare equal but differ in type are interpreted separately
+        integer = Offset(x, offset=1)
+        assert Offset.interpretations == count + 3
+        assert integer.op_name != first.op_name
+        assert Offset(x, offset=1.0).op_name == first.op_name
+
+    def test_size(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.random(10)
+        memo_size = Operator._memo_size
+        Operator._memo_size = 2
+        try:
+            # only the most recently used operators are kept
+            Offset(x, offset=10.0)
+            Offset(x, offset=11.0)
+            Offset(x, offset=10.0)
+            Offset(x, offset=12.0)
+            assert len(Operator._memo) == 2
+            count = Offset.interpretations
+            Offset(x, offset=10.0)
+            assert Offset.interpretations == count
+            Offset(x, offset=11.0)
+            assert Offset.interpretations == count + 1
+        finally:
+            Operator._memo_size = memo_size
+
+if __name__ == '__main__':
+    unittest.main()
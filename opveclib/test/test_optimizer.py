@@ -0,0 +1,437 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import ExpressionDAG, position_in, output_like, input, output, cast, variable, arange, if_, elif_, \
+    else_, zeros, minimum, maximum, where, lang, _ConstScalar, int32, int64, uint32, float32
+from ..optimizer import fold_constants, eliminate_common_subexpressions, eliminate_dead_code, \
+    hoist_loop_invariants, reduce_index_strength, select_branches
+
+
+def _codes(expression_dag):
+    return [expr.code for expr in expression_dag.expressions]
+
+
+def _range_body(expression_dag, n):
+    # the codes of the expressions in the body of the n-th range
+    codes = _codes(expression_dag)
+    start = [i for i, code in enumerate(codes) if code == lang.RANGE][n]
+    depth = 0
+    for i in range(start, len(codes)):
+        depth += {lang.RANGE: 1, lang.ENDRANGE: -1}.get(codes[i], 0)
+        if depth == 0:
+            return codes[start+1:i]
+
+
+class ConstantArithmetic(Operator):
+    def op(self, x, width=5):
+        pos = position_in(x.shape)
+        out = output_like(x)
+
+        # shifted and wrapped index, whose constant offsets are merged
+        shifted = cast(pos[0] - (width-1)//2 + width*x.shape[0], int32)
+        a = x[shifted % x.shape[0]]
+
+        # constant subexpressions with C semantics for negative integer division and modulo
+        seven = variable(-7, int32) + 0
+        quotient = cast(seven*0 - 7, float32)
+        b = a*1.0 - 0.0 + cast(seven, float32)/1.0
+        out[pos] = b + quotient
+        return out
+
+
+class SquaredDistance(Operator):
+    def op(self, data, center):
+        pos = position_in([data.shape[1], center.shape[1]])
+        out = output([data.shape[1], center.shape[1]], data.dtype)
+
+        dist = variable(0, data.dtype)
+        previous = variable(0, data.dtype)
+        total = variable(0, data.dtype)
+        before = dist + previous
+        for i in arange(data.shape[0]):
+            # the variables of the sum are assigned to later in the loop, so it cannot be merged with the one before
+            # the loop
+            total <<= total + (dist + previous)
+
+            # the difference is written twice, but must only be read and computed once
+            dist <<= dist + (data[i, pos[0]] - center[i, pos[1]])*(data[i, pos[0]] - center[i, pos[1]])
+            previous <<= dist
+
+        out[pos] = before + total
+        return out
+
+
+class RowSum(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output([x.shape[0]], x.dtype)
+
+        # neither the local tensor nor the counter are ever read
+        unused = zeros([4], x.dtype)
+        unused[1] = x[pos[0], 0]
+        count = variable(0, x.dtype)
+
+        total = variable(0, x.dtype)
+        for i in arange(x.shape[1]):
+            count <<= count + 1
+            total <<= total + x[pos[0], i]
+        with if_(total > 100):
+            count <<= 0
+
+        out[pos[0]] = total
+        return out
+
+
+class MinDistance(Operator):
+    def op(self, data, center):
+        pos = position_in([data.shape[1]])
+        out = output([data.shape[1]], data.dtype)
+
+        best = variable(1e30, data.dtype)
+        for j in arange(center.shape[1]):
+            # the column of the sample and the index of the center do not change in the inner loop
+            dist = variable(0, data.dtype)
+            for i in arange(data.shape[0]):
+                diff = data[i, pos[0]] - center[i, j]
+                dist <<= dist + diff*diff
+            with if_(dist < best):
+                best <<= dist
+
+        out[pos] = best
+        return out
+
+
+class ReversedDot(Operator):
+    def op(self, x, y):
+        pos = position_in([x.shape[0], y.shape[1]])
+        out = output([x.shape[0], y.shape[1]], x.dtype)
+
+        # the indices of both inputs advance by a constant stride, backwards through the shared dimension
+        total = variable(0, x.dtype)
+        for k in arange(x.shape[1]-1, -1, -1):
+            total <<= total + x[pos[0], k]*y[k, pos[1]]
+
+        out[pos] = total
+        return out
+
+
+class Smooth(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+
+        # sum over a 3x3 neighborhood, clamped to the edges
+        total = variable(0, x.dtype)
+        for i in arange(3):
+            for j in arange(3):
+                row = minimum(maximum(cast(pos[0], int64) + i - 1, 0), x.shape[0] - 1)
+                column = minimum(maximum(cast(pos[1], int64) + j - 1, 0), x.shape[1] - 1)
+                total <<= total + x[row, column]
+
+        out[pos] = total
+        return out
+
+
+class RowMoment(Operator):
+    def op(self, x):
+        pos = position_in([x.shape[0]])
+        out = output([x.shape[0]], x.dtype)
+
+        total = variable(0, x.dtype)
+        for i in arange(x.shape[1]):
+            total <<= total + x[pos[0], i]*cast(i, x.dtype)
+
+        out[pos] = total
+        return out
+
+
+class ZeroStep(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+
+        count = variable(0, x.dtype)
+        for i in arange(5, 0, 0):
+            count <<= count + 1
+
+        out[pos] = count
+        return out
+
+
+class Sign(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+
+        sign = variable(0, x.dtype)
+        with if_(x[pos] > 0):
+            sign <<= 1
+        with elif_(x[pos] < 0):
+            sign <<= -1
+
+        # every branch assigns the same element of the output
+        with if_(x[pos] < -0.5):
+            out[pos] = sign - 0.5
+        with elif_(x[pos] > 0.5):
+            out[pos] = sign + 0.5
+        with else_():
+            out[pos] = sign
+        return out
+
+
+class Shift(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+
+        # the read is out of bounds unless the branch is taken
+        value = variable(0, x.dtype)
+        with if_(pos[0] < x.shape[0] - 1):
+            value <<= x[pos[0] + 1]
+
+        # the output is only assigned in the branch
+        with if_(value > 0):
+            out[pos] = value
+        return out
+
+
+class TestOptimizer(unittest.TestCase):
+    def test_fold_constants(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        ExpressionDAG.clear()
+        x = input([10], float32)
+        pos = position_in([10])
+        out = output([10], float32)
+        index = cast(pos[0], uint32) + 3 - 3
+        y = cast(cast(_ConstScalar(2), int32)*5 + 1, float32)
+        out[index*1] = x[pos[0]]*1 + y
+        dag = ExpressionDAG.as_proto()
+        ExpressionDAG.clear()
+
+        folded = fold_constants(dag)
+        codes = _codes(folded)
+        assert len(codes) < len(_codes(dag))
+
+        # the constant subexpression is replaced by its value
+        assert lang.MULTIPLY not in codes
+        assert codes.count(lang.ADD) == 1
+        assert 11.0 in [expr.double_data[0] for expr in folded.expressions if expr.dtype == lang.FLOAT64]
+
+        # the identity casts, the offsets which cancel out and the multiplications by one are removed. The position
+        # is already a uint32 like the indices, so only the cast of the folded constant remains.
+        assert lang.SUBTRACT not in codes
+        assert codes.count(lang.CAST) == 1
+
+        # the folded dag can be rebuilt
+        ExpressionDAG.from_proto(folded)
+        ExpressionDAG.clear()
+
+    def test_variables(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        ExpressionDAG.clear()
+        pos = position_in([1])
+        out = output([2], int32)
+        v = variable(1, int32)
+        snapshot = v + 0
+        v <<= 5
+        out[0] = snapshot
+        out[1] = v*0
+        dag = ExpressionDAG.as_proto()
+        ExpressionDAG.clear()
+
+        # variables change when they are assigned to, so identities must not replace expressions by them
+        folded = fold_constants(dag)
+        assert lang.ADD in _codes(folded)
+        assert lang.MULTIPLY not in _codes(folded)
+
+    def test_evaluate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.arange(7, dtype=np.float32)
+        op = ConstantArithmetic(x, clear_cache=True)
+        assert np.allclose(op.evaluate_c(), np.roll(x, -5) - 14)
+
+    def test_common_subexpressions(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        ExpressionDAG.clear()
+        x = input([10], float32)
+        pos = position_in([10])
+        out = output([10], float32)
+        v = variable(0, float32)
+        v <<= x[pos[0]] + 1
+        a = x[pos[0]] + v
+        b = v + x[pos[0]]
+        v <<= a*b
+        c = x[pos[0]] + v
+        out[pos[0]] = a + b + c
+        dag = ExpressionDAG.as_proto()
+        ExpressionDAG.clear()
+
+        # the position and the input are read once, and the sum is only recomputed after the variable was assigned to
+        codes = _codes(eliminate_common_subexpressions(dag))
+        assert _codes(dag).count(lang.READ_TENSOR) == 9
+        assert codes.count(lang.READ_TENSOR) == 2
+        assert _codes(dag).count(lang.ADD) == 6
+        assert codes.count(lang.ADD) == 5
+
+        rng = np.random.RandomState(1)
+        data = rng.uniform(-1, 1, [3, 4]).astype(np.float32)
+        center = rng.uniform(-1, 1, [3, 2]).astype(np.float32)
+        # the range is not unrolled, so that the assignments in its body are repeated
+        op = SquaredDistance(data, center, clear_cache=True, unroll_factor=0)
+        codes = _codes(op.op_expression_dag)
+        assert codes.count(lang.SUBTRACT) == 1
+
+        dist = np.cumsum((data[:, :, np.newaxis] - center[:, np.newaxis, :])**2, axis=0)
+        assert np.allclose(op.evaluate_c(), 2*np.sum(dist[:-1], axis=0))
+
+    def test_dead_code(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, [5, 3]).astype(np.float32)
+        op = RowSum(x, clear_cache=True, unroll_factor=0)
+
+        # only the loop which accumulates the total is left, along with the variable which holds the index of the
+        # input in it
+        dag = op.op_expression_dag
+        codes = _codes(dag)
+        assert lang.TENSOR not in codes
+        assert lang.IF not in codes
+        assert codes.count(lang.VARIABLE) == 3
+        assert codes.count(lang.ASSIGN_VARIABLE) == 3
+        assert _codes(eliminate_dead_code(dag)) == codes
+
+        # only the first dimension of the position is computed
+        assert 'position[2] = {worker_position_0, 0}' in op.op_c_src
+        assert np.allclose(op.evaluate_c(), np.sum(x, axis=1))
+
+    def test_loop_invariants(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        ExpressionDAG.clear()
+        x = input([10], float32)
+        pos = position_in([4])
+        out = output([4], float32)
+        total = variable(0, float32)
+        for i in arange(10):
+            total <<= total + x[pos[0]]*x[i]
+        count = variable(3, int32)
+        for i in arange(count):
+            total <<= total + x[pos[0]]
+        out[pos] = total
+        dag = fold_constants(ExpressionDAG.as_proto())
+        ExpressionDAG.clear()
+
+        # the reads of the position and of the input at it move out of the first range, but reading them in
+        # front of the second range would read them even if the range is empty
+        hoisted = hoist_loop_invariants(dag)
+        assert len(hoisted.expressions) == len(dag.expressions)
+        assert _range_body(dag, 0).count(lang.READ_TENSOR) == 3
+        assert _range_body(hoisted, 0).count(lang.READ_TENSOR) == 1
+        assert _range_body(hoisted, 1).count(lang.READ_TENSOR) == 2
+        ExpressionDAG.from_proto(hoisted)
+        ExpressionDAG.clear()
+
+        rng = np.random.RandomState(1)
+        data = rng.uniform(-1, 1, [3, 5]).astype(np.float32)
+        center = rng.uniform(-1, 1, [3, 4]).astype(np.float32)
+        op = MinDistance(data, center, clear_cache=True, unroll_factor=0)
+
+        # no index arithmetic is left in the inner range, only the reads and the distance
+        body = _range_body(op.op_expression_dag, 1)
+        assert lang.CAST not in body
+        assert body.count(lang.MULTIPLY) == 1
+        dist = np.sum((data[:, :, np.newaxis] - center[:, np.newaxis, :])**2, axis=0)
+        assert np.allclose(op.evaluate_c(), np.min(dist, axis=1))
+
+    def test_index_strength(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        rng = np.random.RandomState(1)
+        x = rng.uniform(-1, 1, [4, 5]).astype(np.float32)
+        y = rng.uniform(-1, 1, [5, 3]).astype(np.float32)
+        op = ReversedDot(x, y, clear_cache=True, unroll_factor=0)
+
+        # both inputs are read at variables which are advanced at the end of each iteration, rather than at
+        # indices which are multiplied out from the range index
+        dag = op.op_expression_dag
+        body = _range_body(dag, 0)
+        assert lang.MULTIPLY not in body[:body.index(lang.READ_TENSOR)]
+        for expr, refs in zip(dag.expressions, dag.references):
+            if expr.code == lang.READ_TENSOR and dag.expressions[refs.operand_indices[0]].code == lang.INPUT:
+                assert dag.expressions[refs.operand_indices[1]].code == lang.VARIABLE
+        assert body.count(lang.ASSIGN_VARIABLE) == 3
+        assert _codes(reduce_index_strength(dag)) == _codes(dag)
+        assert np.allclose(op.evaluate_c(), np.dot(x, y))
+
+    def test_unroll(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, [6, 5]).astype(np.float32)
+        op = Smooth(x, clear_cache=True)
+
+        # small ranges are replaced by straight line code
+        assert lang.RANGE not in _codes(op.op_expression_dag)
+        padded = np.pad(x, 1, mode='edge')
+        assert np.allclose(op.evaluate_c(), sum(padded[i:i+6, j:j+5] for i in range(3) for j in range(3)))
+
+        # larger ones repeat their body in each iteration, and the iterations which remain follow the range. Besides
+        # the position, the input is read four times in the range and three times after it.
+        y = np.random.RandomState(1).uniform(-1, 1, [4, 103]).astype(np.float32)
+        moment = np.sum(y*np.arange(103), axis=1)
+        op = RowMoment(y, clear_cache=True, unroll_factor=4)
+        codes = _codes(op.op_expression_dag)
+        assert codes.count(lang.RANGE) == 1
+        assert _range_body(op.op_expression_dag, 0).count(lang.READ_TENSOR) == 4
+        assert codes.count(lang.READ_TENSOR) == 1 + 4 + 3
+        assert np.allclose(op.evaluate_c(), moment)
+
+        # the direction of a constant step is not tested at run time
+        op = RowMoment(y, clear_cache=True, unroll_factor=1)
+        assert _range_body(op.op_expression_dag, 0).count(lang.READ_TENSOR) == 1
+        assert '>0)) ||' not in op.op_c_src
+        assert np.allclose(op.evaluate_c(), moment)
+
+        # a range with a constant step of zero runs no iterations
+        for unroll_factor in [0, 4]:
+            op = ZeroStep(np.ones(4, dtype=np.int32), clear_cache=True, unroll_factor=unroll_factor)
+            assert np.array_equal(op.evaluate_c(), [0, 0, 0, 0])
+
+        try:
+            RowMoment(y, unroll_factor=-1)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Negative unroll factors should be rejected')
+
+    def test_select_branches(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, 50).astype(np.float32)
+        x[:3] = 0
+        op = Sign(x, clear_cache=True)
+
+        # the branches of both blocks are replaced by selections, and the second assigns the output once. A variable
+        # assigned in the second branch is only selected if the condition of the first does not hold.
+        codes = _codes(op.op_expression_dag)
+        assert lang.IF not in codes
+        assert codes.count(lang.WHERE) == 3 + 2
+        assert codes.count(lang.ASSIGN_TENSOR) == 1
+        assert np.allclose(op.evaluate_c(), np.sign(x) + np.where(x < -0.5, -0.5, np.where(x > 0.5, 0.5, 0)))
+
+        # selections evaluate their branches whether they are taken or not
+        op = Shift(x, clear_cache=True)
+        dag = op.op_expression_dag
+        assert _codes(dag).count(lang.IF) == 2
+        assert _codes(select_branches(dag)) == _codes(dag)
+        shifted = np.append(x[1:], 0)
+        assert np.allclose(op.evaluate_c()[shifted > 0], shifted[shifted > 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import position_in, output_like, arange, variable, cast
+
+
+class Cumulative(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+
+        accum = variable(0.0, x.dtype)
+        for i in arange(pos[1]+1):
+            accum <<= accum + x[pos[0], i]
+        out[pos] = accum
+
+        return out
+
+
+class AddPosition(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = x[pos] + cast(100*pos[0] + 10*pos[1] + pos[2], x.dtype)
+
+        return out
+
+
+class TestParallelCPU(unittest.TestCase):
+    def test(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        rng = np.random.RandomState(1)
+        x = rng.uniform(-1, 1, (37, 11))
+        op_np = np.cumsum(x, axis=1)
+
+        serial = Cumulative(x, clear_cache=True).evaluate_c()
+        assert np.allclose(serial, op_np)
+
+        # more threads than workers, an uneven split and all available cores
+        for num_threads in [1000, 3, 0]:
+            op = Cumulative(x, parallel_cpu=True, cpu_threads=num_threads, clear_cache=True)
+            assert np.allclose(op.evaluate_c(), op_np)
+
+        try:
+            Cumulative(x, parallel_cpu=True, cpu_threads=-1)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Negative thread counts should be rejected')
+
+    def test_nested_position(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, (3, 4, 5))
+        op_np = x + np.arange(3)[:, None, None]*100 + np.arange(4)[None, :, None]*10 + np.arange(5)
+
+        # the workers are covered by a loop over the innermost dimension of the position, which the chunks of an
+        # uneven split start and end in the middle of
+        for parallel_cpu, num_threads in [(False, 1), (True, 7), (True, 13)]:
+            op = AddPosition(x, parallel_cpu=parallel_cpu, cpu_threads=num_threads, clear_cache=True)
+            assert 'position[3] = {worker_position_0, worker_position_1, worker_inner}' in op.op_c_src
+            assert np.allclose(op.evaluate_c(), op_np)
+
+if __name__ == '__main__':
+    unittest.main()
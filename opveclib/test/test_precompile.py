@@ -0,0 +1,64 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import os
+import sys
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import position_in, output_like, TensorType, float32, float64
+from ..precompile import precompile
+
+
+class Shift(Operator):
+    precompile_signatures = [(TensorType([10], float32),),
+                             (TensorType([3, 4], float64), {'amount': 2.0})]
+
+    def op(self, x, amount=1.0):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = x[pos] + amount
+
+        return out
+
+
+class Undeclared(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = x[pos]
+
+        return out
+
+
+class TestPrecompile(unittest.TestCase):
+    def test(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        report = precompile([sys.modules[__name__]], jobs=2)
+
+        built = [entry for entry in report if entry['operator'].endswith('Shift') and entry.get('library') == 'C++']
+        assert len(built) == 2
+        for entry in built:
+            assert entry['status'] == 'built'
+            assert os.path.exists(entry['path'])
+        assert built[1]['signature']['inputs'] == [{'shape': [3, 4], 'dtype': 'float64'}]
+
+        skipped = [entry for entry in report if entry['operator'].endswith('Undeclared')]
+        assert len(skipped) == 1
+        assert skipped[0]['status'] == 'skipped'
+
+        # evaluating a precompiled signature uses the library that has been built
+        x = np.arange(12, dtype=np.float64).reshape((3, 4))
+        assert np.allclose(Shift(x, amount=2.0).evaluate_c(), x + 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
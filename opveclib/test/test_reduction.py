@@ -0,0 +1,79 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..local import cuda_enabled
+from ..expression import uint64
+from ..reduction import _chunks, reduce_sum, reduce_max, reduce_min, reduce_argmax, reduce_argmin
+
+
+class TestReduction(unittest.TestCase):
+    def test_chunks(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        # an axis is only split while there are too few outputs to keep the workers busy
+        assert _chunks(1000, 100, 64, 16) == [1000]
+        assert _chunks(10, 1, 64, 16) == [10]
+        assert _chunks(1000, 1, 64, 16) == [16, 16, 4]
+        assert _chunks(4096, 1, 64, 16) == [16, 16, 16]
+
+    def test_reduce(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        rng = np.random.RandomState(1)
+        functions = [(reduce_sum, np.sum), (reduce_max, np.max), (reduce_min, np.min),
+                     (reduce_argmax, np.argmax), (reduce_argmin, np.argmin)]
+        for shape in [(7,), (20000,), (3, 5000), (5000, 3), (2, 3, 700)]:
+            x = rng.uniform(-1, 1, shape).astype(np.float32)
+            for axis in [None, -1] + list(range(len(shape))):
+                for function, np_function in functions:
+                    reduction = function(x, axis)
+                    expected = np_function(x, axis=axis)
+                    results = [reduction.evaluate_c()]
+                    if cuda_enabled:
+                        results.append(reduction.evaluate_cuda())
+                    for result in results:
+                        assert np.allclose(result.reshape(np.shape(expected)), expected, rtol=1e-4, atol=1e-4)
+
+        # the first of equal extremes is found, also across chunks
+        x = rng.randint(0, 3, (4, 3000)).astype(np.int32)
+        assert np.array_equal(reduce_argmax(x, 1).evaluate_c(), np.argmax(x, 1))
+        assert np.array_equal(reduce_argmin(x).evaluate_c(), [np.argmin(x)])
+
+    def test_sum_dtype(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.full(100000, 2**31, dtype=np.uint32)
+        assert reduce_sum(x).evaluate_c()[0] == 0
+        assert reduce_sum(x, dtype=np.uint64).evaluate_c()[0] == 100000*2**31
+        assert reduce_sum(x, dtype=uint64).evaluate_c().dtype == np.uint64
+
+        with self.assertRaises(ValueError):
+            reduce_sum(x, axis=1)
+        with self.assertRaises(ValueError):
+            reduce_max(np.zeros((3, 0), dtype=np.float32), axis=1)
+
+    def test_tensorflow_dtypes(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        # TensorFlow operators only support floats and doubles, which is checked before any of them is created
+        x = np.zeros((3, 4), dtype=np.float32)
+        for function in [reduce_argmax, reduce_argmin]:
+            with self.assertRaises(NotImplementedError):
+                function(x, 1).as_tensorflow()
+        for function in [reduce_sum, reduce_max, reduce_min]:
+            with self.assertRaises(NotImplementedError):
+                function(x.astype(np.uint64), 1).as_tensorflow()
+        with self.assertRaises(NotImplementedError):
+            reduce_sum(x, dtype=np.int32).as_tensorflow()
+        with self.assertRaises(NotImplementedError):
+            reduce_sum(x.astype(np.int32), dtype=np.float32).as_tensorflow()
+
+if __name__ == '__main__':
+    unittest.main()
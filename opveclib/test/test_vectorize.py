@@ -0,0 +1,104 @@
+# Copyright 2016 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from __future__ import print_function
+import unittest
+import numpy as np
+from sys import _getframe
+from ..operator import Operator
+from ..expression import position_in, output_like, output
+
+
+class Scale(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[pos] = 2*x[pos]
+        return out
+
+
+class LastOfRow(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output([x.shape[0]], x.dtype)
+        out[pos[0]] = x[pos]
+        return out
+
+
+class PairsOfRow(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output([x.shape[0], x.shape[1]//2], x.dtype)
+        out[pos[0], pos[1]/2] = x[pos]
+        return out
+
+
+class Scatter(Operator):
+    def op(self, x, index):
+        pos = position_in(x.shape)
+        out = output_like(x)
+        out[index[pos]] = x[pos]
+        return out
+
+
+class Neighbors(Operator):
+    def op(self, x):
+        pos = position_in(x.shape)
+        out = output([x.shape[0] + 1], x.dtype)
+        out[pos[0]] = x[pos]
+        out[pos[0] + 1] = -x[pos]
+        return out
+
+
+class TestVectorize(unittest.TestCase):
+    def test_generate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.zeros((4, 100), dtype=np.float32)
+
+        # the io tensors never alias, and elementwise workers are independent
+        src = Scale(x).op_c_src
+        assert 'const float (* __restrict__ in0)[400], float (* __restrict__ out0)[400]' in src
+        assert '#pragma omp simd\n        for(uint32_t worker_inner' in src
+        assert '__builtin_unreachable' not in src
+        assert '    //loops over the workers\n    for(uint32_t worker_index=0;' in src
+
+        # the rows covered by a thread are only known at run time
+        src = Scale(x, parallel_cpu=True).op_c_src
+        assert 'if(worker_position_0 >= 4) __builtin_unreachable();' in src
+
+        # the workers of a row all write the same output element
+        assert '#pragma omp simd' not in LastOfRow(x).op_c_src
+
+        # adjacent workers write the same output element
+        assert '#pragma omp simd' not in PairsOfRow(x).op_c_src
+
+        # the elements written depend on the data
+        y = np.zeros(100, dtype=np.float32)
+        assert '#pragma omp simd' not in Scatter(y, np.arange(100, dtype=np.uint32)).op_c_src
+
+        # each worker writes an element its neighbor writes as well
+        assert '#pragma omp simd' not in Neighbors(y).op_c_src
+
+    def test_evaluate(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+        x = np.random.RandomState(1).uniform(-1, 1, (4, 100)).astype(np.float32)
+        for parallel in [False, True]:
+            op = Scale(x, parallel_cpu=parallel, build_profile='release', clear_cache=True)
+            result = op.evaluate_c()
+            assert np.allclose(result, 2*x)
+            assert result.ctypes.data % 64 == 0
+            assert op.vectorized_c()
+
+        op = Scale(x, build_profile='debug', clear_cache=True)
+        assert np.allclose(op.evaluate_c(), 2*x)
+        assert not op.vectorized_c()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -113,6 +113,69 @@ class TestIntegration(unittest.TestCase):
         assert np.allclose(eval2, np2)
         assert np.allclose(eval3, np3)
 
+    def test_background_build(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+
+        class ScaleOp(Operator):
+            def op(self, x, factor):
+                pos = position_in(x.shape)
+                out = output_like(x)
+                out[pos] = x[pos]*factor
+                return out
+
+        in0 = np.random.random(5).astype(np.float32)
+
+        # the libraries of all three operators build concurrently while the graph is constructed
+        with tf.Session() as sess:
+            with tf.device('/cpu:0'):
+                outputs = [ScaleOp(in0, factor=float(factor), clear_cache=True).as_tensorflow(wait_for_build=False)
+                           for factor in range(3)]
+            Operator.wait_for_builds()
+            results = sess.run(outputs)
+
+        for factor, result in enumerate(results):
+            assert np.allclose(result, in0*factor)
+
+    def test_deferred_gradient(self):
+        print('*** Running Test: ' + self.__class__.__name__ + ' function: ' + _getframe().f_code.co_name)
+
+        class CubeOp(Operator):
+            def op(self, x):
+                pos = position_in(x.shape)
+                out = output_like(x)
+                out[pos] = x[pos]*x[pos]*x[pos]
+                return out
+
+            def grad(self, x, dout):
+                pos = position_in(x.shape)
+                dx = output_like(x)
+                dx[pos] = 3*x[pos]*x[pos]*dout[pos]
+                return dx
+
+        in0 = np.random.random(5).astype(np.float32)
+
+        # the gradient is named by its content, and only a copy of the operator without its inputs is kept until
+        # TensorFlow asks for the gradient, after which it is dropped
+        with tf.Session() as sess:
+            with tf.device('/cpu:0'):
+                x = tf.constant(in0)
+                op = CubeOp(x, clear_cache=True)
+                y = op.as_tensorflow()
+                assert Operator._deferred_gradients[op.grad_name]._inputs is None
+                grad = tf.gradients(y, x)[0]
+            assert op.grad_name not in Operator._deferred_gradients
+            assert np.allclose(sess.run(grad), 3*in0*in0)
+
+        # a gradient which was neither built nor converted in this process cannot be resolved
+        with tf.Session() as sess:
+            with tf.device('/cpu:0'):
+                x = tf.constant(in0)
+                op = CubeOp(x, clear_cache=True)
+                y = op.as_tensorflow()
+                Operator._deferred_gradients.pop(op.grad_name)
+                with self.assertRaises(RuntimeError):
+                    tf.gradients(y, x)
+
 
 if __name__ == '__main__':
     unittest.main()
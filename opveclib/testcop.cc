@@ -11,8 +11,12 @@
 #include <dlfcn.h>
 #include <iostream>
 #include <memory>
+#include <mutex>
+#include <set>
+#include <string>
 #include <chrono>
 #include "dynamiclibop.h"
+#include "libraryregistry.h"
 #include "language.pb.h"
 
 typedef uint16_t
@@ -25,6 +29,28 @@ struct TensorParam {
     size_t len;
 };
 
+// Operator libraries which have been run by the test harness. The harness keeps a reference to each of them in the
+// library registry, so that repeated evaluations do not load them again.
+static std::mutex testLibrariesMutex;
+static std::set<std::string> testLibraries;
+
+static void* testFunction(const char *opLibPath, const char *opFuncName) {
+    std::lock_guard<std::mutex> lock(testLibrariesMutex);
+    if (testLibraries.count(opLibPath) == 0) {
+        if (!LibraryRegistry::instance().acquire(opLibPath)) return nullptr;
+        testLibraries.insert(opLibPath);
+    }
+    return LibraryRegistry::instance().function(opLibPath, opFuncName);
+}
+
+// Release the reference of the test harness to an operator library, so that it is loaded again the next time it is
+// run. This must be called before a library is removed or rebuilt.
+extern "C"
+void testReleaseLibrary(const char *opLibPath) {
+    std::lock_guard<std::mutex> lock(testLibrariesMutex);
+    if (testLibraries.erase(opLibPath) > 0) LibraryRegistry::instance().release(opLibPath);
+}
+
 // Function which can run the fxxx_generic_cpp function from the
 // operator generated library for testing
 extern "C"
@@ -160,21 +186,14 @@ int32_t testCOperator(const char *opLibPath, const char *opFuncName,
     // load the operator library
 //    std::cout << "loading function " <<  opFuncName << '\n';
 //    std::cout << "from " <<  opLibPath << '\n';
-    static_assert(sizeof(void *) == sizeof(void (*)(void)),
-                      "object pointer and function pointer sizes must equal");
-    void *handle = dlopen(opLibPath, RTLD_LAZY);
-    if (handle == nullptr) {
-        std::cerr << "***ERROR - Unable to find operator library " << opLibPath << '\n';
+    // resolve the function and cast it from void* to a function pointer
+    void *f = testFunction(opLibPath, opFuncName);
+    if (f == nullptr) {
+        std::cerr << "***ERROR - Unable to find operator function " << opFuncName
+                  << " in library " << opLibPath << '\n';
         return 1;
     }
-
-    // load the function and cast it from void* to a function pointer
-    void *f = dlsym(handle, opFuncName);
     C_FUNPTR func_ = reinterpret_cast<C_FUNPTR>(f);
-    if (handle == nullptr) {
-        std::cerr << "***ERROR - Unable to find operator function " << opFuncName << '\n';
-        return 1;
-    }
 
     // call the test library function
     // time the execution in milliseconds
@@ -17,7 +17,7 @@ setup(
     packages=['opveclib', 'opveclib.test', 'opveclib.test_tensorflow', 'opveclib.examples'],
     install_requires=['numpy >= 1.11.0', 'protobuf >= 3.0.0a3', 'tensorflow==0.8.0', 'six >= 1.10.0',],
     package_data={
-        'opveclib': ['dynamiclibop.h', 'dynamiclibop.cc', 'testcop.cc', 'testcudaop.cc']
+        'opveclib': ['dynamiclibop.h', 'dynamiclibop.cc', 'libraryregistry.h', 'testcop.cc', 'testcudaop.cc']
     },
     test_suite='nose2.collector.collector',
     license='Apache 2.0'